@@ -0,0 +1,65 @@
+'''
+Selection of date partitions of a store directory.
+
+HistoryStore and TargetStore store every day's entries in a YYYY-MM-DD directory under
+HISTORY_DIR and TARGET_DIR. Selecting only the partitions within a date window before
+recommend starts means its cost depends on the window, and not on how much older data
+has piled up.
+'''
+from __future__ import print_function
+import datetime
+import os
+import os.path
+import re
+
+PARTITION_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def window_start(since=None, days=None, today=None):
+    '''
+    Returns the first date of a window as a YYYY-MM-DD string, or None if the window is unbounded.
+
+    since: a YYYY-MM-DD date.
+    days: number of days up to and including today.
+    '''
+    if since is not None:
+        # Validates the date.
+        return datetime.datetime.strptime(since, DATE_FORMAT).strftime(DATE_FORMAT)
+
+    if days is not None:
+        if days < 1:
+            raise ValueError('Number of days should be at least 1')
+        today = today or datetime.date.today()
+        return (today - datetime.timedelta(days=days - 1)).strftime(DATE_FORMAT)
+
+    return None
+
+
+def select_partitions(data_dir, since=None, days=None, today=None):
+    '''
+    Returns the full paths of date partitions under data_dir that fall in the window,
+    in date order.
+    '''
+    start = window_start(since, days, today)
+
+    partitions = sorted(p for p in os.listdir(data_dir)
+                        if PARTITION_PATTERN.match(p) and os.path.isdir(os.path.join(data_dir, p)))
+
+    if start is not None:
+        # YYYY-MM-DD strings sort in date order.
+        partitions = [ p for p in partitions if p >= start ]
+
+    return [ os.path.join(data_dir, p) for p in partitions ]
+
+
+def glob_path(partition_paths):
+    '''
+    Returns a single Hadoop glob path that matches exactly the given partitions
+    of a data directory, for passing to Spark.
+    '''
+    if len(partition_paths) == 1:
+        return partition_paths[0]
+
+    data_dir = os.path.dirname(partition_paths[0])
+    return os.path.join(data_dir, '{' + ','.join(os.path.basename(p) for p in partition_paths) + '}')
@@ -0,0 +1,112 @@
+from __future__ import print_function
+import hashlib
+import os
+import os.path
+import re
+import sqlite3
+import threading
+
+from storage_backends import iter_partition_entries
+
+
+class DedupIndex(object):
+    '''
+    A persistent index of everything ever stored under a data directory (HISTORY_DIR or
+    TARGET_DIR), across all its date partitions.
+
+    Entries are keyed both by URL and by a hash of their contents, so that an item
+    is recognized as already stored regardless of which day it was stored on, and
+    even if the same text turns up again under a different URL.
+
+    The index is a SQLite database in the data directory itself. Its name starts with
+    an underscore so that Spark skips it when it's pointed at the data directory.
+    If the database doesn't exist yet, it's built by scanning all existing date
+    partitions, so deleting it is a safe way to reset it.
+
+    Only entries that actually have some contents are indexed. An entry whose fetch
+    failed and got stored with empty contents can be fetched again another day.
+    '''
+
+    INDEX_FILE = '_dedup_index.sqlite'
+    PARTITION_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+
+        index_filename = os.path.join(data_dir, self.INDEX_FILE)
+        needs_rebuild = not os.path.exists(index_filename)
+
+        # Stores may be called from multiple fetcher threads, so the connection
+        # is shared and serialized with a lock.
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(index_filename, check_same_thread=False)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS entries (
+            url TEXT PRIMARY KEY,
+            content_hash TEXT,
+            partition TEXT,
+            id TEXT)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entries_content_hash ON entries (content_hash)')
+        self.conn.commit()
+
+        if needs_rebuild:
+            self.rebuild()
+
+
+    def rebuild(self):
+        print('Building dedup index for', self.data_dir)
+        count = 0
+        for partition in sorted(os.listdir(self.data_dir)):
+            partition_path = os.path.join(self.data_dir, partition)
+            if not self.PARTITION_PATTERN.match(partition) or not os.path.isdir(partition_path):
+                continue
+
+            entries = list(iter_partition_entries(partition_path))
+            self.add(partition, entries)
+            count += len(entries)
+
+        print('Dedup index built from %d stored entries' % (count))
+
+
+    def seen(self, entry):
+        '''
+        Returns True if an entry with the same URL or the same contents
+        has been stored on any date.
+        '''
+        with self.lock:
+            if self.conn.execute('SELECT 1 FROM entries WHERE url = ?', (entry['url'],)).fetchone():
+                return True
+
+            contents = entry.get('contents', None)
+            if contents:
+                row = self.conn.execute('SELECT 1 FROM entries WHERE content_hash = ?',
+                    (self.content_hash(contents),)).fetchone()
+                if row:
+                    return True
+
+        return False
+
+
+    def seen_url(self, url):
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM entries WHERE url = ?', (url,)).fetchone() is not None
+
+
+    def add(self, partition, entries):
+        rows = [ (e['url'], self.content_hash(e['contents']), partition, e['id'])
+                    for e in entries if e.get('url', None) and e.get('contents', None) ]
+        if not rows:
+            return
+
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO entries VALUES (?,?,?,?)', rows)
+            self.conn.commit()
+
+
+    def content_hash(self, contents):
+        return hashlib.sha1(contents.encode('utf-8')).hexdigest()
+
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
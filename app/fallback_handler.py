@@ -2,7 +2,7 @@ from __future__ import print_function
 
 class FallbackHandler(object):
     def __init__(self):
-        pass
+        self.name = 'fallback-handler'
 
     def conf_init(self, app_conf):
         self.app_conf = app_conf
@@ -0,0 +1,95 @@
+from __future__ import print_function
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class FetchPool(object):
+    '''
+    Fetches URLs concurrently using a bounded pool of worker threads.
+
+    All workers share a single requests.Session, so connections to a host are kept
+    alive and reused instead of being set up again for every URL.
+
+    Since most handlers talk to just one or two sites, hammering a site with all workers
+    at once is a good way to get throttled or banned. So besides the total number of
+    workers, the number of requests in flight to any single host is also limited.
+    With a request_limit (see request_scheduler.py), requests are also rate limited,
+    and transient failures are retried.
+    '''
+
+    DEFAULT_MAX_WORKERS = 8
+    DEFAULT_MAX_PER_HOST = 4
+    DEFAULT_TIMEOUT = 30    # Seconds
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, max_per_host=DEFAULT_MAX_PER_HOST, request_limit=None):
+        self.max_workers = max(1, int(max_workers))
+        self.max_per_host = max(1, int(max_per_host))
+        self.request_limit = request_limit
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.host_semaphores = {}
+        self.host_semaphores_lock = threading.Lock()
+
+
+    def fetch_all(self, urls):
+        '''
+        Fetches all URLs and yields their results in the order they complete,
+        so that caller can process and store each one as soon as it arrives.
+
+        urls:
+            an iterable of (key, url) tuples. The key is any object that caller
+            wants to get back along with the result of that URL.
+
+        Yields (key, response, error) tuples. If the request failed, response is None
+        and error is the exception.
+        '''
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+            for key, url in urls:
+                futures[executor.submit(self.fetch, url)] = key
+
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    resp = future.result()
+                except Exception as e:
+                    yield key, None, e
+                else:
+                    yield key, resp, None
+
+
+    def fetch(self, url):
+        if self.request_limit is not None:
+            return self.request_limit.call(self.get, url)
+        return self.get(url)
+
+
+    def get(self, url):
+        # The host's slot is held only during the request, not while waiting to retry.
+        with self.get_host_semaphore(url):
+            resp = self.session.get(url, timeout=self.DEFAULT_TIMEOUT)
+            resp.raise_for_status()
+            return resp
+
+
+    def get_host_semaphore(self, url):
+        host = urlparse(url).netloc
+        with self.host_semaphores_lock:
+            semaphore = self.host_semaphores.get(host, None)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.max_per_host)
+                self.host_semaphores[host] = semaphore
+
+        return semaphore
+
+
+    def close(self):
+        self.session.close()
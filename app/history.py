@@ -1,16 +1,15 @@
 from __future__ import print_function
-import json
-import importlib
-import importlib.util
-import os
 from urllib.parse import urlparse
 import sys
 import traceback
 from collections import Counter
 
 import history_handlers
+import request_scheduler
+from parse_pool import parse_pool
 from history_handlers import history_handlers as handlers
 from fallback_handler import FallbackHandler
+from json_stream import iter_json_array
 
 
 class HistoryProcessor(object):
@@ -22,26 +21,33 @@ class HistoryProcessor(object):
     nothing. But if user instead wishes to simply fetch any remaining URL, it can
     be implemented there.
     
-    As of now, this class does not do any kind of deduplication of history items.
+    This class itself does not do any kind of deduplication of history items.
     So even if an entry was in yesterday's history file and is in today's file too, it'll
-    still handle the entry like it's a new one. 
-    Changing this behavior by deduplicating entries and processing only new entries
-    will be considered in the future.
+    still hand the entry over to its handler like it's a new one. 
+    If DEDUP_INDEX is enabled in conf.yml, HistoryStore recognizes entries stored on any
+    earlier date, and handlers that check already_stored() skip fetching them.
     '''
-    def __init__(self, app_conf):
+    def __init__(self, app_conf, metrics=None):
+        '''
+        metrics: (Optional) a metrics.Metrics that records the calls of every handler.
+        '''
         self.app_conf = app_conf
+        request_scheduler.scheduler.conf_init(self.app_conf)
+        parse_pool.conf_init(self.app_conf)
         handlers.conf_init(self.app_conf)
         self.load_handlers()
 
         self.fallback_handler = FallbackHandler()
         self.fallback_handler.conf_init(self.app_conf)
         
+        if metrics is not None:
+            for handler in handlers.handlers + [self.fallback_handler]:
+                metrics.instrument_handler(handler, ['handle', 'completed'])
+        
     def load_handlers(self):
-        # The handler plugins loaded here register themselves with history_handlers.HistoryHandlers.
-        plugin_files = os.listdir('history_handlers')
-        for plugin_file in plugin_files:
-            if not plugin_file.startswith('__'):
-                importlib.import_module('history_handlers.' + plugin_file[0:-3])
+        # Plugins are registered from the manifest in history_handlers/__init__.py, 
+        # and imported only when they're first needed.
+        handlers.load_plugins()
 
         
     def process_history(self, filepath, history_store):
@@ -51,35 +57,14 @@ class HistoryProcessor(object):
         #   or store all entries in a database
         # - support HDFS paths
         
-        with open(filepath, 'r') as history_file:
-            history = json.load(history_file)
-            
         domain_counts = Counter()
-            
-        for entry in history:
-            urlparts = urlparse(entry['url'])
-            entry['scheme'] = urlparts.scheme
-            entry['domain'] = urlparts.netloc
-            entry['path'] = urlparts.path
-            entry['params'] = urlparts.params
-            entry['query'] = urlparts.query
-            entry['fragment'] = urlparts.fragment
-            
-            domain_counts.update({entry['domain'] : 1})
-            
-            handled = False
-            try:
-                for handler in handlers.handlers:
-                    if handler.handle(entry, history_store):
-                        handled = True
-                        break
-                
-                if not handled:
-                    self.fallback_handler.handle(entry, history_store)
-            except:
-                # No need to stop all processing if one URL fails.
-                print('\n\n\nERROR: Could not process history entry %s\n\tReason:%s\n\n\n' % (
-                    entry['url'], traceback.print_exc() ) )
+        
+        # The history file is parsed as a stream, and each entry is handed over 
+        # to handlers as soon as it's parsed, so that even a history export spanning 
+        # years doesn't have to fit in memory.
+        with open(filepath, 'r') as history_file:
+            for entry in iter_json_array(history_file):
+                self.process_entry(entry, history_store, domain_counts)
             
         for handler in handlers.handlers:
             try:
@@ -95,9 +80,30 @@ class HistoryProcessor(object):
             # No need to stop all processing if one URL fails.
             print('\n\n\nERROR: Could not complete fallback processing\n\tReason:%s\n\n\n' % (
                 traceback.print_exc() ) )
+        
+        # Parse workers aren't needed again until the next history file.
+        parse_pool.close()
                 
         print('\n\nBrowsing History domain counts:')
         for domain,count in domain_counts.most_common():
             print(domain, ':', count)
 
-    
+
+    def process_entry(self, entry, history_store, domain_counts):
+        urlparts = urlparse(entry['url'])
+        entry['scheme'] = urlparts.scheme
+        entry['domain'] = urlparts.netloc
+        entry['path'] = urlparts.path
+        entry['params'] = urlparts.params
+        entry['query'] = urlparts.query
+        entry['fragment'] = urlparts.fragment
+        
+        domain_counts.update({entry['domain'] : 1})
+        
+        try:
+            if not handlers.dispatch(entry, history_store):
+                self.fallback_handler.handle(entry, history_store)
+        except:
+            # No need to stop all processing if one URL fails.
+            print('\n\n\nERROR: Could not process history entry %s\n\tReason:%s\n\n\n' % (
+                entry['url'], traceback.print_exc() ) )
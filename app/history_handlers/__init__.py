@@ -1,14 +1,163 @@
 from __future__ import print_function
+import importlib
+import os
+import os.path
+from urllib.parse import parse_qs
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Plugins of this package, and the domains and paths whose entries they handle.
+# They're registered from here without being imported. A plugin's module is imported
+# only when the first entry is dispatched to it, so that, say, uploading history without
+# any YouTube URLs doesn't load the YouTube API client at all.
+#
+# Any other module in this directory is imported at startup, and should register its
+# handler itself, like:
+#   history_handlers.history_handlers.register(MyHandler(), domains=['www.example.com'])
+PLUGINS = [
+    { 'module' : 'hn_handler', 'class' : 'HackerNewsHistoryHandler', 'name' : 'hn-history-handler',
+      'domains' : ['news.ycombinator.com'], 'paths' : ['/item'] },
+    { 'module' : 'youtube_handler', 'class' : 'YoutubeHistoryHandler', 'name' : 'youtube-history-handler',
+      'domains' : ['www.youtube.com'] },
+    { 'module' : 'sample_handler', 'class' : 'SampleHandler', 'name' : 'sample-handler' },
+]
+
 
 class HistoryHandlers(object):
+    '''
+    Registrar of history handler plugins, and dispatcher of history entries to them.
+
+    A handler can declare the domains, and optionally the paths within those domains,
+    whose entries it wants. Such handlers are put in a dispatch table keyed by
+    (domain, path), so that each entry is offered to only the few handlers
+    routed to its domain and path, instead of to every registered handler.
+
+    Handlers that don't declare any domains are catch-all handlers. They're offered
+    every entry that was not accepted by any routed handler.
+    '''
     def __init__(self):
         self.handlers = []
-        
+
+        # (domain, path) -> [handlers]. A path of None means any path in that domain.
+        self.routes = {}
+        self.catch_all_handlers = []
+        self.plugins_loaded = False
+
     def conf_init(self, app_conf):
         self.app_conf = app_conf
+        for handler in self.handlers:
+            handler.conf_init(app_conf)
+
+    def load_plugins(self):
+        '''
+        Registers the plugins in PLUGINS, and imports all other modules in this directory.
+        Plugins are loaded only once per process.
+        '''
+        if self.plugins_loaded:
+            return
+        self.plugins_loaded = True
 
-    def register(self, handler):
+        for plugin in PLUGINS:
+            handler = LazyHandler(__name__ + '.' + plugin['module'], plugin['class'], plugin['name'])
+            self.register(handler, plugin.get('domains', None), plugin.get('paths', None))
+
+        manifest_modules = set(plugin['module'] for plugin in PLUGINS)
+        for plugin_file in sorted(os.listdir(PLUGIN_DIR)):
+            module_name, ext = os.path.splitext(plugin_file)
+            if ext == '.py' and not module_name.startswith('__') and module_name not in manifest_modules:
+                importlib.import_module(__name__ + '.' + module_name)
+
+    def register(self, handler, domains=None, paths=None):
+        '''
+        handler: the handler instance.
+
+        domains: (Optional) list of domains (like 'www.youtube.com') whose entries
+            this handler handles. If not given, the handler is a catch-all handler.
+
+        paths: (Optional) list of URL paths (like '/item') within those domains.
+            If not given, the handler is offered entries with any path in its domains.
+        '''
         self.handlers.append(handler)
+
+        if domains:
+            for domain in domains:
+                for path in (paths or [None]):
+                    self.routes.setdefault((domain, path), []).append(handler)
+        else:
+            self.catch_all_handlers.append(handler)
+
         handler.conf_init(self.app_conf)
 
+    def dispatch(self, entry, history_store):
+        '''
+        Offers the entry to handlers routed to its domain and path, then to handlers
+        routed to its domain, and finally to catch-all handlers, until one of them
+        accepts it.
+
+        Returns True if some handler accepted the entry.
+        '''
+        domain = entry['domain']
+        for route in ((domain, entry['path']), (domain, None)):
+            for handler in self.routes.get(route, ()):
+                if handler.handle(entry, history_store):
+                    return True
+
+        for handler in self.catch_all_handlers:
+            if handler.handle(entry, history_store):
+                return True
+
+        return False
+
+
+class LazyHandler(object):
+    '''
+    Stands in for a plugin's handler until the first entry is dispatched to it, 
+    and only then imports the plugin and creates the handler.
+    '''
+    def __init__(self, module_name, class_name, name):
+        self.module_name = module_name
+        self.class_name = class_name
+        self.name = name
+        self.app_conf = None
+        self.handler = None
+
+    def conf_init(self, app_conf):
+        self.app_conf = app_conf
+        if self.handler is not None:
+            self.handler.conf_init(app_conf)
+
+    def load(self):
+        if self.handler is None:
+            module = importlib.import_module(self.module_name)
+            handler = getattr(module, self.class_name)()
+            handler.conf_init(self.app_conf)
+            self.handler = handler
+
+        return self.handler
+
+    def handle(self, entry, history_store):
+        return self.load().handle(entry, history_store)
+
+    def completed(self, history_store):
+        # If it was never loaded, no entries were dispatched to it, and there's nothing to complete.
+        if self.handler is not None:
+            self.handler.completed(history_store)
+
+
+def get_query_params(entry):
+    '''
+    Returns the entry's query string parsed by parse_qs. It's parsed only once per entry
+    however many handlers ask for it.
+
+    The parsed query is cached in the entry under '_query_params'. Like all keys starting
+    with an underscore, it's not saved by HistoryStore.
+    '''
+    query_params = entry.get('_query_params', None)
+    if query_params is None:
+        query_params = parse_qs(entry['query'])
+        entry['_query_params'] = query_params
+
+    return query_params
+
+
 history_handlers = HistoryHandlers()
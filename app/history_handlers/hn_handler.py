@@ -1,10 +1,32 @@
 from __future__ import print_function
-from bs4 import BeautifulSoup
-import requests
-from urllib.parse import parse_qs
+import functools
 import time
 
 import history_handlers 
+import request_scheduler
+from fetch_pool import FetchPool
+from html_extract import TextExtractor, resolve_parser
+from parse_pool import parse_pool
+from store_writer import StoreWriter
+
+# parser name -> TextExtractor, in each process that extracts comments.
+_extractors = {}
+
+
+def extract_comments(content, parser='auto'):
+    '''
+    Returns the text of all comments of an item page, joined into one string.
+
+    This is the handler's extract function, run in parse pool worker processes
+    (see parse_pool.py), which each set up their own extractor on first use.
+    '''
+    extractor = _extractors.get(parser, None)
+    if extractor is None:
+        # Comments are in <div class='comment'>.
+        # Each such div has an unwanted <div class='reply'>, whose text is left out.
+        extractor = _extractors[parser] = TextExtractor('div', 'comment', exclude_class='reply', parser=parser)
+    return ' '.join(extractor.extract(content))
+
 
 class HackerNewsHistoryHandler(object):
     '''
@@ -13,68 +35,110 @@ class HackerNewsHistoryHandler(object):
     HN has an API, but since it involves multiple requests to fetch each comment,
     it seems simpler to just scrape a discussion URL. The DOM is also easy enough
     to process.
+    
+    Item URLs are only queued in handle(). They are all fetched concurrently once
+    the 'completed' notification is received from HistoryProcessor, using a bounded
+    pool of workers that share keep-alive connections. Each item's contents are handed
+    to the parse pool as soon as they arrive, which extracts the comments in worker
+    processes on all cores. The comments are then handed to a StoreWriter, which stores 
+    them in batches in the background. Requests are rate limited and retried as configured for 'hn'
+    in RATE_LIMITS (see request_scheduler.py).
+    
+    conf.yml attributes (all optional):
+        HN_FETCH_WORKERS: number of items fetched concurrently. Default is 8.
+        HN_MAX_REQUESTS_PER_HOST: max number of requests in flight to any single host. Default is 4.
+        HTML_PARSER: parser used to extract comments (see html_extract.py). Default is 'auto'.
+        PARSE_WORKERS: number of processes extracting comments (see parse_pool.py). Default is the number of CPUs.
+        HN_BASE_URL: scheme and host that item URLs are fetched from instead of 
+            https://news.ycombinator.com, like a local stand-in server for benchmarks.
     '''
     def __init__(self):
         self.name = 'hn-history-handler'
-        #self.entries_to_fetch = []
+        self.entries_to_fetch = []
         self.store_path = None
         
     def conf_init(self, app_conf):
         self.app_conf = app_conf
         
+        # Fails here rather than in every worker if the configured parser isn't installed.
+        parser = resolve_parser(app_conf.get('HTML_PARSER', 'auto'))
+        self.extract = functools.partial(extract_comments, parser=parser)
+        
 
     def handle(self, entry, history_store):
-        if entry['domain'] == 'news.ycombinator.com':
-            if entry['path'] == '/item':
-                queries = parse_qs(entry['query'])
-                item_id = queries.get('id', None)
-                if item_id:
-                    item_id = item_id[0]
-                    print("HN plugin: Handling item id=", item_id)
+        # Only news.ycombinator.com/item entries are routed to this handler.
+        item_id = history_handlers.get_query_params(entry).get('id', None)
+        if item_id:
+            item_id = item_id[0]
+            print("HN plugin: Handling item id=", item_id)
 
-                    if not self.store_path:
-                        self.store_path = history_store.prepare_to_store(self.name)
+            if not self.store_path:
+                self.store_path = history_store.prepare_to_store(self.name)
 
-                    #self.entries_to_fetch.append(entry)
-
-                    if not history_store.already_stored(self.name, entry, self.store_path):
-                        try:
-                            self.fetch_contents(entry)
-                            
-                        except:
-                            print('Error fetching: ', entry['url'])
-                        else:
-                            history_store.store_content(self.name, [entry], self.store_path)
-                    
-                    else:
-                        print("HN plugin: Already stored, not fetching item id=", item_id)
-                        
-                    return True
+            if not history_store.already_stored(self.name, entry, self.store_path):
+                # Just queue the entry here. Items are fetched concurrently
+                # from 'completed' callback.
+                self.entries_to_fetch.append(entry)
+            
+            else:
+                print("HN plugin: Already stored, not fetching item id=", item_id)
+                
+            return True
                 
         return False
         
         
-    def fetch_contents(self, entry):
-        # Comments are in <div class='comment'>.
-        # Each such div has an unwanted <div class='reply'> which is simply deleted from DOM.
-        resp = requests.get(entry['url'])
-        resp.raise_for_status()
-        
-        soup = BeautifulSoup(resp.content, 'html.parser')
-        for s in soup.find_all('div', attrs={'class':'reply'}):
-            s.decompose()
+    def fetch_url(self, entry):
+        base_url = self.app_conf.get('HN_BASE_URL', None)
+        if not base_url:
+            return entry['url']
             
-        comments = soup.find_all('div', attrs={'class':'comment'})
-        contents = ' '.join([s.get_text() for s in comments])
+        return base_url.rstrip('/') + entry['path'] + '?' + entry['query']
+        
+        
+    def fetched_pages(self, pool, urls):
+        # Page bytes go to parse workers as they arrive. Response objects don't pickle.
+        for entry, resp, error in pool.fetch_all(urls):
+            if error is not None:
+                print('Error fetching: ', entry['url'], error)
+            else:
+                yield entry, resp.content
+        
         
-        entry['contents'] = contents
-
-
     def completed(self, history_store):
-        #print("HN handler: Storing all entries metadata")
-        #history_store.store_entries_metadata(self.name, self.entries_to_fetch, self.store_path)
-        pass
+        if not self.entries_to_fetch:
+            return
+            
+        print("HN plugin: Fetching %d items" % (len(self.entries_to_fetch)))
+        
+        pool = FetchPool(
+            self.app_conf.get('HN_FETCH_WORKERS', FetchPool.DEFAULT_MAX_WORKERS),
+            self.app_conf.get('HN_MAX_REQUESTS_PER_HOST', FetchPool.DEFAULT_MAX_PER_HOST),
+            request_scheduler.scheduler.register('hn'))
+        
+        writer = StoreWriter(history_store, self.name, self.store_path)
+        
+        t0 = time.time()
+        num_fetched = 0
+        try:
+            urls = [ (entry, self.fetch_url(entry)) for entry in self.entries_to_fetch ]
+            for entry, contents, error in parse_pool.map_unordered(self.extract, self.fetched_pages(pool, urls)):
+                if error is not None:
+                    print('Error processing: ', entry['url'], error)
+                    continue
+                    
+                entry['contents'] = contents
+                # Stored in the background, while fetching and parsing go on.
+                writer.submit([entry])
+                num_fetched += 1
+        finally:
+            pool.close()
+            # Waits for everything to be stored.
+            writer.close()
+            
+        print("HN plugin: Fetched %d items, %d failed, in %.2f s" % (
+            num_fetched, len(self.entries_to_fetch) - num_fetched, time.time() - t0))
+        self.entries_to_fetch = []
 
-# Module initialization
-history_handlers.history_handlers.register(HackerNewsHistoryHandler())
+# Registered by PLUGINS in history_handlers/__init__.py, for news.ycombinator.com/item entries.
 
@@ -14,7 +14,8 @@ class SampleHandler(object):
         
     def conf_init(self, app_conf):
         '''
-        Called by the handler registrar after this plugin registers itself.
+        Called by the handler registrar when this handler is created, and again
+        whenever the configuration changes.
         '''
         self.app_conf = app_conf
 
@@ -24,6 +25,13 @@ class SampleHandler(object):
         Handle an entry in the history file.
         If this handler does not intend to handle the URL, it should return False.
         
+        Handlers that register with domains and paths are sent only entries matching 
+        them. This sample registers without any, so it's a catch-all handler that is 
+        offered every entry no other handler accepted.
+        
+        If the handler needs the query string parsed, it should use 
+        history_handlers.get_query_params(entry), which parses it just once per entry.
+        
         entry: a dict of the form
             {
                 "id": "14221",
@@ -55,6 +63,8 @@ class SampleHandler(object):
 # ----------------------------------------------------------------------
 
 
-# Module entry point
-history_handlers.history_handlers.register(SampleHandler())
+# Registered by PLUGINS in history_handlers/__init__.py, where a handler interested 
+# only in some sites lists them like this:
+#   { 'module' : 'sample_handler', 'class' : 'SampleHandler', 'name' : 'sample-handler',
+#     'domains' : ['www.example.com'], 'paths' : ['/articles'] }
 
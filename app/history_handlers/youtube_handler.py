@@ -1,13 +1,13 @@
 from __future__ import print_function
-from urllib.parse import parse_qs
-from apiclient import discovery
 import json
-import yaml
 import os.path
 import sys
 import traceback
 
 import history_handlers 
+import request_scheduler
+import youtube_service
+from video_cache import VideoMetadataCache, video_contents
 
 class YoutubeHistoryHandler(object):
     '''
@@ -34,10 +34,17 @@ class YoutubeHistoryHandler(object):
     batch downloads of video details only on receiving the 'completed' notification from HistoryProcessor.
     According to https://stackoverflow.com/a/36371390,
     max number of IDs in a single request is 50.
+    
+    Video details are also kept in a local VideoMetadataCache, shared with the YouTube
+    target fetcher. Entries already stored are skipped entirely, and of the rest, only
+    those not in the cache are requested from the API. So re-uploading overlapping 
+    history doesn't spend quota on videos that are already known.
+    
+    API calls share the 'youtube' rate limit and daily quota with the YouTube target
+    fetcher (see request_scheduler.py).
     '''
     
     BATCH_REQUEST_SIZE = 50     # from https://stackoverflow.com/a/36371390
-    API_KEY_FILE = 'yt_api_key.yml'
     
     def __init__(self):
         self.name = 'youtube-history-handler'
@@ -46,78 +53,78 @@ class YoutubeHistoryHandler(object):
         
     def conf_init(self, app_conf):
         self.app_conf = app_conf
+        self._youtube_svc = None
         
-        self.youtube_svc = self.get_youtube_service()
         
-
-    def get_youtube_service(self):
-        key_error = ("Error: YouTube API key file conf/yt_api_key.yml not found or API key is not present in that file.\n"
-                "Obtain an API key as explained in https://developers.google.com/youtube/v3/getting-started#before-you-start.\n"
-                "Then create a copy of conf/yt_api_key_template.yml as conf/yt_api_key.yml and insert the key in it.")
-                
-        yt_api_key_file = os.path.join(self.app_conf['CONF_DIR'], self.API_KEY_FILE)
-        if not os.path.exists(yt_api_key_file):
-            raise RuntimeError(key_error)
-                
-        with open(yt_api_key_file, 'r') as cred_file:
-            creds = yaml.load(cred_file)
-        api_key = creds.get('key', '')
-        if not api_key:
-            raise RuntimeError(key_error)
-            
-        service = discovery.build('youtube', 'v3', developerKey=api_key)
-        
-        return service
+    @property
+    def youtube_svc(self):
+        # Built on first use, so that nothing is set up for runs that don't need it.
+        if getattr(self, '_youtube_svc', None) is None:
+            self._youtube_svc = youtube_service.get_youtube_service(self.app_conf)
+        return self._youtube_svc
         
         
-
     def handle(self, entry, history_store):
-        if entry['domain'] == 'www.youtube.com':
-            queries = parse_qs(entry['query'])
-            video_id = queries.get('v', None)
-            if video_id:
-                video_id = video_id[0]
-                print("Youtube plugin: Handling video id=", video_id)
-                
-                # Just cache the ID here. Video details are batch downloaded from
-                # 'completed' callback in order to save quota costs.
-                entry['video_id'] = video_id
-                self.entries_to_fetch[video_id] = entry
-                return True
+        # Only www.youtube.com entries are routed to this handler.
+        video_id = history_handlers.get_query_params(entry).get('v', None)
+        if video_id:
+            video_id = video_id[0]
+            print("Youtube plugin: Handling video id=", video_id)
+            
+            # Just cache the ID here. Video details are batch downloaded from
+            # 'completed' callback in order to save quota costs.
+            entry['video_id'] = video_id
+            self.entries_to_fetch[video_id] = entry
+            return True
             
         return False
         
         
     def completed(self, history_store):
-        # TODO This handler does not implement any checks to see if video details have already been
-        # stored before fetching details. This is just to avoid complexity for now, but it's 
-        # recommended to add it.
+        if not self.entries_to_fetch:
+            return
+            
+        store_path = history_store.prepare_to_store(self.name)
+        
+        for video_id, entry in list(self.entries_to_fetch.items()):
+            if history_store.already_stored(self.name, entry, store_path):
+                del self.entries_to_fetch[video_id]
+                
+        cache = VideoMetadataCache(self.app_conf)
+        cached = cache.get_many(self.entries_to_fetch.keys())
+        for video_id, snippet in cached.items():
+            self.entries_to_fetch[video_id]['contents'] = video_contents(snippet)
+            
+        ids_to_fetch = [ video_id for video_id in self.entries_to_fetch if video_id not in cached ]
+        print("Youtube plugin: %d videos to store, %d of them cached, %d to fetch" % (
+            len(self.entries_to_fetch), len(cached), len(ids_to_fetch)))
         
-        ids_to_fetch = list(self.entries_to_fetch.keys())
         batches = [ ids_to_fetch[x:x+self.BATCH_REQUEST_SIZE] for x in range(0, len(ids_to_fetch), self.BATCH_REQUEST_SIZE) ]
+        youtube_limit = request_scheduler.scheduler.register('youtube')
 
         for batch in batches:
             try:
                 batch_ids = ','.join(batch)
                 
-                resp = self.youtube_svc.videos().list(
+                req = self.youtube_svc.videos().list(
                     id=batch_ids, 
-                    part='snippet').execute()
+                    part='snippet')
+                resp = youtube_limit.call(req.execute, cost=request_scheduler.QUOTA_COSTS['youtube.videos.list'])
                 
-                self.fetch_contents(resp)
+                self.fetch_contents(resp, cache)
                 
             except:            
                 # If one batch fails, no need to fail everything else.
                 print('\n\n\nERROR: Youtube handler fetch partial failure. Reason:%s\n\n\n' % (traceback.print_exc()))
 
-        # Store all entries in one file and contents for each entry in their own files.
-        store_path = history_store.prepare_to_store(self.name)
+        cache.close()
+        
         entries = list(self.entries_to_fetch.values())
         #history_store.store_entries_metadata(self.name, entries, store_path=store_path)
         history_store.store_content(self.name, entries, store_path=store_path)
                 
                 
-    def fetch_contents(self, resp):
+    def fetch_contents(self, resp, cache):
         
         items = resp.get('items', None)
         if not items:
@@ -125,22 +132,15 @@ class YoutubeHistoryHandler(object):
         
         # If any video ID is no longer available, it's not included in the response.
         # So it's possible some of the entries won't have contents.
+        snippets = {}
         for v in items:
             video_id = v['id']
-            v = v['snippet']
-            title = v.get('title','')
-            desc = v.get('description','')
-            tags = v.get('tags', None)
-            tags = ' '.join(tags) if tags else ''
-                
-            # Since LDA is a bag of words model, things like newlines and order of terms don't matter.
-            # Just combine all the attributes into a single string.
-            contents = ' '.join([title, desc, tags])
+            snippets[video_id] = v['snippet']
+            self.entries_to_fetch[video_id]['contents'] = video_contents(v['snippet'])
             
-            self.entries_to_fetch[video_id]['contents'] = contents
+        cache.put_many(snippets, complete=True)
         
       
 
-# Module initialization
-history_handlers.history_handlers.register(YoutubeHistoryHandler())
+# Registered by PLUGINS in history_handlers/__init__.py, for www.youtube.com entries.
 
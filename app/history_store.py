@@ -1,9 +1,12 @@
 from __future__ import print_function
 import datetime
-import json
 import os
 import os.path
 
+from storage_backends import create_storage_backend
+from dedup_index import DedupIndex
+from vocabulary import create_term_counter
+
 class HistoryStore(object):
     '''
     Responsible for storing whatever text is fetched by the history handlers.
@@ -11,15 +14,21 @@ class HistoryStore(object):
     As of now, this just saves all items directly to filesystem with date on which
     history was uploaded. 
     
-    Each entry is saved in its own JSON file containing the history metadata and fetched contents.
+    Each entry is saved as a JSON document containing the history metadata and fetched contents.
+    How the documents are laid out inside a date directory depends on the STORAGE_BACKEND
+    configured in conf.yml (see storage_backends.py).
     
         # The directory structure for history storage as of now is:
         # HISTORY_DIR
         #   /<datetime>/
-        #      /<handler-name>/
-        #           <id1>.json
-        #           <id2>.json
-        #               ...
+        #       <id1>.json              (STORAGE_BACKEND: files)
+        #       <id2>.json
+        #           ...
+        #   or
+        #       segment-00000.json      (STORAGE_BACKEND: segments)
+        #       segment-00001.json
+        #           ...
+        #       _segments.idx
 
     Future enhancements:
     - save the text in a directory tree so that system can get content only for a range
@@ -29,6 +38,17 @@ class HistoryStore(object):
     '''
     def __init__(self, app_conf):
         self.app_conf = app_conf
+        self.backend = create_storage_backend(app_conf)
+        
+        # With DEDUP_INDEX enabled, anything stored on any earlier date is recognized
+        # as already stored, and not fetched or stored again.
+        self.dedup_index = None
+        if app_conf.get('DEDUP_INDEX', False):
+            self.dedup_index = DedupIndex(app_conf['HISTORY_DIR'])
+            
+        # With VOCABULARY_FILE configured, term counts of every entry are stored 
+        # with it, so that LDA doesn't have to tokenize contents again (see vocabulary.py).
+        self.term_counter = create_term_counter(app_conf)
         
         
     def prepare_to_store(self, handler_name):
@@ -58,6 +78,7 @@ class HistoryStore(object):
         entries: 
             a list with single or multiple history entries. Each entry dict
             should ideally have a 'contents' key, but it's possible some don't.
+            Keys starting with an underscore are not stored.
             
         store_path:
             Since store path involves a date which may change between calls, 
@@ -73,11 +94,19 @@ class HistoryStore(object):
             if e.get('contents', None) is None:
                 e['contents'] = ''
                 
-            entry_filename = self.get_entry_filename(store_path, e)
-            with open(entry_filename, 'w') as entry_file:
-                # Caution: Don't set indent and separators or do any pretty printing to file,
-                # because Spark is unable to handle a JSON file that spans multiple lines.
-                json.dump(e, entry_file)
+        # Keys starting with an underscore are only for use while processing an entry. 
+        entries = [ { k:v for k,v in e.items() if not k.startswith('_') } for e in entries ]
+        
+        if self.dedup_index is not None:
+            entries = [ e for e in entries if not self.dedup_index.seen(e) ]
+            
+        if self.term_counter is not None:
+            self.term_counter.add_term_counts(entries)
+            
+        self.backend.write(store_path, entries)
+        
+        if self.dedup_index is not None:
+            self.dedup_index.add(os.path.basename(store_path), entries)
       
     
     def get_store_path(self, handler_name):
@@ -100,11 +129,13 @@ class HistoryStore(object):
         if not store_path:
             store_path = self.get_store_path(handler_name)
             
-        entry_filename = self.get_entry_filename(store_path, entry)
-        return os.path.exists(entry_filename)
-        
+        if self.dedup_index is not None and self.dedup_index.seen_url(entry['url']):
+            return True
+            
+        return self.backend.contains(store_path, entry)
         
         
-    def get_entry_filename(self, store_path, entry):
-        entry_filename = os.path.join(store_path, entry['id'] + '.json')
-        return entry_filename
+    def close(self):
+        self.backend.close()
+        if self.dedup_index is not None:
+            self.dedup_index.close()
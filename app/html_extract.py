@@ -0,0 +1,181 @@
+'''
+Extraction of text from selected parts of HTML pages, like the comments of a discussion page.
+
+Parsing is often the most expensive part of handling a scraped page. BeautifulSoup with
+Python's html.parser builds a full tree of Python objects, and is several times slower
+than parsers written in C. So a TextExtractor uses the fastest parser that's installed:
+
+    selectolax      Modest/Lexbor based. Fastest. pip install selectolax
+    lxml            libxml2 based. pip install lxml
+    bs4             BeautifulSoup with html.parser. Always available.
+
+All of them extract the same text. With selectolax and lxml, selected elements are found,
+and their text is collected leaving out excluded elements, in a single pass over the tree
+in C, without first deleting excluded elements from the tree.
+
+HTML_PARSER in conf.yml can force one of them. Default is 'auto', the fastest installed.
+'''
+from __future__ import print_function
+import codecs
+import re
+
+PARSERS = [ 'selectolax', 'lxml', 'bs4' ]
+
+# Encodings declared in a page, like <meta charset="utf-8"> or
+# <meta http-equiv="Content-Type" content="text/html; charset=utf-8">
+META_CHARSET = re.compile(br'<meta[^>]+charset\s*=\s*["\']?([-\w.:]+)', re.I)
+
+
+def available_parsers():
+    '''
+    Returns names of installed parsers, fastest first.
+    '''
+    available = []
+    for parser in PARSERS:
+        try:
+            if parser == 'selectolax':
+                import selectolax.parser
+            elif parser == 'lxml':
+                import lxml.html
+            else:
+                import bs4
+        except ImportError:
+            continue
+        available.append(parser)
+
+    return available
+
+
+def resolve_parser(parser):
+    '''
+    Returns the name of the parser that 'auto' or None stands for, or raises
+    RuntimeError if the given parser is not installed.
+    '''
+    available = available_parsers()
+    if parser in (None, 'auto'):
+        return available[0]
+    if parser not in available:
+        raise RuntimeError('HTML parser %s is not installed. Installed parsers: %s' % (parser, ', '.join(available)))
+    return parser
+
+
+def decode_html(content):
+    '''
+    Decodes page bytes with the encoding declared in the page, if any, or else as UTF-8,
+    or failing that as Windows-1252. Every parser is given the same text, so that they
+    all extract the same thing.
+    '''
+    if not isinstance(content, bytes):
+        return content
+
+    match = META_CHARSET.search(content[:2048])
+    if match:
+        try:
+            return content.decode(codecs.lookup(match.group(1).decode('ascii')).name, 'replace')
+        except LookupError:
+            pass
+
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        return content.decode('windows-1252', 'replace')
+
+
+def class_xpath(class_name):
+    return 'contains(concat(" ", normalize-space(@class), " "), " %s ")' % (class_name)
+
+
+
+class TextExtractor(object):
+    '''
+    Extracts the text of every element with tag and class, leaving out text within
+    elements with exclude_class.
+
+    parser: 'auto', or one of PARSERS.
+    '''
+
+    def __init__(self, tag, class_name, exclude_class=None, parser='auto'):
+        self.tag = tag
+        self.class_name = class_name
+        self.exclude_class = exclude_class
+
+        self.parser = parser = resolve_parser(parser)
+
+        self.extract_texts = getattr(self, 'extract_' + parser)
+
+        if parser == 'lxml':
+            from lxml import etree
+            self.lxml_selector = etree.XPath('//%s[%s]' % (tag, class_xpath(class_name)))
+            if exclude_class:
+                self.lxml_texts = etree.XPath('.//text()[not(ancestor::*[%s])]' % (class_xpath(exclude_class)))
+            else:
+                self.lxml_texts = etree.XPath('.//text()')
+
+
+    def extract(self, content):
+        '''
+        content: page as bytes or text.
+
+        Returns a list with the text of each selected element, in document order.
+        '''
+        text = decode_html(content)
+        if not text.strip():
+            return []
+        return self.extract_texts(text)
+
+
+    def extract_selectolax(self, text):
+        from selectolax.parser import HTMLParser
+
+        tree = HTMLParser(text)
+        texts = []
+        for node in tree.css('%s.%s' % (self.tag, self.class_name)):
+            if self.exclude_class and node.css_first('.' + self.exclude_class) is not None:
+                texts.append(''.join(self.selectolax_texts(node)))
+            else:
+                texts.append(node.text(deep=True, separator=''))
+        return texts
+
+
+    def selectolax_texts(self, node):
+        # Only elements that contain something excluded are walked in Python.
+        child = node.child
+        while child is not None:
+            if child.tag == '-text':
+                yield child.text(deep=False)
+            elif child.tag.startswith('_'):
+                # Comments and such.
+                pass
+            elif self.exclude_class not in (child.attributes.get('class', None) or '').split():
+                if child.css_first('.' + self.exclude_class) is None:
+                    yield child.text(deep=True, separator='')
+                else:
+                    for t in self.selectolax_texts(child):
+                        yield t
+            child = child.next
+
+
+    def extract_lxml(self, text):
+        import lxml.html
+
+        try:
+            tree = lxml.html.fromstring(text)
+        except ValueError:
+            # Text with an XML encoding declaration has to be parsed as bytes.
+            tree = lxml.html.fromstring(text.encode('utf-8'))
+
+        # The ancestor test of lxml_texts looks all the way up to the root, so a selected
+        # element within an excluded one would get no text. Discussion pages don't have
+        # comments within replies.
+        return [ ''.join(self.lxml_texts(element)) for element in self.lxml_selector(tree) ]
+
+
+    def extract_bs4(self, text):
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(text, 'html.parser')
+        if self.exclude_class:
+            for e in soup.find_all(attrs={'class' : self.exclude_class}):
+                e.decompose()
+
+        return [ e.get_text() for e in soup.find_all(self.tag, attrs={'class' : self.class_name}) ]
@@ -0,0 +1,110 @@
+from __future__ import print_function
+import json
+import re
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Longest token, like -Infinity or a \uXXXX escape, that a decode error may point at the
+# start of when it's only cut off by the end of the buffer.
+MAX_TRUNCATED_TOKEN = 16
+
+# Characters a number may continue with, up to the end of the buffer.
+NUMBER_TAIL = re.compile(r'[-+.eE0-9]*\Z')
+
+def iter_json_array(json_file, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Parses a file whose top level is a JSON array, and yields its elements one at a time
+    as they're parsed. Only the element being parsed and a chunk of the file are held
+    in memory at any time, so memory use doesn't depend on the size of the file.
+
+    json_file: a file object opened in text mode.
+    '''
+    decoder = json.JSONDecoder()
+    reader = _ChunkReader(json_file, chunk_size)
+
+    if reader.next_token() != '[':
+        raise ValueError('Expected a JSON array in %s' % (getattr(json_file, 'name', 'file')))
+    reader.pos += 1
+
+    if reader.next_token() == ']':
+        return
+
+    while True:
+        reader.next_token()
+        read_size = chunk_size
+
+        while True:
+            try:
+                element, end = decoder.raw_decode(reader.buf, reader.pos)
+            except json.JSONDecodeError as e:
+                # Only an element cut off by the end of the buffer is read further. A malformed
+                # one is raised right away, not after reading the rest of the file.
+                if not _is_incomplete(e, reader.buf) or not reader.read_more(read_size):
+                    raise
+                # Each attempt decodes the element from its start again, so reads of a large
+                # element double in size to keep the number of attempts logarithmic.
+                read_size *= 2
+                continue
+
+            # A number like 123 or 1. may just be the beginning of a longer one
+            # that continues in the next chunk.
+            if isinstance(element, (int, float)) and NUMBER_TAIL.match(reader.buf, end) and reader.read_more():
+                continue
+
+            break
+
+        reader.pos = end
+        yield element
+
+        token = reader.next_token()
+        if token == ',':
+            reader.pos += 1
+        elif token == ']':
+            return
+        else:
+            raise ValueError('Expected , or ] after array element but found %r' % (token))
+
+
+
+def _is_incomplete(error, buf):
+    if error.pos >= len(buf) - MAX_TRUNCATED_TOKEN:
+        return True
+    # A string with no closing quote up to the end of the buffer.
+    return error.msg.startswith('Unterminated string')
+
+
+
+class _ChunkReader(object):
+    def __init__(self, json_file, chunk_size):
+        self.json_file = json_file
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+
+
+    def read_more(self, size=None):
+        chunk = self.json_file.read(size or self.chunk_size)
+        if not chunk:
+            return False
+
+        # Drop everything that has already been parsed before growing the buffer.
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+
+    def next_token(self):
+        '''
+        Skips whitespace and returns the next non-whitespace character without consuming it,
+        or None at end of file.
+        '''
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+
+            if not self.read_more():
+                return None
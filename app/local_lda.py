@@ -0,0 +1,643 @@
+'''
+In-process LDA engine for the recommend command.
+
+It does the same thing as the Spark job in Lda.scala, but in a single Python process
+using NumPy and SciPy. For a single user's few thousand documents, this returns results
+in seconds, where the Spark job spends most of its time just starting up a JVM and Spark.
+
+- Documents are tokenized and stripped of stop words exactly as by Spark's Tokenizer and
+  StopWordsRemover (see text_pipeline.py), and turned into a sparse term count matrix with
+  a vocabulary fitted on history documents, like CountVectorizer. Term counts stored with
+  entries (see vocabulary.py) are used as they are, without tokenizing anything.
+
+- Topics are modelled by batch variational Bayes LDA. The E-step is vectorized over
+  documents using sparse matrix products, and runs on chunks of documents in parallel
+  threads, one per core.
+
+- Recommendations are the targets nearest to any history document, found by an exact
+  search over all topic vectors (see topic_index.py) instead of an approximate LSH join.
+
+- With a model directory, the fitted model and the topic vectors of history and target
+  documents are saved, and reused for as long as those documents and parameters don't change.
+'''
+from __future__ import print_function
+import os
+import os.path
+import json
+import hashlib
+import shutil
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.special import psi
+
+from storage_backends import iter_partition_entries
+import text_pipeline
+import vocabulary as shared_vocabulary
+from topic_index import TopicIndex, SIMILARITY_METRICS
+import topic_index
+from results import ResultRenderer
+
+
+# Same as CountVectorizer's default vocabSize.
+DEFAULT_VOCAB_SIZE = 1 << 18
+
+NUM_RECOMMENDATIONS = 20
+TERMS_PER_TOPIC = 10
+
+# Changed whenever the layout of a saved model changes.
+MODEL_FORMAT_VERSION = 1
+
+
+def as_paths(paths):
+    '''
+    Functions that take a directory path also take a list of them, like a list of date partitions.
+    '''
+    return [ paths ] if isinstance(paths, str) else list(paths)
+
+
+def iter_documents(paths):
+    '''
+    Yields every document stored under paths, including their subdirectories.
+    Like Spark, hidden files and directories (starting with _ or .) are skipped.
+    So are targets stored as near-duplicates of another (see near_dup.py).
+    '''
+    for path in as_paths(paths):
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted([ d for d in dirnames if not d.startswith('_') and not d.startswith('.') ])
+            for entry in iter_partition_entries(dirpath):
+                if entry.get('near_duplicate_of', None) is None:
+                    yield entry
+
+
+class Corpus(object):
+    '''
+    Documents loaded from a store directory, as a sparse term count matrix
+    with one row per document.
+
+    docs: list of document metadata dicts with 'id', 'title' and 'url'.
+    counts: scipy.sparse.csr_matrix of shape (number of docs, vocabulary size).
+    '''
+    def __init__(self, docs, counts):
+        self.docs = docs
+        self.counts = counts
+
+
+class TermIds(object):
+    '''
+    Ids of the terms of loaded documents, which are the columns of their term count matrices.
+
+    Terms of the shared vocabulary (see vocabulary.py) keep their ids, so that term counts
+    stored with entries are ready-made rows of the matrix. Terms of documents tokenized here
+    get ids after those.
+
+    stored_vocabulary: (Optional) list of terms of the shared vocabulary, indexed by term id.
+    '''
+    def __init__(self, stored_vocabulary=None):
+        self.use_stored = stored_vocabulary is not None
+        self.terms = list(stored_vocabulary or [])
+        self.num_stored = len(self.terms)
+
+        # term -> id, only built if needed.
+        self.ids = None
+
+
+    def id_of(self, term):
+        if self.ids is None:
+            self.ids = { t : i for i, t in enumerate(self.terms) }
+        return self.ids.get(term, None)
+
+
+    def counts(self, terms):
+        '''
+        Returns a dict of term id to count of a tokenized document, adding ids for new terms.
+        '''
+        if self.ids is None:
+            self.ids = { t : i for i, t in enumerate(self.terms) }
+
+        counts = Counter()
+        for term in terms:
+            term_id = self.ids.get(term, None)
+            if term_id is None:
+                term_id = self.ids[term] = len(self.terms)
+                self.terms.append(term)
+            counts[term_id] += 1
+        return counts
+
+
+    def stored_counts(self, entry):
+        '''
+        Returns a dict of term id to count from the term counts stored with an entry.
+        '''
+        # Ids of terms added to the vocabulary after it was read are skipped.
+        return { term_id : count for term_id, count in zip(entry['term_ids'], entry['term_counts'])
+                 if term_id < self.num_stored }
+
+
+
+def load_documents(paths, stop_words, term_ids):
+    '''
+    Returns a (docs, counts) tuple: the metadata of every document under paths, and their
+    term counts as a scipy.sparse.csr_matrix with a column for each term of term_ids.
+
+    term_ids: a TermIds. If it has the shared vocabulary, term counts stored with entries
+        are used instead of tokenizing their contents.
+    '''
+    docs = []
+    indptr = [0]
+    indices = []
+    data = []
+    for entry in iter_documents(paths):
+        docs.append({
+            'id' : entry.get('id', None),
+            'title' : entry.get('title', None),
+            'url' : entry.get('url', None)
+        })
+        if term_ids.use_stored and 'term_ids' in entry:
+            counts = term_ids.stored_counts(entry)
+        else:
+            counts = term_ids.counts(text_pipeline.terms(entry.get('contents', None) or '', stop_words))
+
+        for term_id in sorted(counts):
+            indices.append(term_id)
+            data.append(counts[term_id])
+        indptr.append(len(indices))
+
+    counts = sp.csr_matrix(
+        (np.array(data, dtype=np.float64), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+        shape=(len(docs), len(term_ids.terms)))
+    return docs, counts
+
+
+class VocabularyOptions(object):
+    '''
+    Controls of the term counts, the same as the Spark job's (see VocabularyOptions in LdaPipeline.scala).
+
+    vocab_size: keep only this many terms, the most frequent across history.
+    min_df: keep only terms in at least this many history documents, or this fraction of them if below 1.
+    min_tf: count a term in a document only if it occurs at least this many times in it,
+        or at least this fraction of its terms if below 1.
+    max_df: (Optional) leave out terms in more than this many history documents, or more than
+        this fraction of them if below 1.
+    hashing_features: (Optional) hash terms into this many features instead of fitting a
+        vocabulary. The other options then don't apply.
+    '''
+    def __init__(self, vocab_size=DEFAULT_VOCAB_SIZE, min_df=1.0, min_tf=1.0, max_df=None, hashing_features=None):
+        self.vocab_size = int(vocab_size)
+        self.min_df = float(min_df)
+        self.min_tf = float(min_tf)
+        self.max_df = float(max_df) if max_df is not None else None
+        self.hashing_features = int(hashing_features) if hashing_features else None
+
+
+    def fingerprint(self):
+        return 'vocab_size=%d,min_df=%r,min_tf=%r,max_df=%r,hashing=%r' % (
+            self.vocab_size, self.min_df, self.min_tf, self.max_df, self.hashing_features)
+
+
+    def is_default(self):
+        return self.fingerprint() == VocabularyOptions().fingerprint()
+
+
+
+def document_limit(df, num_docs):
+    # Document frequency options are a number of documents, or a fraction of them if below 1.
+    return df if df >= 1.0 else df * num_docs
+
+
+def fit_vocabulary(counts, terms, vocab_size=DEFAULT_VOCAB_SIZE, min_df=1.0, max_df=None):
+    '''
+    Like CountVectorizer, the vocabulary is the vocab_size most frequent terms
+    across all documents, in descending order of frequency, of those in at least
+    min_df documents, and in at most max_df documents.
+
+    counts: term count matrix of documents (see load_documents), with a column for each of terms.
+    '''
+    num_docs = counts.shape[0]
+    term_totals = np.asarray(counts.sum(axis=0)).ravel()
+    doc_counts = np.diff(counts.tocsc().indptr)
+
+    keep = (term_totals > 0) & (doc_counts >= document_limit(min_df, num_docs))
+    if max_df is not None:
+        keep &= doc_counts <= document_limit(max_df, num_docs)
+
+    # Stable, so that terms as frequent as each other are in order of id.
+    candidates = np.flatnonzero(keep)
+    top = candidates[np.argsort(-term_totals[candidates], kind='stable')][:vocab_size]
+    return [ terms[i] for i in top ]
+
+
+def hashed_index(term, hashing_features):
+    return zlib.crc32(term.encode('utf-8')) % hashing_features
+
+
+def hashed_vocabulary(counts, terms, hashing_features):
+    '''
+    With feature hashing, there's no vocabulary to describe topics with. Instead, each
+    feature is labelled with the most frequent history terms that hash to it, like
+    "apple" or, if two terms collide, "apple|orange". Features no term hashes to are ''.
+    '''
+    term_totals = np.asarray(counts.sum(axis=0)).ravel()
+    present = np.flatnonzero(term_totals)
+
+    feature_terms = {}
+    for i in present[np.argsort(-term_totals[present], kind='stable')]:
+        labels = feature_terms.setdefault(hashed_index(terms[i], hashing_features), [])
+        if len(labels) < 2:
+            labels.append(terms[i])
+
+    vocabulary = [ '' ] * hashing_features
+    for index, labels in feature_terms.items():
+        vocabulary[index] = '|'.join(labels)
+    return vocabulary
+
+
+def count_matrix(counts, term_ids, vocabulary, min_tf=1.0, hashing_features=None):
+    '''
+    Returns the term count matrix of documents with a column for each term of vocabulary,
+    from their counts of all terms (see load_documents). Terms not in vocabulary are ignored.
+
+    min_tf: like CountVectorizer's minTF, counts below it, or below that fraction of
+        a document's terms if it's below 1, are left out.
+    hashing_features: (Optional) terms are hashed into this many features, like HashingTF,
+        instead of being looked up in vocabulary. Like HashingTF, min_tf then doesn't apply.
+    '''
+    # Feature of every column of counts, or -1 if its term is left out.
+    features = np.full(counts.shape[1], -1, dtype=np.int64)
+    if hashing_features:
+        present = np.unique(counts.indices)
+        features[present] = [ hashed_index(term_ids.terms[i], hashing_features) for i in present ]
+        num_features = hashing_features
+        min_tf = 1.0
+    else:
+        for feature, term in enumerate(vocabulary):
+            term_id = term_ids.id_of(term)
+            if term_id is not None and term_id < counts.shape[1]:
+                features[term_id] = feature
+        num_features = len(vocabulary)
+
+    entries = counts.tocoo()
+    entry_features = features[entries.col]
+    keep = entry_features >= 0
+    if min_tf < 1.0:
+        doc_lengths = np.asarray(counts.sum(axis=1)).ravel()
+        keep &= entries.data >= (min_tf * doc_lengths)[entries.row]
+    else:
+        keep &= entries.data >= min_tf
+
+    # Terms hashed to the same feature are summed.
+    matrix = sp.csr_matrix((entries.data[keep], (entries.row[keep], entry_features[keep])),
+        shape=(counts.shape[0], num_features))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def vocabulary_stats(counts, num_topics, hashing=False):
+    '''
+    Returns the size and sparsity of a term count matrix as a "vocabulary" record
+    (see results.py). LDA keeps a vector of topic weights for every term, so the
+    vocabulary size bounds the memory and time of every iteration.
+    '''
+    num_docs, num_features = counts.shape
+    return {
+        'type' : 'vocabulary',
+        'features' : num_features,
+        'hashing' : hashing,
+        'documents' : num_docs,
+        'nonzeros' : counts.nnz,
+        'density' : float(counts.nnz) / (num_docs * num_features) if num_docs and num_features else 0.0,
+        'terms_per_document' : float(counts.nnz) / num_docs if num_docs else 0.0,
+        'topic_matrix_bytes' : num_features * num_topics * 8
+    }
+
+
+
+def dirichlet_expectation(alpha):
+    '''
+    E[log X] for X ~ Dir(alpha), for each row of alpha.
+    '''
+    return psi(alpha) - psi(np.sum(alpha, axis=1))[:, np.newaxis]
+
+
+class LocalLdaModel(object):
+    '''
+    LDA topic model trained by batch variational Bayes
+    (Hoffman, Blei and Bach, "Online Learning for Latent Dirichlet Allocation", 2010,
+    with the whole corpus as a single batch).
+
+    Priors default to 1/num_topics, same as Spark's online LDA optimizer.
+    '''
+
+    CHUNK_SIZE = 2048
+    MAX_DOC_ITERATIONS = 100
+    DOC_CONVERGENCE_THRESHOLD = 1e-3
+
+    def __init__(self, num_topics, alpha=None, eta=None, num_threads=None, seed=1):
+        self.num_topics = num_topics
+        self.alpha = alpha if alpha is not None else 1.0 / num_topics
+        self.eta = eta if eta is not None else 1.0 / num_topics
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.seed = seed
+        self.lam = None
+
+
+    def fit(self, counts, iterations):
+        rng = np.random.RandomState(self.seed)
+        self.lam = rng.gamma(100., 1./100., (self.num_topics, counts.shape[1]))
+
+        for i in range(iterations):
+            exp_elog_beta = np.exp(dirichlet_expectation(self.lam))
+            gamma, sstats = self.e_step(counts, exp_elog_beta, collect_sstats=True)
+            self.lam = self.eta + sstats * exp_elog_beta
+
+        return self
+
+
+    def transform(self, counts):
+        '''
+        Returns the topic distribution of each document. Like Spark, documents that have no
+        terms in the vocabulary get all zero weights.
+        '''
+        exp_elog_beta = np.exp(dirichlet_expectation(self.lam))
+        gamma, _ = self.e_step(counts, exp_elog_beta, collect_sstats=False)
+
+        topics = gamma / np.sum(gamma, axis=1)[:, np.newaxis]
+        topics[np.diff(counts.indptr) == 0] = 0.0
+        return topics
+
+
+    def describe_topics(self, max_terms=TERMS_PER_TOPIC):
+        '''
+        Returns a list with a (term indices, term weights) tuple for each topic,
+        sorted in order of decreasing term weight.
+        '''
+        topic_terms = self.lam / np.sum(self.lam, axis=1)[:, np.newaxis]
+        topics = []
+        for weights in topic_terms:
+            top = np.argsort(-weights)[:max_terms]
+            topics.append((top, weights[top]))
+
+        return topics
+
+
+    def e_step(self, counts, exp_elog_beta, collect_sstats):
+        chunks = [ (start, min(start + self.CHUNK_SIZE, counts.shape[0]))
+                    for start in range(0, counts.shape[0], self.CHUNK_SIZE) ]
+
+        # NumPy and SciPy release the GIL in the heavy operations, so chunks
+        # actually do run in parallel.
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            results = list(executor.map(
+                lambda chunk: self.e_step_chunk(chunk[0], counts[chunk[0]:chunk[1]], exp_elog_beta, collect_sstats),
+                chunks))
+
+        if not results:
+            return np.zeros((0, self.num_topics)), np.zeros(exp_elog_beta.shape)
+
+        gamma = np.vstack([ r[0] for r in results ])
+        sstats = sum(r[1] for r in results) if collect_sstats else None
+        return gamma, sstats
+
+
+    def e_step_chunk(self, start, counts, exp_elog_beta, collect_sstats):
+        num_docs = counts.shape[0]
+        rng = np.random.RandomState(self.seed + start)
+        gamma = rng.gamma(100., 1./100., (num_docs, self.num_topics))
+        exp_elog_theta = np.exp(dirichlet_expectation(gamma))
+
+        # Row of each nonzero term count, and the beta columns of its term.
+        rows = np.repeat(np.arange(num_docs), np.diff(counts.indptr))
+        beta_cols = exp_elog_beta[:, counts.indices].T
+
+        for i in range(self.MAX_DOC_ITERATIONS):
+            last_gamma = gamma
+
+            norm_counts = self.normalized_counts(counts, rows, exp_elog_theta, beta_cols)
+            gamma = self.alpha + exp_elog_theta * (norm_counts @ exp_elog_beta.T)
+            exp_elog_theta = np.exp(dirichlet_expectation(gamma))
+
+            if np.mean(np.abs(gamma - last_gamma)) < self.DOC_CONVERGENCE_THRESHOLD:
+                break
+
+        sstats = None
+        if collect_sstats:
+            norm_counts = self.normalized_counts(counts, rows, exp_elog_theta, beta_cols)
+            sstats = (norm_counts.T @ exp_elog_theta).T
+
+        return gamma, sstats
+
+
+    def normalized_counts(self, counts, rows, exp_elog_theta, beta_cols):
+        # Each term count divided by the normalizer of its variational
+        # topic distribution phi.
+        phinorm = np.einsum('ij,ij->i', exp_elog_theta[rows], beta_cols) + 1e-100
+        return sp.csr_matrix((counts.data / phinorm, counts.indices, counts.indptr), shape=counts.shape)
+
+
+
+def corpus_fingerprint(paths):
+    '''
+    A fingerprint of every document file under paths, that changes whenever
+    any file is added, removed or modified.
+    '''
+    h = hashlib.sha1()
+    for path in as_paths(paths):
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted([ d for d in dirnames if not d.startswith('_') and not d.startswith('.') ])
+            for filename in sorted(filenames):
+                if filename.startswith('_') or filename.startswith('.'):
+                    continue
+                st = os.stat(os.path.join(dirpath, filename))
+                h.update(('%s:%d:%d\n' % (os.path.join(dirpath, filename),
+                    st.st_size, int(st.st_mtime * 1e6))).encode('utf-8'))
+
+    return h.hexdigest()
+
+
+def model_fingerprint(history_dir, stop_words, num_topics, num_iterations, vocab_options=None):
+    h = hashlib.sha1()
+    h.update(('v%d\n%d\n%d\n' % (MODEL_FORMAT_VERSION, num_topics, num_iterations)).encode('utf-8'))
+    # Only if not the defaults, so that models saved before vocabulary options existed are still used.
+    if vocab_options is not None and not vocab_options.is_default():
+        h.update(vocab_options.fingerprint().encode('utf-8'))
+    h.update('\n'.join(sorted(stop_words)).encode('utf-8'))
+    h.update(corpus_fingerprint(history_dir).encode('utf-8'))
+    return h.hexdigest()
+
+
+def save_model(model_path, model, vocabulary, history_index):
+    '''
+    Saves a fitted model, its vocabulary and history topic vectors under model_path,
+    and returns the saved history index.
+    '''
+    history_index = TopicIndex.create(os.path.join(model_path, 'history'), history_index.topics, history_index.docs)
+    np.save(os.path.join(model_path, 'lambda.npy'), model.lam)
+    with open(os.path.join(model_path, 'vocabulary.json'), 'w') as f:
+        json.dump(vocabulary, f)
+
+    # Written last, like the index meta file.
+    with open(os.path.join(model_path, 'model.json'), 'w') as f:
+        json.dump({ 'num_topics' : model.num_topics, 'alpha' : model.alpha, 'eta' : model.eta }, f)
+
+    return history_index
+
+
+def load_model(model_path, num_threads=None):
+    '''
+    Returns a (model, vocabulary, history index) tuple saved by save_model,
+    or None if there's no complete model at model_path.
+    '''
+    if not os.path.exists(os.path.join(model_path, 'model.json')):
+        return None
+
+    with open(os.path.join(model_path, 'model.json'), 'r') as f:
+        params = json.load(f)
+    with open(os.path.join(model_path, 'vocabulary.json'), 'r') as f:
+        vocabulary = json.load(f)
+
+    model = LocalLdaModel(params['num_topics'], params['alpha'], params['eta'], num_threads=num_threads)
+    model.lam = np.load(os.path.join(model_path, 'lambda.npy'))
+
+    return model, vocabulary, TopicIndex.open(os.path.join(model_path, 'history'))
+
+
+def prune_models(models_dir, keep=3):
+    '''
+    Deletes all but the keep most recently used models under models_dir.
+    '''
+    paths = [ os.path.join(models_dir, d) for d in os.listdir(models_dir) if not d.startswith('.') ]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def recommend(history_dir, target_dir, num_topics, num_iterations,
+        custom_stop_words_file=text_pipeline.CUSTOM_STOP_WORDS_FILE,
+        metric='euclidean', num_threads=None, model_dir=None, vocabulary_file=None, vocab_options=None):
+    '''
+    Runs LDA on history documents, and prints recommended target documents and topics
+    in the same format as Lda.scala.
+
+    history_dir and target_dir may also be lists of directories.
+
+    If model_dir is given, models and topic vectors are saved under it and reused.
+
+    If vocabulary_file is given, term counts stored with entries are used wherever available.
+
+    vocab_options: (Optional) a VocabularyOptions.
+    '''
+    renderer = ResultRenderer()
+    for record in iter_results(history_dir, target_dir, num_topics, num_iterations,
+            custom_stop_words_file, metric, num_threads, model_dir, vocabulary_file, vocab_options):
+        renderer.render(record)
+
+
+def iter_results(history_dir, target_dir, num_topics, num_iterations,
+        custom_stop_words_file=text_pipeline.CUSTOM_STOP_WORDS_FILE,
+        metric='euclidean', num_threads=None, model_dir=None, vocabulary_file=None, vocab_options=None):
+    '''
+    Same as recommend, but yields results as records (see results.py) instead of printing them.
+    '''
+    vocab_options = vocab_options or VocabularyOptions()
+
+    t0 = time.time()
+    stage_start = [t0]
+
+    def stage(name):
+        now = time.time()
+        record = { 'type' : 'stage', 'name' : name, 'seconds' : now - stage_start[0] }
+        stage_start[0] = now
+        return record
+
+    stop_words = text_pipeline.load_stop_words(custom_stop_words_file)
+    term_ids = TermIds(shared_vocabulary.load_terms(vocabulary_file) if vocabulary_file else None)
+
+    model_path = None
+    saved = None
+    if model_dir:
+        models_dir = os.path.join(model_dir, 'local')
+        model_path = os.path.join(models_dir, model_fingerprint(history_dir, stop_words, num_topics, num_iterations, vocab_options))
+        saved = load_model(model_path, num_threads)
+
+    if saved is not None:
+        print("Using saved model %s" % (model_path))
+        model, vocabulary, history_index = saved
+        # Marks the model as recently used.
+        os.utime(model_path, None)
+
+    else:
+        history_docs, history_term_counts = load_documents(history_dir, stop_words, term_ids)
+        if not history_docs:
+            raise RuntimeError('No history documents found in %s' % (', '.join(as_paths(history_dir))))
+
+        if vocab_options.hashing_features:
+            vocabulary = hashed_vocabulary(history_term_counts, term_ids.terms, vocab_options.hashing_features)
+        else:
+            vocabulary = fit_vocabulary(history_term_counts, term_ids.terms,
+                vocab_options.vocab_size, vocab_options.min_df, vocab_options.max_df)
+        history_counts = count_matrix(history_term_counts, term_ids, vocabulary,
+            vocab_options.min_tf, vocab_options.hashing_features)
+        del history_term_counts
+        yield stage('load-history')
+        yield vocabulary_stats(history_counts, num_topics, bool(vocab_options.hashing_features))
+
+        model = LocalLdaModel(num_topics, num_threads=num_threads)
+        model.fit(history_counts, num_iterations)
+        history_index = TopicIndex(model.transform(history_counts), history_docs)
+
+        if model_path:
+            history_index = save_model(model_path, model, vocabulary, history_index)
+            prune_models(models_dir)
+
+    yield stage('fit')
+
+    target_index = None
+    if model_path:
+        target_index_path = os.path.join(model_path, 'targets', corpus_fingerprint(target_dir))
+        target_index = TopicIndex.open(target_index_path)
+
+    if target_index is None:
+        target_docs, target_term_counts = load_documents(target_dir, stop_words, term_ids)
+        target_counts = count_matrix(target_term_counts, term_ids, vocabulary,
+            vocab_options.min_tf, vocab_options.hashing_features)
+        del target_term_counts
+        target_index = TopicIndex(model.transform(target_counts), target_docs)
+
+        if model_path:
+            target_index = TopicIndex.create(target_index_path, target_index.topics, target_index.docs)
+            prune_models(os.path.dirname(target_index_path))
+
+    yield stage('transform-targets')
+
+    nearest = topic_index.recommendations(history_index, target_index, NUM_RECOMMENDATIONS, metric)
+    yield stage('similar')
+
+    for rank, (t, h, distance) in enumerate(nearest):
+        yield {
+            'type' : 'recommendation',
+            'rank' : rank + 1,
+            'distance' : distance,
+            'target' : {
+                'title' : target_index.docs[t]['title'],
+                'url' : target_index.docs[t]['url'],
+                'topics' : [ float(x) for x in target_index.topics[t] ]
+            },
+            'history' : {
+                'title' : history_index.docs[h]['title'],
+                'url' : history_index.docs[h]['url'],
+                'topics' : [ float(x) for x in history_index.topics[h] ]
+            }
+        }
+
+    for topic, (term_indices, term_weights) in enumerate(model.describe_topics()):
+        yield {
+            'type' : 'topic',
+            'topic' : topic,
+            'terms' : [ [ vocabulary[i], float(w) ] for i, w in zip(term_indices, term_weights) ]
+        }
+
+    yield { 'type' : 'done', 'seconds' : time.time() - t0 }
@@ -0,0 +1,337 @@
+'''
+Instrumentation of upload and fetch: what every handler and store spends its time on.
+
+Metrics wraps the handle and completed methods of history handlers, the fetch method of
+target handlers, and the writes of HistoryStore and TargetStore, and records for each
+of them call counts, error counts, latency histograms, and the entries and bytes written.
+
+At the end of a run, they're printed as a short report, and if METRICS_DIR is configured
+in conf.yml, exported to it as:
+
+    METRICS_DIR/<command>.json      A JSON summary.
+    METRICS_DIR/<command>.prom      Prometheus text exposition format, for node_exporter's
+                                    textfile collector (--collector.textfile.directory),
+                                    next to the Spark metrics set up in deploy/metrics.properties.
+
+Both files are replaced atomically, so a collector never reads a partly written one.
+'''
+from __future__ import print_function
+import bisect
+import datetime
+import json
+import os
+import os.path
+import tempfile
+import threading
+import time
+
+NAMESPACE = 'recommender'
+
+# Upper bounds in seconds of latency histogram buckets. Handler calls range from
+# dispatching an entry (microseconds) to fetching a whole target (minutes).
+LATENCY_BUCKETS = [ 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0 ]
+
+# name -> (type, help)
+METRICS = {
+    'handler_calls_total' : ('counter', 'Calls of a handler method.'),
+    'handler_errors_total' : ('counter', 'Calls of a handler method that raised an exception.'),
+    'handler_accepted_total' : ('counter', 'History entries accepted by a handler.'),
+    'handler_seconds' : ('histogram', 'Seconds taken by calls of a handler method.'),
+    'store_writes_total' : ('counter', 'Calls of store_content.'),
+    'store_errors_total' : ('counter', 'Calls of store_content that raised an exception.'),
+    'store_entries_total' : ('counter', 'Entries written by a store, after deduplication.'),
+    'store_bytes_total' : ('counter', 'Bytes of entries written by a store.'),
+    'store_write_seconds' : ('histogram', 'Seconds taken by calls of store_content.'),
+    'run_seconds' : ('gauge', 'Seconds taken by the whole run.'),
+    'run_timestamp_seconds' : ('gauge', 'Unix time at which the run finished.'),
+}
+
+
+class Histogram(object):
+    '''
+    Counts of observations in cumulative buckets, like a Prometheus histogram.
+    '''
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # The last count is of observations above the largest bucket.
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+    def cumulative_counts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+    def quantile(self, q):
+        '''
+        Returns an estimate of the q quantile: the upper bound of the bucket it falls in.
+        '''
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        for bound, total in zip(self.buckets, self.cumulative_counts()):
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+
+class Metrics(object):
+    '''
+    Metrics of a single run of a command, like upload or fetch.
+
+    Metrics are keyed by name and labels. All methods are thread safe, since targets
+    are fetched concurrently.
+    '''
+    def __init__(self, command, app_conf=None):
+        self.command = command
+        self.app_conf = app_conf or {}
+        self.started = time.time()
+        self.finished = None
+
+        # (name, labels) -> value, where labels is a sorted tuple of (label, value)
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key, None)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+
+    def instrument_handler(self, handler, methods):
+        '''
+        Replaces the given methods of a handler instance with wrappers that record
+        their calls. For 'handle', entries it accepts are counted too.
+        '''
+        handler_name = getattr(handler, 'name', None) or type(handler).__name__
+        for method_name in methods:
+            method = getattr(handler, method_name, None)
+            if method is not None:
+                setattr(handler, method_name, self.wrap_handler_method(handler_name, method_name, method))
+
+
+    def wrap_handler_method(self, handler_name, method_name, method):
+        labels = { 'handler' : handler_name, 'method' : method_name }
+
+        def wrapper(*args, **kwargs):
+            t0 = time.time()
+            try:
+                result = method(*args, **kwargs)
+            except:
+                self.inc('handler_errors_total', labels)
+                raise
+            finally:
+                self.inc('handler_calls_total', labels)
+                self.observe('handler_seconds', labels, time.time() - t0)
+
+            if method_name == 'handle' and result:
+                self.inc('handler_accepted_total', labels)
+            return result
+
+        return wrapper
+
+
+    def instrument_store(self, store, store_name):
+        '''
+        Wraps a HistoryStore or TargetStore so that its writes are recorded.
+        '''
+        store_content = store.store_content
+        backend_write = store.backend.write
+        labels = { 'store' : store_name }
+
+        def store_content_wrapper(*args, **kwargs):
+            t0 = time.time()
+            try:
+                return store_content(*args, **kwargs)
+            except:
+                self.inc('store_errors_total', labels)
+                raise
+            finally:
+                self.inc('store_writes_total', labels)
+                self.observe('store_write_seconds', labels, time.time() - t0)
+
+        def backend_write_wrapper(store_path, entries):
+            # Storage backends return the numbers of entries and bytes they wrote,
+            # leaving out entries they already had.
+            num_entries, num_bytes = backend_write(store_path, entries)
+            self.inc('store_entries_total', labels, num_entries)
+            self.inc('store_bytes_total', labels, num_bytes)
+            return num_entries, num_bytes
+
+        store.store_content = store_content_wrapper
+        store.backend.write = backend_write_wrapper
+
+
+    def finish(self):
+        self.finished = time.time()
+
+
+    def summary(self):
+        '''
+        Returns all metrics as a JSON serializable dict.
+        '''
+        finished = self.finished or time.time()
+        with self.lock:
+            counters = [ { 'name' : name, 'labels' : dict(labels), 'value' : value }
+                         for (name, labels), value in sorted(self.counters.items()) ]
+            histograms = []
+            for (name, labels), h in sorted(self.histograms.items()):
+                histograms.append({
+                    'name' : name,
+                    'labels' : dict(labels),
+                    'count' : h.count,
+                    'sum' : h.sum,
+                    'mean' : h.sum / h.count if h.count else None,
+                    'max' : h.max,
+                    'p50' : h.quantile(0.5),
+                    'p90' : h.quantile(0.9),
+                    'p99' : h.quantile(0.99),
+                    'buckets' : [ [ bound, total ] for bound, total in zip(self.histogram_bounds(h), h.cumulative_counts()) ]
+                })
+
+        return {
+            'command' : self.command,
+            'started' : datetime.datetime.utcfromtimestamp(self.started).isoformat('T') + 'Z',
+            'finished' : datetime.datetime.utcfromtimestamp(finished).isoformat('T') + 'Z',
+            'seconds' : finished - self.started,
+            'counters' : counters,
+            'histograms' : histograms
+        }
+
+
+    def histogram_bounds(self, histogram):
+        return [ repr(float(b)) for b in histogram.buckets ] + [ '+Inf' ]
+
+
+    def prometheus_text(self):
+        '''
+        Returns all metrics in Prometheus text exposition format.
+        '''
+        finished = self.finished or time.time()
+        run_labels = (('command', self.command),)
+
+        # name -> list of (labels, value) samples
+        samples = {}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                samples.setdefault(name, []).append((run_labels + labels, value))
+            histograms = [ (name, run_labels + labels, h) for (name, labels), h in self.histograms.items() ]
+        samples['run_seconds'] = [ (run_labels, finished - self.started) ]
+        samples['run_timestamp_seconds'] = [ (run_labels, finished) ]
+
+        for name, labels, h in histograms:
+            samples.setdefault(name, [])
+
+        lines = []
+        for name in sorted(samples):
+            metric_type, help_text = METRICS[name]
+            full_name = '%s_%s' % (NAMESPACE, name)
+            lines.append('# HELP %s %s' % (full_name, help_text))
+            lines.append('# TYPE %s %s' % (full_name, metric_type))
+
+            if metric_type == 'histogram':
+                for h_name, labels, h in sorted(histograms, key=lambda x: x[:2]):
+                    if h_name != name:
+                        continue
+                    for bound, total in zip(self.histogram_bounds(h), h.cumulative_counts()):
+                        lines.append('%s_bucket%s %d' % (full_name, format_labels(labels + (('le', bound),)), total))
+                    lines.append('%s_sum%s %r' % (full_name, format_labels(labels), h.sum))
+                    lines.append('%s_count%s %d' % (full_name, format_labels(labels), h.count))
+            else:
+                for labels, value in sorted(samples[name]):
+                    lines.append('%s%s %r' % (full_name, format_labels(labels), value))
+
+        return '\n'.join(lines) + '\n'
+
+
+    def report(self):
+        '''
+        Prints where the time went, by handler method and by store.
+        '''
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+
+        def counter(name, labels):
+            return counters.get((name, labels), 0)
+
+        print('\n\n%s metrics:' % (self.command.capitalize()))
+        print('%-32s %-10s %8s %8s %8s %10s %10s' % ('handler', 'method', 'calls', 'accepted', 'errors', 'total s', 'max s'))
+        for (name, labels), h in sorted(histograms.items()):
+            if name == 'handler_seconds':
+                l = dict(labels)
+                print('%-32s %-10s %8d %8s %8d %10.2f %10.3f' % (l['handler'], l['method'], h.count,
+                    counter('handler_accepted_total', labels) if l['method'] == 'handle' else '',
+                    counter('handler_errors_total', labels), h.sum, h.max))
+
+        print('%-32s %8s %8s %12s %8s %10s %10s' % ('store', 'writes', 'entries', 'bytes', 'errors', 'total s', 'max s'))
+        for (name, labels), h in sorted(histograms.items()):
+            if name == 'store_write_seconds':
+                print('%-32s %8d %8d %12d %8d %10.2f %10.3f' % (dict(labels)['store'], h.count,
+                    counter('store_entries_total', labels), counter('store_bytes_total', labels),
+                    counter('store_errors_total', labels), h.sum, h.max))
+
+
+    def export(self, metrics_dir=None):
+        '''
+        Writes the JSON summary and Prometheus text file to metrics_dir, or to METRICS_DIR
+        from conf.yml. Does nothing if neither is set.
+        '''
+        metrics_dir = metrics_dir or self.app_conf.get('METRICS_DIR', None)
+        if not metrics_dir:
+            return
+
+        os.makedirs(metrics_dir, exist_ok=True)
+        write_atomically(os.path.join(metrics_dir, self.command + '.json'),
+            json.dumps(self.summary(), indent=2, sort_keys=True) + '\n')
+        write_atomically(os.path.join(metrics_dir, self.command + '.prom'), self.prometheus_text())
+
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, escape_label_value(value)) for name, value in labels) + '}'
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_atomically(filename, text):
+    # Temporary file starts with a dot, so that collectors ignore it.
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        # Readable by a collector running as another user.
+        os.chmod(tmp_filename, 0o644)
+        os.rename(tmp_filename, filename)
+    except:
+        os.remove(tmp_filename)
+        raise
@@ -0,0 +1,269 @@
+from __future__ import print_function
+import hashlib
+import os
+import os.path
+import re
+import sqlite3
+import threading
+import zlib
+
+import numpy as np
+
+from storage_backends import iter_partition_entries
+
+
+class NearDupIndex(object):
+    '''
+    A persistent MinHash/LSH index of the text of target entries stored under TARGET_DIR,
+    for recognizing near-duplicates, like a feed item syndicated by several feeds or a
+    video re-posted with a slightly different description.
+
+    DedupIndex recognizes only identical contents. Here, the contents of each entry are
+    broken into shingles (runs of SHINGLE_SIZE words), and two entries are near-duplicates
+    if the Jaccard similarity of their shingle sets is at least the threshold.
+
+    Each entry is summarized by a MinHash signature of NUM_PERM values, where the fraction
+    of values two signatures have in common estimates the Jaccard similarity of the
+    entries. Signatures are split into bands of rows, and entries with any identical band
+    are candidates, so an entry is compared only with the few stored entries likely to be
+    similar, not with all of them. Bands are sized so that pairs with about the threshold
+    similarity become candidates, and candidates are then checked against the threshold.
+
+    Only the first entry of each cluster of near-duplicates is indexed, as its representative.
+    Later near-duplicates are either not stored at all (action 'drop'), or stored with a
+    'near_duplicate_of' field holding the id of the representative (action 'flag'), which
+    the recommend job skips.
+
+    Like DedupIndex, the index is a SQLite database in TARGET_DIR, with a name starting with
+    an underscore so that Spark skips it. If it doesn't exist, or was built with different
+    settings, it's rebuilt from all stored entries.
+    '''
+
+    INDEX_FILE = '_near_dup_index.sqlite'
+    PARTITION_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+    ACTIONS = ('drop', 'flag')
+
+    DEFAULT_THRESHOLD = 0.8
+    NUM_PERM = 128
+    SHINGLE_SIZE = 3
+
+    # Smallest prime above 2^32. Shingle hashes are 32 bits, so hashes permuted
+    # with 32 bit a and b fit in 64 bits.
+    PRIME = 4294967311
+    SEED = 1
+
+    WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+    def __init__(self, data_dir, threshold=DEFAULT_THRESHOLD, action='drop'):
+        if not 0.0 < threshold <= 1.0:
+            raise RuntimeError('conf.yml error: NEAR_DUP threshold should be above 0 and at most 1, not %s' % (threshold))
+        if action not in self.ACTIONS:
+            raise RuntimeError('conf.yml error: unknown NEAR_DUP action %s. Should be one of %s' % (
+                action, ', '.join(self.ACTIONS)))
+
+        self.data_dir = data_dir
+        self.threshold = float(threshold)
+        self.action = action
+        self.num_near_dups = 0
+
+        self.rows = self.band_rows(self.NUM_PERM, self.threshold)
+        self.bands = self.NUM_PERM // self.rows
+
+        random_state = np.random.RandomState(self.SEED)
+        self.perm_a = random_state.randint(1, 1 << 32, size=self.NUM_PERM, dtype=np.uint64)
+        self.perm_b = random_state.randint(0, 1 << 32, size=self.NUM_PERM, dtype=np.uint64)
+
+        os.makedirs(data_dir, exist_ok=True)
+        index_filename = os.path.join(data_dir, self.INDEX_FILE)
+
+        # Stores may be called from multiple fetcher threads, so the connection
+        # is shared and serialized with a lock.
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(index_filename, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS docs (
+            id TEXT PRIMARY KEY,
+            partition TEXT,
+            signature BLOB)''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS bands (
+            band INTEGER,
+            key INTEGER,
+            id TEXT)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS bands_key ON bands (band, key)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS bands_id ON bands (id)')
+        self.conn.commit()
+
+        settings = 'perm=%d rows=%d shingle=%d seed=%d' % (self.NUM_PERM, self.rows, self.SHINGLE_SIZE, self.SEED)
+        row = self.conn.execute("SELECT value FROM settings WHERE name = 'settings'").fetchone()
+        if row is None or row[0] != settings:
+            self.rebuild(settings)
+
+
+    @staticmethod
+    def band_rows(num_perm, threshold):
+        '''
+        Returns the number of rows per band. Entries with similarity s share at least one
+        band with probability 1 - (1 - s^rows)^bands, which rises most steeply around
+        (1/bands)^(1/rows). Of the band sizes that put that point at or below the threshold,
+        so that near-duplicates are rarely missed, the one closest to it is chosen.
+        '''
+        best = 1
+        for rows in range(1, num_perm + 1):
+            if num_perm % rows == 0 and (1.0 / (num_perm // rows)) ** (1.0 / rows) <= threshold:
+                best = rows
+        return best
+
+
+    def rebuild(self, settings):
+        print('Building near-duplicate index for', self.data_dir)
+        with self.lock:
+            self.conn.execute('DELETE FROM docs')
+            self.conn.execute('DELETE FROM bands')
+            self.conn.execute('INSERT OR REPLACE INTO settings VALUES (?, ?)', ('settings', settings))
+            self.conn.commit()
+
+        count = 0
+        for partition in sorted(os.listdir(self.data_dir)):
+            partition_path = os.path.join(self.data_dir, partition)
+            if not self.PARTITION_PATTERN.match(partition) or not os.path.isdir(partition_path):
+                continue
+
+            # Entries already stored are all kept. Only those stored as near-duplicates
+            # aren't representatives.
+            representatives = []
+            for entry in iter_partition_entries(partition_path):
+                if entry.get('near_duplicate_of', None) is None:
+                    signature = self.signature(entry.get('contents', None))
+                    if signature is not None:
+                        representatives.append((entry, signature, self.band_keys(signature)))
+
+            self.add(partition, representatives)
+            count += len(representatives)
+
+        print('Near-duplicate index built from %d stored entries' % (count))
+
+
+    def shingles(self, contents):
+        words = self.WORD_PATTERN.findall(contents.lower())
+        if len(words) < self.SHINGLE_SIZE:
+            return set([ ' '.join(words) ]) if words else set()
+
+        return set(' '.join(words[i:i + self.SHINGLE_SIZE]) for i in range(len(words) - self.SHINGLE_SIZE + 1))
+
+
+    def signature(self, contents):
+        '''
+        Returns the MinHash signature of contents, as an array of NUM_PERM uint64 values,
+        or None if contents has no words.
+        '''
+        if not contents:
+            return None
+
+        shingles = self.shingles(contents)
+        if not shingles:
+            return None
+
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+        # Each of the NUM_PERM hash functions is (a * h + b) mod PRIME.
+        permuted = (np.outer(hashes, self.perm_a) + self.perm_b) % np.uint64(self.PRIME)
+        return permuted.min(axis=0)
+
+
+    def band_keys(self, signature):
+        keys = []
+        for band in range(self.bands):
+            data = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            keys.append((band, int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little', signed=True)))
+        return keys
+
+
+    def find(self, entry_id, signature, band_keys, batch):
+        '''
+        Returns the id of the most similar representative that's a near-duplicate of
+        signature, if any, among those indexed and those in batch.
+        '''
+        candidates = {}
+        for band_key in band_keys:
+            for (doc_id,) in self.conn.execute('SELECT id FROM bands WHERE band = ? AND key = ?', band_key):
+                candidates[doc_id] = None
+            for doc_id, doc_signature in batch.get(band_key, ()):
+                candidates[doc_id] = doc_signature
+
+        # The same entry stored again is not a near-duplicate of itself.
+        candidates.pop(entry_id, None)
+
+        best_id, best_similarity = None, 0.0
+        for doc_id, doc_signature in candidates.items():
+            if doc_signature is None:
+                row = self.conn.execute('SELECT signature FROM docs WHERE id = ?', (doc_id,)).fetchone()
+                if row is None:
+                    continue
+                doc_signature = np.frombuffer(row[0], dtype=np.uint64)
+
+            similarity = float(np.mean(doc_signature == signature))
+            if similarity >= self.threshold and similarity > best_similarity:
+                best_id, best_similarity = doc_id, similarity
+
+        return best_id
+
+
+    def check(self, entries):
+        '''
+        Finds near-duplicates among entries, of stored entries or of earlier entries in the list.
+
+        Returns (entries to store, representatives), where near-duplicates are left out of the
+        entries to store, or flagged with 'near_duplicate_of', depending on the action.
+        representatives is a list of (entry, signature, band keys) to be passed to add() once stored.
+        '''
+        to_store = []
+        representatives = []
+        # (band, key) -> [(id, signature)] of representatives in this list.
+        batch = {}
+
+        with self.lock:
+            for entry in entries:
+                signature = self.signature(entry.get('contents', None))
+                if signature is None:
+                    to_store.append(entry)
+                    continue
+
+                band_keys = self.band_keys(signature)
+                duplicate_of = self.find(entry['id'], signature, band_keys, batch)
+                if duplicate_of is None:
+                    to_store.append(entry)
+                    representatives.append((entry, signature, band_keys))
+                    for band_key in band_keys:
+                        batch.setdefault(band_key, []).append((entry['id'], signature))
+                    continue
+
+                self.num_near_dups += 1
+                if self.action == 'flag':
+                    entry['near_duplicate_of'] = duplicate_of
+                    to_store.append(entry)
+
+        return to_store, representatives
+
+
+    def add(self, partition, representatives):
+        '''
+        Indexes stored representatives, as returned by check().
+        '''
+        if not representatives:
+            return
+
+        with self.lock:
+            for entry, signature, band_keys in representatives:
+                self.conn.execute('DELETE FROM bands WHERE id = ?', (entry['id'],))
+                self.conn.execute('INSERT OR REPLACE INTO docs VALUES (?,?,?)',
+                    (entry['id'], partition, signature.astype(np.uint64).tobytes()))
+                self.conn.executemany('INSERT INTO bands VALUES (?,?,?)',
+                    [ (band, key, entry['id']) for band, key in band_keys ])
+            self.conn.commit()
+
+
+    def close(self):
+        with self.lock:
+            if self.num_near_dups:
+                print('Near-duplicate index: %d near-duplicate entries %s' % (
+                    self.num_near_dups, 'dropped' if self.action == 'drop' else 'flagged'))
+            self.conn.close()
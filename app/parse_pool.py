@@ -0,0 +1,141 @@
+'''
+A pool of worker processes that extract text from fetched pages.
+
+Extracting text from HTML is CPU bound, and in one Python process, pages fetched
+concurrently still get parsed one at a time behind the GIL. So handlers hand raw
+payloads to the process-wide `parse_pool`, which parses them in worker processes
+on all cores, and sends back just the extracted text:
+
+    extract = functools.partial(extract_comments, parser='lxml')
+    for key, text, error in parse_pool.parse_pool.map_unordered(extract, payloads):
+        ...
+
+A handler opts in by declaring an extract function. It's called in another process,
+so it must be a module-level function (or a functools.partial of one) taking the payload,
+like page bytes, and returning something small, like a string. Anything it needs, like
+a parser, it sets up itself, once per worker process (see hn_handler.extract_comments).
+
+PARSE_WORKERS in conf.yml sets the number of worker processes. Default is the number of
+CPUs. With 1, payloads are extracted in this process, as if there were no pool.
+Workers are started when first needed, and stopped by HistoryProcessor once all
+handlers have completed.
+'''
+from __future__ import print_function
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+
+class ParsePool(object):
+    '''
+    max_workers: number of worker processes. Default is the number of CPUs.
+    '''
+
+    # Payloads sent to workers and not yet extracted, per worker.
+    PENDING_PER_WORKER = 4
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor = None
+        self.lock = threading.Lock()
+
+
+    def conf_init(self, app_conf):
+        max_workers = max(1, int(app_conf.get('PARSE_WORKERS', None) or os.cpu_count() or 1))
+        with self.lock:
+            if max_workers != self.max_workers:
+                self.shutdown()
+                self.max_workers = max_workers
+
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                # Forking a process that has fetch and store threads running can copy
+                # locks held by those threads. A fork server forks from a clean process instead.
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else None)
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+            return self.executor
+
+
+    def map_unordered(self, extract, items):
+        '''
+        Calls extract(payload) for each payload, in worker processes, and yields the results
+        in the order they complete.
+
+        items:
+            an iterable of (key, payload) tuples. It's consumed only as fast as the workers
+            keep up, so it can be a generator of pages as they're fetched.
+
+        Yields (key, result, error) tuples. If extract raised an exception, result is None
+        and error is the exception.
+        '''
+        if self.max_workers <= 1:
+            for key, payload in items:
+                try:
+                    yield key, extract(payload), None
+                except Exception as e:
+                    yield key, None, e
+            return
+
+        executor = self.get_executor()
+        max_pending = self.max_workers * self.PENDING_PER_WORKER
+        pending = {}
+        items = iter(items)
+        exhausted = False
+
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                try:
+                    key, payload = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+
+                try:
+                    pending[executor.submit(extract, payload)] = key
+                except BrokenProcessPool:
+                    # A worker died, say killed for running out of memory. The rest
+                    # is extracted here rather than lost.
+                    print('Parse pool is broken, extracting the remaining payloads in this process')
+                    self.close()
+                    try:
+                        yield key, extract(payload), None
+                    except Exception as e:
+                        yield key, None, e
+                    for key, result, error in ParsePool(max_workers=1).map_unordered(extract, items):
+                        yield key, result, error
+                    exhausted = True
+                    break
+
+            if not pending:
+                return
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                try:
+                    yield key, future.result(), None
+                except Exception as e:
+                    yield key, None, e
+
+
+    def shutdown(self):
+        '''
+        Stops the worker processes. They're started again if the pool is used again.
+        '''
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+
+    def close(self):
+        with self.lock:
+            self.shutdown()
+
+
+
+parse_pool = ParsePool()
@@ -6,50 +6,229 @@ from pprint import pprint
 import sys
 import argparse
 import subprocess
+import shutil
+import tempfile
+
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import urlopen
 
 from history import HistoryProcessor
 from history_store import HistoryStore
+from metrics import Metrics
 
 from targets import TargetsProcessor
 from target_store import TargetStore
 
+import date_partitions
+from results import ResultRenderer, ResultTimeout, follow_records
+
 def recommend(args, app_conf):
-    proc_path = os.path.join(
-        args.spark_dir if args.spark_dir is not None else '/root/spark/stockspark/spark-2.1.1-bin-hadoop2.7/',
-        'bin/spark-submit')
+    history_paths = window_partitions(args.history_dir, args.history_since, args.history_days)
+    target_paths = window_partitions(args.target_dir, args.targets_since, args.targets_days)
+    
+    if args.engine == 'local':
+        # Imported only when needed, so that NumPy and SciPy are required only
+        # for the local engine.
+        import local_lda
+        local_lda.recommend(history_paths, target_paths, 
+            int(args.num_topics), int(args.num_iterations),
+            metric=args.similarity, num_threads=args.threads,
+            model_dir=args.model_dir if args.model_dir is not None else app_conf.get('MODEL_DIR', None),
+            vocabulary_file=app_conf.get('VOCABULARY_FILE', None),
+            vocab_options=local_lda.VocabularyOptions(**vocabulary_options(args)))
+        return
+        
+    history_path = date_partitions.glob_path(history_paths)
+    target_path = date_partitions.glob_path(target_paths)
+    
+    if args.server is not None:
+        if vocabulary_options(args):
+            print('Vocabulary options are ignored with --server. Those the server was started with apply.',
+                file=sys.stderr)
+        recommend_from_server(args, history_path, target_path)
+        return
         
     proc_args = [
-        proc_path,
-        args.spark_job_jarpath if args.spark_job_jarpath is not None else '/root/spark/lda-prototype.jar',
-        args.history_dir,
-        args.target_dir,
+        spark_submit_path(args),
+        spark_job_jarpath(args),
+        history_path,
+        target_path,
         args.num_topics,
         args.num_iterations,
         'em',
         'custom_stopwords.txt'
-    ]
+    ] + spark_job_options(args, app_conf)
+    
+    timeout = args.timeout if args.timeout is not None else app_conf.get('RECOMMEND_TIMEOUT', None)
+    run_spark_job(proc_args, app_conf, timeout)
+    
+    
+def run_spark_job(proc_args, app_conf, timeout=None):
+    '''
+    Runs the Spark job, rendering its results as it writes them to a results file.
+    All other output of spark-submit goes to a log file, which is shown only if the job fails.
+    '''
+    log_dir = os.path.join(app_conf['CACHE_DIR'], 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    log_filename = os.path.join(log_dir, 'recommend-spark.log')
+    
+    work_dir = tempfile.mkdtemp(prefix='recommend-')
+    results_filename = os.path.join(work_dir, 'results.jsonl')
+    # Created before the job starts, so that it can be followed right away.
+    open(results_filename, 'w').close()
+    
+    renderer = ResultRenderer()
+    try:
+        with open(log_filename, 'w') as log_file:
+            p = subprocess.Popen(proc_args + [ '--results', results_filename ], 
+                stdout=log_file, stderr=subprocess.STDOUT)
+            
+            done = False
+            try:
+                for record in follow_records(results_filename, p, timeout):
+                    renderer.render(record)
+                    done = done or record.get('type', None) == 'done'
+                    
+            except ResultTimeout as e:
+                print(e, '- stopping the Spark job', file=sys.stderr)
+                p.terminate()
+                
+            finally:
+                p.wait()
+                
+        if not done:
+            print('The Spark job failed with exit code %s. Its log is in %s:\n' % (p.returncode, log_filename), 
+                file=sys.stderr)
+            with open(log_filename, 'r') as log_file:
+                print(''.join(log_file.readlines()[-40:]), file=sys.stderr)
+            sys.exit(1)
+            
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    
+def recommend_from_server(args, history_path, target_path):
+    query = urlencode({
+        'history' : os.path.abspath(history_path),
+        'targets' : os.path.abspath(target_path),
+        'topics' : args.num_topics,
+        'iterations' : args.num_iterations,
+        'algo' : 'em'
+    })
+    url = args.server.rstrip('/') + '/recommend?' + query
+    
+    try:
+        resp = urlopen(url)
+    except HTTPError as e:
+        print(e.read().decode('utf-8'), file=sys.stderr)
+        sys.exit(1)
+        
+    print(resp.read().decode('utf-8'))
+    
+    
+def window_partitions(data_dir, since, days):
+    '''
+    Returns the list of date partitions of data_dir in the window, or just
+    [ data_dir ] if no window is given.
+    '''
+    if since is None and days is None:
+        return [ data_dir ]
+        
+    paths = date_partitions.select_partitions(data_dir, since, days)
+    if not paths:
+        print('No date directories under %s since %s' % (data_dir, date_partitions.window_start(since, days)), 
+            file=sys.stderr)
+        sys.exit(1)
+        
+    return paths
+    
+    
+def serve(args, app_conf):
+    proc_args = [
+        spark_submit_path(args),
+        '--class', 'com.pathbreak.lda.LdaServer',
+        spark_job_jarpath(args),
+        str(args.port),
+        'custom_stopwords.txt'
+    ] + spark_job_options(args, app_conf)
     
-    p = subprocess.Popen(proc_args, stdout=subprocess.PIPE)
- 
-    stdoutdata, stderrdata = p.communicate()
-    print(stdoutdata.decode('utf-8'))
+    # Runs in the foreground until it's interrupted.
+    p = subprocess.Popen(proc_args)
+    try:
+        p.wait()
+    except KeyboardInterrupt:
+        p.terminate()
+        p.wait()
+    
+    
+def spark_submit_path(args):
+    return os.path.join(
+        args.spark_dir if args.spark_dir is not None else '/root/spark/stockspark/spark-2.1.1-bin-hadoop2.7/',
+        'bin/spark-submit')
+        
+        
+def spark_job_jarpath(args):
+    return args.spark_job_jarpath if args.spark_job_jarpath is not None else '/root/spark/lda-prototype.jar'
+        
+        
+def spark_job_options(args, app_conf):
+    options = []
+    
+    model_dir = args.model_dir if args.model_dir is not None else app_conf.get('MODEL_DIR', None)
+    if model_dir:
+        options += [ '--model-dir', model_dir ]
+        
+    # Makes the job use term counts stored with entries instead of tokenizing their contents.
+    if app_conf.get('VOCABULARY_FILE', None):
+        options += [ '--vocabulary', app_conf['VOCABULARY_FILE'] ]
+        
+    for name, value in sorted(vocabulary_options(args).items()):
+        options += [ '--' + name.replace('_', '-'), str(value) ]
+        
+    return options
+    
+    
+def vocabulary_options(args):
+    '''
+    Returns the vocabulary options given on the command line, as a dict of 
+    local_lda.VocabularyOptions arguments.
+    '''
+    return { name : getattr(args, name) for name in VOCABULARY_OPTIONS if getattr(args, name, None) is not None }
     
     
 def upload(args, app_conf):
+    metrics = Metrics('upload', app_conf)
     history_store = HistoryStore(app_conf)
-    history = HistoryProcessor(app_conf)
-    history.process_history(args.history_filepath, history_store)
+    metrics.instrument_store(history_store, 'history')
+    history = HistoryProcessor(app_conf, metrics)
+    try:
+        history.process_history(args.history_filepath, history_store)
+    finally:
+        history_store.close()
+        report_metrics(metrics, args)
     
 def fetch(args, app_conf):
+    metrics = Metrics('fetch', app_conf)
     target_store = TargetStore(app_conf)    
-    targets_proc = TargetsProcessor(app_conf)
-    targets_proc.fetch(target_store)
+    metrics.instrument_store(target_store, 'target')
+    targets_proc = TargetsProcessor(app_conf, metrics)
+    try:
+        targets_proc.fetch(target_store, concurrency=args.concurrency, timeout=args.timeout)
+    finally:
+        target_store.close()
+        report_metrics(metrics, args)
+    
+def report_metrics(metrics, args):
+    metrics.finish()
+    metrics.report()
+    metrics.export(args.metrics_dir)
     
     
 def read_conf():
     conf_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'conf')
     with open(os.path.join(conf_dir, 'conf.yml'), 'r') as conf_file:
-        app_conf = yaml.load(conf_file)
+        app_conf = yaml.safe_load(conf_file)
     
     # Adjust relative paths.
     if app_conf['HISTORY_DIR'].startswith('.'):
@@ -58,10 +237,47 @@ def read_conf():
     if app_conf['TARGET_DIR'].startswith('.'):
         app_conf['TARGET_DIR'] = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), app_conf['TARGET_DIR']))
         
+    # Directory for caches and state that can be safely deleted. Default is ./cache
+    app_conf.setdefault('CACHE_DIR', './cache')
+    if app_conf['CACHE_DIR'].startswith('.'):
+        app_conf['CACHE_DIR'] = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), app_conf['CACHE_DIR']))
+        
+    # Directory where the Spark job saves fitted models. Default is CACHE_DIR/models
+    if 'MODEL_DIR' not in app_conf:
+        app_conf['MODEL_DIR'] = os.path.join(app_conf['CACHE_DIR'], 'models')
+    elif app_conf['MODEL_DIR'] and app_conf['MODEL_DIR'].startswith('.'):
+        app_conf['MODEL_DIR'] = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), app_conf['MODEL_DIR']))
+        
+    if app_conf.get('METRICS_DIR', None) and app_conf['METRICS_DIR'].startswith('.'):
+        app_conf['METRICS_DIR'] = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), app_conf['METRICS_DIR']))
+        
+    if app_conf.get('VOCABULARY_FILE', None) and app_conf['VOCABULARY_FILE'].startswith('.'):
+        app_conf['VOCABULARY_FILE'] = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), app_conf['VOCABULARY_FILE']))
+        
     app_conf['CONF_DIR'] = conf_dir
     
     return app_conf
 
+VOCABULARY_OPTIONS = [ 'vocab_size', 'min_df', 'min_tf', 'max_df', 'hashing_features' ]
+
+def add_vocabulary_arguments(parser):
+    parser.add_argument('--vocab-size', dest='vocab_size', metavar='N', type=int, required=False,
+        help='(Optional) Keep only the N terms most frequent across history documents. Default: 262144')
+    parser.add_argument('--min-df', dest='min_df', metavar='X', type=float, required=False,
+        help='(Optional) Keep only terms in at least X history documents, or at least that fraction '
+            'of them if X is below 1. Default: 1')
+    parser.add_argument('--min-tf', dest='min_tf', metavar='X', type=float, required=False,
+        help='(Optional) Count a term in a document only if it occurs at least X times in it, '
+            'or at least that fraction of its terms if X is below 1. Default: 1')
+    parser.add_argument('--max-df', dest='max_df', metavar='X', type=float, required=False,
+        help='(Optional) Leave out terms in more than X history documents, or more than that fraction '
+            'of them if X is below 1. Default: no limit')
+    parser.add_argument('--hashing-features', dest='hashing_features', metavar='N', type=int, required=False,
+        help='(Optional) Hash terms into N features instead of fitting a vocabulary, so that the size of '
+            'topic matrices stays fixed however many distinct terms history has. '
+            'The other vocabulary options then don\'t apply.')
+            
+            
 def configure_arguments_parser():
     parser = argparse.ArgumentParser()
     
@@ -76,18 +292,73 @@ def configure_arguments_parser():
         help='Number of topics to discover. This depends on your interest and perceived quality of recommendations')
     recommend_parser.add_argument(dest='num_iterations', metavar='NUMBER-OF-ITERATIONS', 
         help='Number of iterations for LDA to execute.')
+    history_window = recommend_parser.add_mutually_exclusive_group()
+    history_window.add_argument('--history-since', dest='history_since', metavar='YYYY-MM-DD', required=False,
+        help='(Optional) Use only history stored on or after this date. HISTORY-DIRECTORY should then be '
+            'the directory containing the date directories, like HISTORY_DIR.')
+    history_window.add_argument('--history-days', dest='history_days', metavar='N', type=int, required=False,
+        help='(Optional) Use only history stored in the last N days, including today.')
+    targets_window = recommend_parser.add_mutually_exclusive_group()
+    targets_window.add_argument('--targets-since', dest='targets_since', metavar='YYYY-MM-DD', required=False,
+        help='(Optional) Use only targets fetched on or after this date. TARGET-DIRECTORY should then be '
+            'the directory containing the date directories, like TARGET_DIR.')
+    targets_window.add_argument('--targets-days', dest='targets_days', metavar='N', type=int, required=False,
+        help='(Optional) Use only targets fetched in the last N days, including today.')
     recommend_parser.add_argument('--spark-dir', dest='spark_dir', metavar='SPARK-INSTALLATION-DIRECTORY', required=False,
         help='(Optional) Path of a Spark installation. Default: /root/spark/stockspark/spark-2.1.1-bin-hadoop2.7')
     recommend_parser.add_argument('--spark-jar', dest='spark_job_jarpath', metavar='SPARK-JOB-JAR-PATH', required=False,
         help='(Optional) Path of the Spark Job JAR. Default: /root/spark/lda-prototype.jar')
+    recommend_parser.add_argument('--model-dir', dest='model_dir', metavar='MODEL-DIRECTORY', required=False,
+        help='(Optional) Directory where fitted models are saved, and reused while '
+            'history documents and parameters are unchanged. Default: MODEL_DIR from conf.yml')
+    recommend_parser.add_argument('--timeout', dest='timeout', metavar='SECONDS', type=float, required=False,
+        help='(Optional) Stop the Spark job if it hasn\'t finished in this many seconds. '
+            'Default: RECOMMEND_TIMEOUT from conf.yml, or no timeout')
+    recommend_parser.add_argument('--engine', dest='engine', choices=['spark', 'local'], default='spark',
+        help='(Optional) "spark" runs the LDA job with spark-submit. "local" runs LDA in this process '
+            'using NumPy, which is much faster for small volumes of history and targets. Default: spark')
+    recommend_parser.add_argument('--similarity', dest='similarity', choices=['euclidean', 'cosine', 'hellinger'], 
+        default='euclidean',
+        help='(Optional) Distance between topic distributions used by the local engine. Default: euclidean')
+    recommend_parser.add_argument('--threads', dest='threads', metavar='N', type=int, required=False,
+        help='(Optional) Number of threads used by the local engine. Default: number of cores')
+    recommend_parser.add_argument('--server', dest='server', metavar='SERVER-URL', required=False,
+        help='(Optional) URL of a recommender server started with the serve command, like http://127.0.0.1:8970 . '
+            'The Spark engine then runs in the server instead of a new Spark application.')
+    add_vocabulary_arguments(recommend_parser)
         
     upload_parser = actions.add_parser('upload', help='Upload a browsing history JSON file')
     upload_parser.add_argument(dest='history_filepath', metavar='JSON-FILEPATH', 
         help='File path of browsing history JSON file.')
+    upload_parser.add_argument('--metrics-dir', dest='metrics_dir', metavar='METRICS-DIRECTORY', required=False,
+        help='(Optional) Directory to write upload.json and upload.prom metrics files to. Default: METRICS_DIR from conf.yml')
 
     fetch_parser = actions.add_parser('fetch', help='Download content from all configured targets (mainly meant for cron job)')
+    fetch_parser.add_argument('--concurrency', dest='concurrency', metavar='N', type=int, required=False,
+        help='(Optional) Number of targets fetched at the same time. Default: FETCH_CONCURRENCY from conf.yml')
+    fetch_parser.add_argument('--timeout', dest='timeout', metavar='SECONDS', type=float, required=False,
+        help='(Optional) Maximum time to wait for any single target. Default: FETCH_TIMEOUT from conf.yml')
+    fetch_parser.add_argument('--metrics-dir', dest='metrics_dir', metavar='METRICS-DIRECTORY', required=False,
+        help='(Optional) Directory to write fetch.json and fetch.prom metrics files to. Default: METRICS_DIR from conf.yml')
+    
+    serve_parser = actions.add_parser('serve', 
+        help='Run a recommender server that keeps Spark, documents and models in memory between recommend --server calls')
+    serve_parser.add_argument('--port', dest='port', metavar='PORT', type=int, default=8970,
+        help='(Optional) Port to listen on. The server listens only on the loopback interface. Default: 8970')
+    serve_parser.add_argument('--spark-dir', dest='spark_dir', metavar='SPARK-INSTALLATION-DIRECTORY', required=False,
+        help='(Optional) Path of a Spark installation. Default: /root/spark/stockspark/spark-2.1.1-bin-hadoop2.7')
+    serve_parser.add_argument('--spark-jar', dest='spark_job_jarpath', metavar='SPARK-JOB-JAR-PATH', required=False,
+        help='(Optional) Path of the Spark Job JAR. Default: /root/spark/lda-prototype.jar')
+    serve_parser.add_argument('--model-dir', dest='model_dir', metavar='MODEL-DIRECTORY', required=False,
+        help='(Optional) Directory where the server saves fitted models, and reuses them after a restart. '
+            'Default: MODEL_DIR from conf.yml')
+    add_vocabulary_arguments(serve_parser)
     
     args = parser.parse_args()
+    
+    if getattr(args, 'hashing_features', None) is not None and len(vocabulary_options(args)) > 1:
+        parser.error('--hashing-features can\'t be combined with other vocabulary options')
+        
     return args, parser
     
 
@@ -97,7 +368,8 @@ if __name__ == '__main__':
     command_handlers = {
         'recommend' : recommend,
         'upload' : upload,
-        'fetch': fetch
+        'fetch': fetch,
+        'serve': serve
     }
     handler = command_handlers.get(args.cmd, None)
     if handler is None:
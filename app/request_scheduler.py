@@ -0,0 +1,335 @@
+'''
+Rate limits, quota accounting and retries shared by everything that makes outbound requests.
+
+Handlers register the APIs and hosts they talk to with the process-wide `scheduler`, and
+make every request through the RequestLimit they get back:
+
+    self.hn_limit = request_scheduler.scheduler.register('hn')
+    ...
+    resp = self.hn_limit.call(session.get, url)
+
+For each registered name, RATE_LIMITS in conf.yml can set:
+
+    rate:           requests per second, sustained. Default is no limit.
+    burst:          requests that may be made at once after being idle. Default is max(1, rate).
+    daily_quota:    units that may be spent per day. Default is no quota.
+
+Rate limits are token buckets. A request waits until its bucket has a token, so a handler
+with many workers gets as much throughput as the limit allows and no more.
+
+Quota is for APIs like YouTube's, where every call has a cost in units (see QUOTA_COSTS)
+and a daily budget. Spent units are saved under CACHE_DIR/quota, so upload and every
+fetch run share the same budget. A call that would go over budget raises QuotaExceeded
+without being made.
+
+Failed calls are retried up to REQUEST_MAX_RETRIES times with exponential backoff and full
+jitter, honouring any Retry-After the server sends. Only transient failures are retried:
+connection errors, timeouts, 429, 5xx, and YouTube's rate limit errors. Exhausting the daily
+YouTube quota (403 quotaExceeded) is not transient, and isn't retried.
+'''
+from __future__ import print_function
+import datetime
+import fcntl
+import json
+import os
+import os.path
+import random
+import socket
+import threading
+import time
+
+# Quota units of YouTube Data API v3 calls, per
+# https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+    'youtube.videos.list' : 3,      # part=snippet
+    'youtube.search.list' : 100,
+}
+
+RETRY_STATUSES = frozenset([ 408, 429, 500, 502, 503, 504 ])
+
+# Reasons of YouTube 403 errors that go away if retried later. Others, like quotaExceeded, don't.
+RETRY_REASONS = frozenset([ 'rateLimitExceeded', 'userRateLimitExceeded' ])
+
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF_BASE = 0.5      # Seconds
+DEFAULT_BACKOFF_MAX = 60.0
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class RetryableError(Exception):
+    '''
+    Raised by a call to have it retried, like when a response has a retryable status
+    but the client library doesn't raise an exception for it.
+    '''
+    def __init__(self, message, retry_after=None):
+        super(RetryableError, self).__init__(message)
+        self.retry_after = retry_after
+
+
+
+class TokenBucket(object):
+    '''
+    Allows 'rate' acquisitions per second on average, and up to 'burst' at once.
+    '''
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, self.rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+
+    def acquire(self, tokens=1):
+        '''
+        Blocks until the tokens are available, and takes them. Returns the seconds waited.
+        '''
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+
+                wait = (tokens - self.tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+
+
+class QuotaLedger(object):
+    '''
+    Units of a daily quota spent so far, in CACHE_DIR/quota/<name>.json.
+
+    The file is locked while it's updated, since upload and fetch may run at the same time.
+    YouTube quotas reset at midnight Pacific Time, so days are counted in UTC-8.
+    '''
+    DAY_OFFSET = datetime.timedelta(hours=-8)
+
+    def __init__(self, cache_dir, name, daily_quota):
+        self.daily_quota = int(daily_quota)
+        self.quota_dir = os.path.join(cache_dir, 'quota')
+        self.filename = os.path.join(self.quota_dir, name + '.json')
+        self.lock = threading.Lock()
+
+
+    def charge(self, units):
+        '''
+        Records the units as spent, or raises QuotaExceeded if they would take today's
+        total over the daily quota.
+        '''
+        today = (datetime.datetime.utcnow() + self.DAY_OFFSET).strftime('%Y-%m-%d')
+
+        with self.lock:
+            os.makedirs(self.quota_dir, exist_ok=True)
+            with open(self.filename, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    text = f.read()
+                    state = json.loads(text) if text.strip() else {}
+                    used = state.get('used', 0) if state.get('day', None) == today else 0
+
+                    if used + units > self.daily_quota:
+                        raise QuotaExceeded('Daily quota of %d units would be exceeded: %d used, %d more needed' % (
+                            self.daily_quota, used, units))
+
+                    f.seek(0)
+                    f.truncate()
+                    json.dump({ 'day' : today, 'used' : used + units }, f)
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+            return used + units
+
+
+
+class RequestLimit(object):
+    '''
+    The rate limit, quota and retry policy of one registered API or host.
+    '''
+    def __init__(self, name, rate=None, burst=None, quota=None, max_retries=DEFAULT_MAX_RETRIES,
+            backoff_base=DEFAULT_BACKOFF_BASE, backoff_max=DEFAULT_BACKOFF_MAX):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.quota = quota
+        self.max_retries = int(max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.random = random.Random()
+
+
+    def call(self, func, *args, **kwargs):
+        '''
+        Calls func(*args, **kwargs) within the rate limit, retrying transient failures.
+        Returns what func returns, or raises the last failure once retries run out.
+
+        cost: (keyword) quota units of each attempt. Default is 1.
+        '''
+        cost = kwargs.pop('cost', 1)
+        attempt = 0
+
+        while True:
+            if self.bucket is not None:
+                self.bucket.acquire()
+            if self.quota is not None:
+                # Failed calls count against YouTube quota too.
+                self.quota.charge(cost)
+
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                retryable, retry_after = classify_error(e)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+
+                delay = self.backoff_delay(attempt, retry_after)
+                attempt += 1
+                print('%s: request failed (%s), retry %d of %d in %.1f s' % (
+                    self.name, describe_error(e), attempt, self.max_retries, delay))
+                time.sleep(delay)
+
+
+    def backoff_delay(self, attempt, retry_after=None):
+        '''
+        Full jitter: a random delay up to base * 2^attempt, so that clients that failed
+        together don't all retry together. A server's Retry-After is a lower bound.
+        '''
+        delay = self.random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(self.backoff_max, retry_after))
+        return delay
+
+
+
+class RequestScheduler(object):
+    '''
+    Registrar of RequestLimits. Registering the same name again returns the same RequestLimit,
+    so that all handlers talking to the same API share its limits.
+    '''
+    def __init__(self):
+        self.app_conf = {}
+        self.limits = {}
+        self.lock = threading.Lock()
+
+
+    def conf_init(self, app_conf):
+        with self.lock:
+            if app_conf is not self.app_conf:
+                # Limits registered under an earlier configuration no longer apply.
+                self.limits = {}
+            self.app_conf = app_conf
+
+
+    def register(self, name, rate=None, burst=None, daily_quota=None):
+        '''
+        name: name of an API like 'youtube', or a host name.
+
+        rate, burst, daily_quota: defaults used if RATE_LIMITS in conf.yml has nothing for name.
+        '''
+        with self.lock:
+            limit = self.limits.get(name, None)
+            if limit is not None:
+                return limit
+
+            limit_conf = (self.app_conf.get('RATE_LIMITS', None) or {}).get(name, None) or {}
+            rate = limit_conf.get('rate', rate)
+            burst = limit_conf.get('burst', burst)
+            daily_quota = limit_conf.get('daily_quota', daily_quota)
+
+            quota = None
+            if daily_quota:
+                quota = QuotaLedger(self.app_conf.get('CACHE_DIR', './cache'), name, daily_quota)
+
+            limit = RequestLimit(name, rate, burst, quota,
+                max_retries=self.app_conf.get('REQUEST_MAX_RETRIES', DEFAULT_MAX_RETRIES))
+            self.limits[name] = limit
+            return limit
+
+
+
+def classify_error(e):
+    '''
+    Returns (retryable, retry_after seconds or None) for an exception raised by a request.
+    '''
+    if isinstance(e, RetryableError):
+        return True, e.retry_after
+
+    if isinstance(e, QuotaExceeded):
+        return False, None
+
+    # requests
+    try:
+        import requests
+        if isinstance(e, requests.exceptions.SSLError):
+            # A certificate error, which requests raises as a ConnectionError.
+            return False, None
+        if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+            return True, None
+        if isinstance(e, requests.HTTPError) and e.response is not None:
+            return e.response.status_code in RETRY_STATUSES, parse_retry_after(e.response.headers.get('Retry-After', None))
+        if isinstance(e, requests.RequestException):
+            # Like an invalid URL, which won't be any different when retried.
+            return False, None
+    except ImportError:
+        pass
+
+    # Google API client
+    try:
+        from googleapiclient.errors import HttpError
+        if isinstance(e, HttpError):
+            status = int(e.resp.status)
+            retry_after = parse_retry_after(e.resp.get('retry-after', None))
+            if status in RETRY_STATUSES:
+                return True, retry_after
+            if status == 403:
+                return youtube_error_reason(e) in RETRY_REASONS, retry_after
+            return False, None
+    except ImportError:
+        pass
+
+    # Lower level network errors, like those raised by httplib2 or urllib. Other OSErrors,
+    # like certificate or file errors, won't be any different when retried, and each
+    # attempt would be charged to the quota.
+    if isinstance(e, (ConnectionError, TimeoutError, socket.timeout, socket.gaierror)):
+        return True, None
+    try:
+        import httplib2
+        if isinstance(e, httplib2.ServerNotFoundError):
+            return True, None
+    except ImportError:
+        pass
+
+    return False, None
+
+
+def youtube_error_reason(e):
+    try:
+        error = json.loads(e.content.decode('utf-8'))['error']
+        return error['errors'][0]['reason']
+    except Exception:
+        return None
+
+
+def parse_retry_after(value):
+    # Only the delay-seconds form. HTTP dates are rare enough to ignore.
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def describe_error(e):
+    text = str(e).strip().split('\n')[0]
+    return '%s: %s' % (type(e).__name__, text[:200]) if text else type(e).__name__
+
+
+scheduler = RequestScheduler()
@@ -0,0 +1,141 @@
+'''
+Results of recommend as JSON-line records, and their rendering as text.
+
+The Spark job writes its results with --results FILE (see ResultWriter.scala), and the
+local engine produces the same records. Records are:
+
+    {"type": "stage", "name": "fit", "seconds": 12.5}
+    {"type": "vocabulary", "features": 5000, "hashing": false, "documents": 1200,
+        "nonzeros": 90000, "density": 0.015, "terms_per_document": 75.0, "topic_matrix_bytes": 800000}
+    {"type": "recommendation", "rank": 1, "distance": 0.01,
+        "target": {"title": ..., "url": ..., "topics": [...]},
+        "history": {"title": ..., "url": ..., "topics": [...]}}
+    {"type": "topic", "topic": 0, "terms": [["term", 0.05], ...]}
+    {"type": "done", "seconds": 30.1}
+
+ResultRenderer prints them in the same text format that the Spark job prints.
+'''
+from __future__ import print_function
+import json
+import sys
+import time
+
+
+class ResultTimeout(Exception):
+    pass
+
+
+def format_vector(v):
+    return '[' + ','.join(repr(float(x)) for x in v) + ']'
+
+
+def format_vocabulary(record):
+    # Same text as VocabularyStats.text in LdaPipeline.scala.
+    return ('Vocabulary: %d %s, %d documents, %.1f terms per document, density %.4f%%, topic matrix %.1f MB' % (
+        record['features'], 'hashed features' if record['hashing'] else 'terms', record['documents'],
+        record['terms_per_document'], record['density'] * 100, record['topic_matrix_bytes'] / 1e6))
+
+
+class ResultRenderer(object):
+    '''
+    Prints records as they're rendered, followed by the timings of all stages and
+    the vocabulary statistics at the end.
+    '''
+
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+        self.stages = []
+        self.vocabulary = None
+        self.started_recommendations = False
+        self.started_topics = False
+
+
+    def render(self, record):
+        record_type = record.get('type', None)
+
+        if record_type == 'stage':
+            self.stages.append((record['name'], record['seconds']))
+
+        elif record_type == 'vocabulary':
+            self.vocabulary = record
+
+        elif record_type == 'recommendation':
+            self.start_recommendations()
+            target = record['target']
+            history = record['history']
+            self.write("\nRecommendation:\n\t%s\n\t%s\n\n" % (target['title'], target['url']))
+            self.write("\tTopics: %s\n\n" % (format_vector(target['topics'])))
+            self.write("  based on:\n\t%s\n\t%s\n\n" % (history['title'], history['url']))
+            self.write("\tTopics: %s\n\n" % (format_vector(history['topics'])))
+
+        elif record_type == 'topic':
+            self.start_recommendations()
+            if not self.started_topics:
+                self.write("Topics:\n")
+                self.started_topics = True
+            self.write("\n\tTopic %d:\n" % (record['topic']))
+            for term, weight in record['terms']:
+                self.write("\t\t%s : %r\n" % (term, float(weight)))
+
+        elif record_type == 'done':
+            self.start_recommendations()
+            self.write("Time taken for LDA:%s s\n" % (record['seconds']))
+            if self.stages:
+                self.write("\nStage timings:\n")
+                for name, seconds in self.stages:
+                    self.write("\t%-20s %8.2f s\n" % (name, seconds))
+            if self.vocabulary is not None:
+                self.write("\n%s\n" % (format_vocabulary(self.vocabulary)))
+
+        self.out.flush()
+
+
+    def start_recommendations(self):
+        if not self.started_recommendations:
+            self.write("\n\nRecommendations:\n\n\n")
+            self.started_recommendations = True
+
+
+    def write(self, text):
+        self.out.write(text)
+
+
+
+def follow_records(results_filename, proc, timeout=None, poll_interval=0.2):
+    '''
+    Yields records from a results file as a running process writes them, until the
+    "done" record or until the process exits.
+
+    Raises ResultTimeout if the process is still running after timeout seconds.
+    '''
+    deadline = time.time() + timeout if timeout else None
+    buf = ''
+
+    with open(results_filename, 'r') as f:
+        while True:
+            chunk = f.read()
+            if chunk:
+                buf += chunk
+                # A line without a newline is still being written.
+                lines = buf.split('\n')
+                buf = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        record = json.loads(line)
+                        yield record
+                        if record.get('type', None) == 'done':
+                            return
+                continue
+
+            if proc.poll() is not None:
+                # Anything written just before the process exited.
+                rest = f.read()
+                for line in (buf + rest).split('\n'):
+                    if line.strip():
+                        yield json.loads(line)
+                return
+
+            if deadline is not None and time.time() > deadline:
+                raise ResultTimeout('No complete results after %s seconds' % (timeout))
+
+            time.sleep(poll_interval)
@@ -0,0 +1,346 @@
+from __future__ import print_function
+import json
+import os
+import os.path
+import threading
+
+
+def create_storage_backend(app_conf):
+    '''
+    Returns the storage backend configured by STORAGE_BACKEND in conf.yml.
+    If it's not configured, the original one-file-per-entry layout is used.
+    '''
+    backend_name = app_conf.get('STORAGE_BACKEND', 'files')
+    backend_type = STORAGE_BACKENDS.get(backend_name, None)
+    if backend_type is None:
+        raise RuntimeError('conf.yml error: unknown STORAGE_BACKEND %s. Should be one of %s' % (
+            backend_name, ', '.join(sorted(STORAGE_BACKENDS.keys()))))
+
+    return backend_type(app_conf)
+
+
+
+def iter_partition_entries(partition_path):
+    '''
+    Yields every entry stored in a date partition directory, regardless of which backend
+    stored them. Both backends write one complete JSON document per line, so every 
+    non-hidden file is simply read line by line, the same way spark.read.json does.
+    '''
+    for filename in sorted(os.listdir(partition_path)):
+        if filename.startswith('_') or filename.startswith('.'):
+            continue
+            
+        filepath = os.path.join(partition_path, filename)
+        if not os.path.isfile(filepath):
+            continue
+            
+        with open(filepath, 'r') as entries_file:
+            for line in entries_file:
+                # A last line without a newline was cut short by a crash while it was 
+                # being appended. It's not in the segment index, and gets truncated
+                # the next time the partition is written to.
+                if not line.endswith('\n') and filename.startswith('segment-'):
+                    break
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+
+class FileStorageBackend(object):
+    '''
+    Saves each entry in its own JSON file named after the entry's id.
+
+        # <store_path>/
+        #     <id1>.json
+        #     <id2>.json
+        #         ...
+
+    Simple, but creates one inode per entry, and Spark has to list and open every
+    single file.
+
+    Each file is written under a temporary name starting with a dot, which Spark skips,
+    and renamed once it's complete. So a crash never leaves a partly written entry
+    where Spark would read it.
+    '''
+    def __init__(self, app_conf):
+        self.app_conf = app_conf
+
+
+    def write(self, store_path, entries):
+        '''
+        Returns (number of entries written, number of bytes written).
+        '''
+        num_bytes = 0
+        for e in entries:
+            entry_filename = self.get_entry_filename(store_path, e)
+            tmp_filename = os.path.join(store_path, '.tmp-' + os.path.basename(entry_filename))
+            with open(tmp_filename, 'w') as entry_file:
+                # Caution: Don't set indent and separators or do any pretty printing to file,
+                # because Spark is unable to handle a JSON file that spans multiple lines.
+                # json.dumps escapes all non-ASCII characters, so its length is in bytes.
+                data = json.dumps(e)
+                entry_file.write(data)
+                num_bytes += len(data)
+            os.replace(tmp_filename, entry_filename)
+        return len(entries), num_bytes
+
+
+    def contains(self, store_path, entry):
+        return os.path.exists(self.get_entry_filename(store_path, entry))
+
+
+    def read(self, store_path, entry_id):
+        entry_filename = os.path.join(store_path, entry_id + '.json')
+        if not os.path.exists(entry_filename):
+            return None
+
+        with open(entry_filename, 'r') as entry_file:
+            return json.load(entry_file)
+
+
+    def close(self):
+        pass
+
+
+    def get_entry_filename(self, store_path, entry):
+        entry_filename = os.path.join(store_path, entry['id'] + '.json')
+        return entry_filename
+
+
+
+class SegmentStorageBackend(object):
+    '''
+    Appends entries as JSON lines to a few large rolling segment files, along with
+    a small offset index that maps every entry id to its location.
+
+        # <store_path>/
+        #     segment-00000.json
+        #     segment-00001.json
+        #         ...
+        #     _segments.idx
+
+    A segment is rolled over once it grows beyond SEGMENT_MAX_BYTES.
+
+    Every line of a segment is a complete JSON document, which is exactly what
+    spark.read.json expects. The index file starts with an underscore so that
+    Spark (like all Hadoop input formats) treats it as hidden and skips it.
+
+    Each index line is a JSON list [id, segment file name, byte offset, byte length].
+
+    Segments are append-only. An entry whose id is already in the index of a
+    partition is not appended again, so Spark never sees the same id twice.
+    Neither is an entry that the files backend already saved as <id>.json in the
+    partition, before STORAGE_BACKEND was switched to segments.
+
+    A batch of entries is committed by appending their index lines, which happens only
+    after their data is written. So after a crash, anything in a segment beyond what
+    the index points to is an uncommitted batch. It's truncated away when the partition
+    is next opened for writing, along with any partly written index line.
+    '''
+
+    DEFAULT_SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+    INDEX_FILE = '_segments.idx'
+    SEGMENT_FILE_FORMAT = 'segment-%05d.json'
+
+    def __init__(self, app_conf):
+        self.app_conf = app_conf
+        self.segment_max_bytes = int(app_conf.get('SEGMENT_MAX_BYTES', self.DEFAULT_SEGMENT_MAX_BYTES))
+
+        # Store path -> _Partition. Each partition's index is loaded on first use.
+        self.partitions = {}
+        self.lock = threading.Lock()
+
+
+    def write(self, store_path, entries):
+        '''
+        Returns (number of entries written, number of bytes written). Entries whose
+        ids are already stored are skipped, and not counted.
+        '''
+        with self.lock:
+            partition = self.get_partition(store_path)
+            return partition.append(entries)
+
+
+    def contains(self, store_path, entry):
+        with self.lock:
+            partition = self.get_partition(store_path)
+            return partition.contains(entry['id'])
+
+
+    def read(self, store_path, entry_id):
+        with self.lock:
+            partition = self.get_partition(store_path)
+            return partition.read(entry_id)
+
+
+    def close(self):
+        with self.lock:
+            self.partitions = {}
+
+
+    def get_partition(self, store_path):
+        partition = self.partitions.get(store_path, None)
+        if partition is None:
+            partition = _Partition(store_path, self.segment_max_bytes)
+            self.partitions[store_path] = partition
+
+        return partition
+
+
+
+class _Partition(object):
+    '''
+    The segments and index of a single store directory.
+    '''
+    def __init__(self, store_path, segment_max_bytes):
+        self.store_path = store_path
+        self.segment_max_bytes = segment_max_bytes
+        self.index_filename = os.path.join(store_path, SegmentStorageBackend.INDEX_FILE)
+
+        # id -> (segment file name, offset, length)
+        self.index = {}
+        self.segment_num = 0
+        self.load_index()
+
+        # Ids of entries saved by the files backend.
+        self.file_ids = self.load_file_ids()
+
+        self.segment_size = self.get_segment_size(self.segment_num)
+
+
+    def load_index(self):
+        if os.path.exists(self.index_filename):
+            committed = 0
+            with open(self.index_filename, 'rb') as index_file:
+                for line in index_file:
+                    if not line.endswith(b'\n'):
+                        break
+                    committed += len(line)
+                    line = line.strip()
+                    if not line:
+                        continue
+                    entry_id, segment, offset, length = json.loads(line.decode('utf-8'))
+                    self.index[entry_id] = (segment, offset, length)
+
+            if committed < os.path.getsize(self.index_filename):
+                print('Truncating partly written index line in', self.index_filename)
+                with open(self.index_filename, 'r+b') as index_file:
+                    index_file.truncate(committed)
+
+        segment_nums = [ int(segment[8:13]) for segment, _, _ in self.index.values() ]
+        if segment_nums:
+            self.segment_num = max(segment_nums)
+
+        self.recover_segments()
+
+
+    def load_file_ids(self):
+        if not os.path.isdir(self.store_path):
+            return set()
+
+        return set(filename[:-len('.json')] for filename in os.listdir(self.store_path)
+                   if filename.endswith('.json') and not filename.startswith('segment-')
+                   and not filename.startswith('.') and not filename.startswith('_'))
+
+
+    def contains(self, entry_id):
+        return entry_id in self.index or entry_id in self.file_ids
+
+
+    def recover_segments(self):
+        '''
+        Truncates every segment to the end of its last indexed entry, removing data
+        of batches that were never committed.
+        '''
+        if not os.path.isdir(self.store_path):
+            return
+
+        committed_ends = {}
+        for segment, offset, length in self.index.values():
+            committed_ends[segment] = max(committed_ends.get(segment, 0), offset + length)
+
+        for filename in os.listdir(self.store_path):
+            if not (filename.startswith('segment-') and filename.endswith('.json')):
+                continue
+
+            segment_filename = os.path.join(self.store_path, filename)
+            committed_end = committed_ends.get(filename, 0)
+            if os.path.getsize(segment_filename) > committed_end:
+                print('Truncating uncommitted data in %s to %d bytes' % (segment_filename, committed_end))
+                with open(segment_filename, 'r+b') as segment_file:
+                    segment_file.truncate(committed_end)
+
+
+    def get_segment_size(self, segment_num):
+        segment_filename = os.path.join(self.store_path, SegmentStorageBackend.SEGMENT_FILE_FORMAT % (segment_num))
+        if not os.path.exists(segment_filename):
+            return 0
+        return os.path.getsize(segment_filename)
+
+
+    def append(self, entries):
+        index_lines = []
+        segment_file = None
+        num_bytes = 0
+
+        try:
+            for e in entries:
+                if self.contains(e['id']):
+                    continue
+
+                # Caution: Don't set indent and separators or do any pretty printing to file,
+                # because Spark is unable to handle a JSON document that spans multiple lines.
+                line = (json.dumps(e) + '\n').encode('utf-8')
+
+                if self.segment_size > 0 and self.segment_size + len(line) > self.segment_max_bytes:
+                    if segment_file is not None:
+                        segment_file.close()
+                        segment_file = None
+                    self.segment_num += 1
+                    self.segment_size = 0
+
+                segment = SegmentStorageBackend.SEGMENT_FILE_FORMAT % (self.segment_num)
+                if segment_file is None:
+                    segment_file = open(os.path.join(self.store_path, segment), 'ab')
+
+                segment_file.write(line)
+
+                location = (segment, self.segment_size, len(line))
+                self.index[e['id']] = location
+                index_lines.append(json.dumps([e['id']] + list(location)) + '\n')
+                self.segment_size += len(line)
+                num_bytes += len(line)
+
+        finally:
+            if segment_file is not None:
+                segment_file.close()
+
+            # Index is appended only after segment data is written, so it never points
+            # at data that isn't there.
+            if index_lines:
+                with open(self.index_filename, 'a') as index_file:
+                    index_file.writelines(index_lines)
+
+        return len(index_lines), num_bytes
+
+
+    def read(self, entry_id):
+        location = self.index.get(entry_id, None)
+        if location is None:
+            if entry_id in self.file_ids:
+                with open(os.path.join(self.store_path, entry_id + '.json'), 'r') as entry_file:
+                    return json.load(entry_file)
+            return None
+
+        segment, offset, length = location
+        with open(os.path.join(self.store_path, segment), 'rb') as segment_file:
+            segment_file.seek(offset)
+            return json.loads(segment_file.read(length).decode('utf-8'))
+
+
+
+STORAGE_BACKENDS = {
+    'files' : FileStorageBackend,
+    'segments' : SegmentStorageBackend
+}
@@ -0,0 +1,122 @@
+'''
+Background, batched writes of entries to a HistoryStore or TargetStore.
+
+Handlers that fetch entries one by one would otherwise alternate between waiting on
+the network and waiting on the disk. Instead, they submit entries to a StoreWriter,
+which collects them into batches and writes each batch with a single store_content
+call on its own thread, while the handler goes on fetching:
+
+    writer = StoreWriter(history_store, self.name, store_path)
+    for entry in fetched_entries:
+        writer.submit([entry])
+    writer.close()      # Returns once everything submitted is stored.
+
+The queue of submitted entries is bounded. If the disk can't keep up, submit() blocks
+until there's room, so memory use stays bounded however fast entries are fetched.
+'''
+from __future__ import print_function
+import queue
+import threading
+import time
+import traceback
+
+
+class StoreWriter(object):
+    '''
+    store: a HistoryStore or TargetStore.
+    handler_name, store_path: passed on to store_content.
+    batch_size: max number of entries written in one store_content call.
+    max_pending: max number of submitted entries not yet written, after which submit() blocks.
+    linger: seconds to wait for more entries before writing a batch smaller than batch_size.
+    '''
+
+    DEFAULT_BATCH_SIZE = 100
+    DEFAULT_MAX_PENDING = 1000
+    DEFAULT_LINGER = 0.05
+
+    def __init__(self, store, handler_name, store_path=None, batch_size=DEFAULT_BATCH_SIZE,
+            max_pending=DEFAULT_MAX_PENDING, linger=DEFAULT_LINGER):
+        self.store = store
+        self.handler_name = handler_name
+        self.store_path = store_path
+        self.batch_size = max(1, int(batch_size))
+        self.linger = linger
+
+        # Items are (entry, callback, entries) tuples, or None to stop. entries is the list
+        # the entry was submitted with, and callback is set only on its last entry.
+        self.pending = queue.Queue(maxsize=max(1, int(max_pending)))
+        self.error = None
+        self.num_written = 0
+        self.num_batches = 0
+
+        self.thread = threading.Thread(target=self.run, name=handler_name + '-store-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def submit(self, entries, callback=None):
+        '''
+        Queues entries to be stored. Blocks while the queue is full.
+
+        callback: (Optional) called with the entries on the writer thread, once they're stored.
+        '''
+        if self.error is not None:
+            raise self.error
+
+        entries = list(entries)
+        for i, entry in enumerate(entries):
+            # The callback goes with the last entry, so it's called once all of them are written.
+            self.pending.put((entry, callback if i == len(entries) - 1 else None, entries))
+
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            item = self.pending.get()
+            if item is None:
+                return
+            batch = [ item ]
+
+            # Collect whatever else arrives within the linger time, up to batch_size.
+            deadline = time.time() + self.linger
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.time()
+                try:
+                    item = self.pending.get(timeout=timeout) if timeout > 0 else self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self.write(batch)
+
+
+    def write(self, batch):
+        if self.error is not None:
+            # Entries after a failure are drained, but not written.
+            return
+
+        try:
+            self.store.store_content(self.handler_name, [ entry for entry, _, _ in batch ], self.store_path)
+            self.num_written += len(batch)
+            self.num_batches += 1
+
+            for _, callback, entries in batch:
+                if callback is not None:
+                    callback(entries)
+        except Exception as e:
+            traceback.print_exc()
+            self.error = e
+
+
+    def close(self):
+        '''
+        Waits until everything submitted is stored, and stops the writer thread.
+        Raises the error if any write failed.
+        '''
+        self.pending.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
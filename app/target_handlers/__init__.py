@@ -1,18 +1,77 @@
 from __future__ import print_function
+import importlib
+import os
+import os.path
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Target types of the plugins of this package, and their modules and handler classes.
+# A plugin's module is imported only when a target of its type is configured.
+#
+# Any other module in this directory is imported at startup, and should register its
+# handler class itself, like:
+#   target_handlers.target_handlers.register(MyFetcher, 'my-type')
+PLUGINS = {
+    'feed' : ('feed_fetcher', 'FeedFetcher'),
+    'youtube' : ('youtube_fetcher', 'YoutubeFetcher'),
+}
+
 
 class TargetHandlers(object):
+    '''
+    Registrar of target handler classes, by target type.
+    '''
     def __init__(self):
+        # Target type -> handler class
         self.handlers = {}
+        self.plugins_loaded = False
         
     def conf_init(self, app_conf):
         self.app_conf = app_conf
 
-    def register(self, prototype_handler):
-        self.handlers[prototype_handler.type] = prototype_handler
+    def register(self, handler_class, handler_type=None):
+        '''
+        handler_class: the handler's class. Instances are created for each configured target.
+        
+        handler_type: the target type it handles. 
+        
+        For plugins written before handler classes were registered, a prototype handler 
+        instance is accepted too, and its type is taken from its 'type' attribute.
+        '''
+        if not isinstance(handler_class, type):
+            handler_type = handler_type or handler_class.type
+            handler_class = type(handler_class)
+            
+        self.handlers[handler_type] = handler_class
+        
+    def load_plugins(self):
+        '''
+        Imports modules in this directory that are not in PLUGINS. Done only once per process.
+        '''
+        if self.plugins_loaded:
+            return
+        self.plugins_loaded = True
+        
+        manifest_modules = set(module_name for module_name, _ in PLUGINS.values())
+        for plugin_file in sorted(os.listdir(PLUGIN_DIR)):
+            module_name, ext = os.path.splitext(plugin_file)
+            if ext == '.py' and not module_name.startswith('__') and module_name not in manifest_modules:
+                importlib.import_module(__name__ + '.' + module_name)
         
     def create_handler_instance(self, handler_type):
-        handler_type = type(self.handlers[handler_type])
-        return handler_type()
+        handler_class = self.handlers.get(handler_type, None)
+        
+        if handler_class is None and handler_type in PLUGINS:
+            module_name, class_name = PLUGINS[handler_type]
+            module = importlib.import_module(__name__ + '.' + module_name)
+            handler_class = getattr(module, class_name)
+            self.handlers[handler_type] = handler_class
+            
+        if handler_class is None:
+            raise RuntimeError('conf.yml error: unknown target type %s. Should be one of %s' % (
+                handler_type, ', '.join(sorted(set(PLUGINS.keys()) | set(self.handlers.keys())))))
+            
+        return handler_class()
 
 
 target_handlers = TargetHandlers()
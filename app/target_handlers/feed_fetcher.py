@@ -1,6 +1,13 @@
 from __future__ import print_function
 import feedparser
+import hashlib
+import json
+import os
+import os.path
+from urllib.error import URLError
+from urllib.parse import urlparse
 
+import request_scheduler
 import target_handlers
 
 class FeedFetcher(object):
@@ -9,6 +16,18 @@ class FeedFetcher(object):
     
     This uses just the feed's title, summary/description and tags as signals.
     It does not fetch or scrape the URLs in the feed.
+    
+    To avoid downloading and storing the same items on every cron run, the ETag and 
+    Last-Modified headers of each feed, and the ids of items already seen, are saved 
+    in a FeedState under CACHE_DIR. Feed requests are conditional, so an unchanged feed 
+    is answered with a '304 Not Modified' and not parsed at all. Of a changed feed, 
+    only the items not seen before are stored.
+    
+    Item ids are derived from each item's GUID (or link, if it has no GUID), so the 
+    same item gets the same id no matter where it appears in the feed.
+    
+    Requests are rate limited and retried as configured for the feed's host name in 
+    RATE_LIMITS (see request_scheduler.py).
     '''
     
     def __init__(self):
@@ -34,21 +53,50 @@ class FeedFetcher(object):
         
     def fetch(self, target_store):
         print("Fetching ", self.feed_url)
-        feed = feedparser.parse(self.feed_url)
+        state = FeedState(self.app_conf, self.name)
+        
+        feed_limit = request_scheduler.scheduler.register(urlparse(self.feed_url).netloc)
+        feed = feed_limit.call(self.parse_feed, state)
+        if feed.get('status', None) == 304:
+            print("Feed not modified since last fetch:", self.feed_url)
+            return
+            
         if not feed.entries:
             return
         
-        entries = self.create_entries(feed.entries)
+        entries = [ e for e in self.create_entries(feed.entries) if not state.is_seen(e['id']) ]
+        print("%s: %d new items out of %d" % (self.name, len(entries), len(feed.entries)))
+        
+        if entries:
+            # Store every fetched content along with its metadata.
+            store_path = target_store.prepare_to_store(self.name)
+            print('Store path:', store_path)
+            target_store.store_content(self.name, entries, store_path=store_path)
         
-        # Store every fetched content along with its metadata in its own file.
-        store_path = target_store.prepare_to_store(self.name)
-        print('Store path:', store_path)
-        target_store.store_content(self.name, entries, store_path=store_path)
+        # State is saved only after the items are stored, so that if storing fails, 
+        # they're fetched again next time.
+        state.update(feed.get('etag', None), feed.get('modified', None), [ e['id'] for e in entries ])
+        state.save()
             
         
+    def parse_feed(self, state):
+        # feedparser doesn't raise exceptions for failed requests. Transient failures
+        # are raised here, so that they're retried.
+        feed = feedparser.parse(self.feed_url, etag=state.etag, modified=state.modified)
+        
+        status = feed.get('status', None)
+        if status in request_scheduler.RETRY_STATUSES:
+            retry_after = request_scheduler.parse_retry_after(feed.get('headers', {}).get('retry-after', None))
+            raise request_scheduler.RetryableError('HTTP status %d' % (status), retry_after)
+            
+        if status is None and isinstance(feed.get('bozo_exception', None), URLError):
+            raise request_scheduler.RetryableError(str(feed['bozo_exception']))
+            
+        return feed
+        
+        
     def create_entries(self, entries):
         target_entries = []
-        id = 1
 
         for e in entries:
             title = e.get('title','')
@@ -63,7 +111,7 @@ class FeedFetcher(object):
             contents = ' '.join([title, desc, tags])
             
             entry = {
-                'id': self.name + '-' + str(id),
+                'id': self.get_entry_id(e),
                 'url' : url,
                 'title' : title,
                 'details' : desc,
@@ -71,11 +119,69 @@ class FeedFetcher(object):
             }
             
             target_entries.append(entry)
-            
-            id += 1
 
         return target_entries
+        
+        
+    def get_entry_id(self, e):
+        # feedparser exposes an item's <guid> (RSS) or <id> (ATOM) as 'id'.
+        guid = e.get('id', None) or e['link']
+        return self.name + '-' + hashlib.sha1(guid.encode('utf-8')).hexdigest()[:16]
+        
+        
+        
+class FeedState(object):
+    '''
+    What's known about a feed from earlier fetches - its ETag and Last-Modified
+    validators, and ids of the most recent items seen in it. 
+    
+    Saved as JSON in CACHE_DIR/feeds/<feed name>.json. Since each feed has its own
+    file, feeds being fetched concurrently don't step on each other.
+    '''
+    
+    MAX_SEEN_IDS = 5000
+    
+    def __init__(self, app_conf, name):
+        self.state_dir = os.path.join(app_conf['CACHE_DIR'], 'feeds')
+        self.state_file = os.path.join(self.state_dir, name + '.json')
+        
+        state = {}
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+                
+        self.etag = state.get('etag', None)
+        self.modified = state.get('modified', None)
+        self.seen_ids = state.get('seen_ids', [])
+        self.seen_ids_set = set(self.seen_ids)
+        
+        
+    def is_seen(self, entry_id):
+        return entry_id in self.seen_ids_set
+        
+        
+    def update(self, etag, modified, new_ids):
+        self.etag = etag
+        self.modified = modified
+        
+        self.seen_ids.extend(new_ids)
+        self.seen_ids = self.seen_ids[-self.MAX_SEEN_IDS:]
+        self.seen_ids_set = set(self.seen_ids)
+        
+        
+    def save(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        
+        # Write to a temporary file and rename, so that a crash never leaves behind
+        # a half written state file.
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({
+                'etag' : self.etag,
+                'modified' : self.modified,
+                'seen_ids' : self.seen_ids
+            }, f)
+        os.replace(tmp_file, self.state_file)
     
 #-----------------------------------------------------------------------
-# Module entry point
-target_handlers.target_handlers.register(FeedFetcher())
+# Registered by PLUGINS in target_handlers/__init__.py, for targets of type 'feed'.
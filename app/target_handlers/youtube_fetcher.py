@@ -1,13 +1,13 @@
 from __future__ import print_function
-from apiclient import discovery
-import json
 import datetime
-import traceback
-import yaml
-import os
-from pprint import pprint
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import target_handlers
+import request_scheduler
+import youtube_service
+from store_writer import StoreWriter
+from video_cache import VideoMetadataCache, video_contents
 
 class YoutubeFetcher(object):
     '''
@@ -20,10 +20,20 @@ class YoutubeFetcher(object):
     matching that query. Since the whole idea of topic modelling is to go beyond search queries
     and look for latent relationships between web resources, it's recommended to not use this
     unless it's a very very general query term.
+    
+    Snippets of all videos found are added to the VideoMetadataCache shared with the
+    YouTube history handler. Search snippets lack tags, so they're cached as incomplete.
+    
+    API calls share the 'youtube' rate limit and daily quota with the YouTube history
+    handler (see request_scheduler.py).
+    
+    Search result pages are pipelined: as soon as a page arrives, the next page is requested,
+    and while that request is in flight, the page is converted to entries and handed over to
+    a StoreWriter that stores them on its own thread. So the total time is close to that of
+    the API calls alone, instead of API calls plus conversion plus disk writes.
     '''
     
     DEFAULT_PERIOD = 6  # Hours, in case there's no 'period' in conf.yml. 
-    API_KEY_FILE = 'yt_api_key.yml'
     
     def __init__(self):
         self.type = 'youtube'
@@ -37,7 +47,7 @@ class YoutubeFetcher(object):
         '''
         self.app_conf = app_conf
         self.handler_conf = handler_conf
-        self.youtube_svc = self.get_youtube_service()
+        self.youtube_limit = request_scheduler.scheduler.register('youtube')
         
         self.name = handler_conf.get('name', None)
         if not self.name:
@@ -49,27 +59,14 @@ class YoutubeFetcher(object):
         self.query = handler_conf.get('query', None)
         
         
-    def get_youtube_service(self):
-        key_error = ("Error: YouTube API key file conf/yt_api_key.yml not found or API key is not present in that file.\n"
-                "Obtain an API key as explained in https://developers.google.com/youtube/v3/getting-started#before-you-start.\n"
-                "Then create a copy of conf/yt_api_key_template.yml as conf/yt_api_key.yml and insert the key in it.")
-                
-        yt_api_key_file = os.path.join(self.app_conf['CONF_DIR'], self.API_KEY_FILE)
-        if not os.path.exists(yt_api_key_file):
-            raise RuntimeError(key_error)
-                
-        with open(yt_api_key_file, 'r') as cred_file:
-            creds = yaml.load(cred_file)
-        api_key = creds.get('key', '')
-        if not api_key:
-            raise RuntimeError(key_error)
-            
-        service = discovery.build('youtube', 'v3', developerKey=api_key)
+    @property
+    def youtube_svc(self):
+        # Built on first use, so that nothing is set up for runs that don't need it.
+        if getattr(self, '_youtube_svc', None) is None:
+            self._youtube_svc = youtube_service.get_youtube_service(self.app_conf)
+        return self._youtube_svc
+        
         
-        return service
-
-
-
     def fetch(self, target_store):
         # Youtube API's search.list expects publishedAfter timestamp 
         # in RFC 3339 format like '2017-06-12T00:00:00Z'
@@ -78,39 +75,59 @@ class YoutubeFetcher(object):
 
         print("Fetching latest YouTube video details published since %s, matching query:%s"%(published_after, self.query))
         
-        try:
-            req = self.youtube_svc.search().list(
-                part='snippet', type='video', 
-                q=self.query, 
-                publishedAfter=published_after)
-            
-            resp = req.execute()
-        except:
-            print('\n\n\nERROR: Youtube target handler search could not be initiated. Reason:%s\n\n\n' % (traceback.print_exc()))
-            return
+        req = self.youtube_svc.search().list(
+            part='snippet', type='video', 
+            q=self.query, 
+            publishedAfter=published_after)
             
-        # Store every fetched content along with its metadata in its own file.
+        # Store every fetched content along with its metadata.
         store_path = target_store.prepare_to_store(self.name)
+        cache = VideoMetadataCache(self.app_conf)
+        writer = StoreWriter(target_store, self.name, store_path)
         
-        while resp is not None:
-            # Every video resource in the response is converted to a text document using its
-            # attributes.
-            entries = self.create_entries(resp)
-            if entries:
-                pprint(entries)
-                target_store.store_content(self.name, entries, store_path=store_path)
-        
-            # Next page of requests
-            try:
-                req = self.youtube_svc.search().list_next(req, resp)
-                if req is None:
-                    print('\n\n\nYoutube target handler: Search completed') 
-                    break
+        t0 = time.time()
+        num_pages = 0
+        num_videos = 0
+        try:
+            # A single prefetch thread, so that pages are still requested one at a time.
+            with ThreadPoolExecutor(max_workers=1) as prefetcher:
+                pending = prefetcher.submit(self.execute, req)
+                
+                while pending is not None:
+                    try:
+                        resp = pending.result()
+                    except Exception as e:
+                        # Transient failures have already been retried by the request scheduler,
+                        # so there's no point trying this page again.
+                        if num_pages == 0:
+                            raise
+                        print('ERROR: Youtube target handler search stopped after %d pages. Reason: %s' % (
+                            num_pages, request_scheduler.describe_error(e)))
+                        break
+                    
+                    # Next page is requested before this one is processed.
+                    req = self.youtube_svc.search().list_next(req, resp)
+                    pending = prefetcher.submit(self.execute, req) if req is not None else None
                     
-                resp = req.execute()
-            except:
-                print('\n\n\nERROR: Youtube target handler search partial failure. Reason:%s\n\n\n' % (traceback.print_exc()))
+                    # Every video resource in the response is converted to a text document using its
+                    # attributes.
+                    entries = self.create_entries(resp)
+                    if entries:
+                        # Snippets are cached once their entries are stored.
+                        snippets = self.get_snippets(resp)
+                        writer.submit(entries, lambda stored, snippets=snippets: cache.put_many(snippets, complete=False))
+                        num_videos += len(entries)
+                    num_pages += 1
+        finally:
+            # Waits for all pages to be stored.
+            writer.close()
+            cache.close()
+            
+        print('%s: %d videos in %d pages in %.2f s' % (self.name, num_videos, num_pages, time.time() - t0))
+        
         
+    def execute(self, req):
+        return self.youtube_limit.call(req.execute, cost=request_scheduler.QUOTA_COSTS['youtube.search.list'])
         
         
     def create_entries(self, resp):
@@ -124,12 +141,7 @@ class YoutubeFetcher(object):
             v = v['snippet']
             title = v.get('title','')
             desc = v.get('description','')
-            tags = v.get('tags', None)
-            tags = ' '.join(tags) if tags else ''
-                
-            # Since LDA is a bag of words model, things like newlines and order of terms don't matter.
-            # Just combine all the attributes into a single string.
-            contents = ' '.join([title, desc, tags])
+            contents = video_contents(v)
             
             entry = {
                 'id': self.name + '-' + video_id,
@@ -144,7 +156,10 @@ class YoutubeFetcher(object):
         
         return entries
         
+        
+    def get_snippets(self, resp):
+        return { v['id']['videoId'] : v['snippet'] for v in resp.get('items', None) or [] }
+        
 
 #-----------------------------------------------------------------------
-# Module entry point
-target_handlers.target_handlers.register(YoutubeFetcher())
+# Registered by PLUGINS in target_handlers/__init__.py, for targets of type 'youtube'.
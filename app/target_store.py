@@ -1,8 +1,14 @@
 from __future__ import print_function
+import contextlib
 import datetime
-import json
 import os
 import os.path
+import threading
+
+from storage_backends import create_storage_backend
+from dedup_index import DedupIndex
+from near_dup import NearDupIndex
+from vocabulary import create_term_counter
 
 class TargetStore(object):
     '''
@@ -11,14 +17,20 @@ class TargetStore(object):
     As of now, this just saves all items directly to filesystem with date on which
     target is fetched. 
     
-    Each entry is saved in its own JSON file containing the target metadata and fetched contents.
+    Each entry is saved as a JSON document containing the target metadata and fetched contents.
+    How the documents are laid out inside a date directory depends on the STORAGE_BACKEND
+    configured in conf.yml (see storage_backends.py).
     
         # The directory structure for target storage as of now is:
         # TARGET_DIR
         #   /<datetime>/
-        #           <handler-name>-<id1>.json
+        #           <handler-name>-<id1>.json       (STORAGE_BACKEND: files)
         #           <handler-name>-<id2>.json
         #               ...
+        #   or
+        #           segment-00000.json              (STORAGE_BACKEND: segments)
+        #               ...
+        #           _segments.idx
 
     Future enhancements:
     - save the text in a directory tree so that system can get content only for a range
@@ -28,8 +40,49 @@ class TargetStore(object):
     '''
     def __init__(self, app_conf):
         self.app_conf = app_conf
+        self.backend = create_storage_backend(app_conf)
+        
+        # With DEDUP_INDEX enabled, anything stored on any earlier date is recognized
+        # as already stored, and not fetched or stored again.
+        self.dedup_index = None
+        if app_conf.get('DEDUP_INDEX', False):
+            self.dedup_index = DedupIndex(app_conf['TARGET_DIR'])
+            
+        # With NEAR_DUP configured, only one of each cluster of near-duplicate entries,
+        # like the same story syndicated by several feeds, reaches recommend (see near_dup.py).
+        self.near_dup_index = None
+        near_dup_conf = app_conf.get('NEAR_DUP', None)
+        if near_dup_conf:
+            self.near_dup_index = NearDupIndex(app_conf['TARGET_DIR'],
+                near_dup_conf.get('threshold', NearDupIndex.DEFAULT_THRESHOLD),
+                near_dup_conf.get('action', 'drop'))
+            
+        # With VOCABULARY_FILE configured, term counts of every entry are stored 
+        # with it, so that LDA doesn't have to tokenize contents again (see vocabulary.py).
+        self.term_counter = create_term_counter(app_conf)
+        
+        # A target that timed out is abandoned, not stopped, so its fetcher thread may
+        # still store entries after fetch returns and the store is closed. Once closed,
+        # the store refuses them, and close() waits for calls already under way.
+        self.closed = False
+        self.num_in_use = 0
+        self.in_use_cond = threading.Condition()
         
         
+    @contextlib.contextmanager
+    def in_use(self):
+        with self.in_use_cond:
+            if self.closed:
+                raise RuntimeError('Target store is closed. Entries of a target that timed out are not stored.')
+            self.num_in_use += 1
+        try:
+            yield
+        finally:
+            with self.in_use_cond:
+                self.num_in_use -= 1
+                self.in_use_cond.notify_all()
+                
+                
     def prepare_to_store(self, handler_name):
         
         store_path = self.get_store_path(handler_name)
@@ -65,11 +118,24 @@ class TargetStore(object):
             if e.get('contents', None) is None:
                 e['contents'] = ''
                 
-            entry_filename = self.get_entry_filename(store_path, e)
-            with open(entry_filename, 'w') as entry_file:
-                # Caution: Don't set indent and separators or do any pretty printing to file,
-                # because Spark is unable to handle a JSON file that spans multiple lines.
-                json.dump(e, entry_file)
+        with self.in_use():
+            if self.dedup_index is not None:
+                entries = [ e for e in entries if not self.dedup_index.seen(e) ]
+                
+            representatives = None
+            if self.near_dup_index is not None:
+                entries, representatives = self.near_dup_index.check(entries)
+                
+            if self.term_counter is not None:
+                self.term_counter.add_term_counts(entries)
+                
+            self.backend.write(store_path, entries)
+            
+            if self.dedup_index is not None:
+                self.dedup_index.add(os.path.basename(store_path), entries)
+                
+            if representatives is not None:
+                self.near_dup_index.add(os.path.basename(store_path), representatives)
       
     
     
@@ -93,11 +159,21 @@ class TargetStore(object):
         if not store_path:
             store_path = self.get_store_path(handler_name)
             
-        entry_filename = self.get_entry_filename(store_path, entry)
-        return os.path.exists(entry_filename)
-        
+        with self.in_use():
+            if self.dedup_index is not None and self.dedup_index.seen_url(entry['url']):
+                return True
+                
+            return self.backend.contains(store_path, entry)
         
         
-    def get_entry_filename(self, store_path, entry):
-        entry_filename = os.path.join(store_path, entry['id'] + '.json')
-        return entry_filename
+    def close(self):
+        with self.in_use_cond:
+            self.closed = True
+            while self.num_in_use:
+                self.in_use_cond.wait()
+                
+        self.backend.close()
+        if self.dedup_index is not None:
+            self.dedup_index.close()
+        if self.near_dup_index is not None:
+            self.near_dup_index.close()
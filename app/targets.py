@@ -1,7 +1,9 @@
 from __future__ import print_function
-import os
-import importlib
+import threading
+import time
+import traceback
 
+import request_scheduler
 import target_handlers
 from target_handlers import target_handlers as handlers
 
@@ -10,32 +12,141 @@ class TargetsProcessor(object):
     Fetches user configured target URLs using their respective handlers,
     and stores their content.
     '''
-    def __init__(self, app_conf):
+    def __init__(self, app_conf, metrics=None):
+        '''
+        metrics: (Optional) a metrics.Metrics that records the fetches of every target.
+        '''
         self.app_conf = app_conf
+        request_scheduler.scheduler.conf_init(self.app_conf)
         self.load_handlers()
         
-        # At this point, TargetHandlers (__init__.py) has list of prototype 
-        # handler instances. 
-        # Now create handler instances according to configured TARGETS.
+        # Create handler instances according to configured TARGETS.
         self.handler_instances = []
         for target_conf in self.app_conf['TARGETS']:
             h_instance = handlers.create_handler_instance(target_conf['type'])
             self.handler_instances.append(h_instance)
             h_instance.conf_init(self.app_conf, target_conf)
+            if metrics is not None:
+                metrics.instrument_handler(h_instance, ['fetch'])
 
 
     def load_handlers(self):
-        # The handler plugins loaded here register themselves with target_handlers.TargetHandlers.
-        plugin_files = os.listdir('target_handlers')
-        for plugin_file in plugin_files:
-            if not plugin_file.startswith('__'):
-                importlib.import_module('target_handlers.' + plugin_file[0:-3])
+        # Plugins in the manifest in target_handlers/__init__.py are imported only 
+        # when a target of their type is configured.
+        handlers.load_plugins()
 
 
                 
-    def fetch(self, target_store):
-        for handler in self.handler_instances:
-            handler.fetch(target_store)
+    def fetch(self, target_store, concurrency=None, timeout=None):
+        '''
+        Fetches all configured targets, up to 'concurrency' of them at the same time.
+        Since fetching is mostly waiting on network, total time taken is then closer to
+        that of the slowest target rather than the sum of all targets.
+        
+        concurrency: max number of targets fetched at the same time. If not given,
+            FETCH_CONCURRENCY from conf.yml is used. 1 fetches targets one after another.
+            
+        timeout: max seconds to wait for any single target once its fetch has started. 
+            If not given, FETCH_TIMEOUT from conf.yml is used. If that's not set either,
+            there's no timeout.
             
+        Returns a list of TargetFetchResult, one per target.
+        '''
+        if concurrency is None:
+            concurrency = self.app_conf.get('FETCH_CONCURRENCY', 1)
+        concurrency = max(1, int(concurrency))
+        
+        if timeout is None:
+            timeout = self.app_conf.get('FETCH_TIMEOUT', None)
+        
+        results = [ TargetFetchResult(handler) for handler in self.handler_instances ]
+        pending = list(results)
+        cond = threading.Condition()
+        
+        def worker():
+            while True:
+                with cond:
+                    if not pending:
+                        return
+                    result = pending.pop(0)
+                    result.status = 'running'
+                    result.started = time.time()
+                    
+                try:
+                    result.handler.fetch(target_store)
+                    status, error = 'ok', None
+                except Exception as e:
+                    traceback.print_exc()
+                    status, error = 'error', e
+                    
+                with cond:
+                    timed_out = result.status == 'timeout'
+                    if not timed_out:
+                        result.status = status
+                        result.error = error
+                        result.finished = time.time()
+                    cond.notify_all()
+                    
+                if timed_out:
+                    # A replacement worker was started when this target timed out.
+                    return
+                    
+        # Threads are daemons, so that a target that hangs past its timeout doesn't 
+        # stop the process from exiting.
+        for i in range(min(concurrency, len(results))):
+            t = threading.Thread(target=worker, name='target-fetcher-%d' % (i))
+            t.daemon = True
+            t.start()
+            
+        with cond:
+            while True:
+                now = time.time()
+                if timeout:
+                    for result in results:
+                        if result.status == 'running' and now - result.started > timeout:
+                            # The thread can't be stopped, but it's no longer waited for,
+                            # and it won't pick up any more targets. A replacement worker
+                            # takes its place.
+                            result.status = 'timeout'
+                            result.finished = now
+                            t = threading.Thread(target=worker, name='target-fetcher')
+                            t.daemon = True
+                            t.start()
+                            
+                if all(r.status not in ('pending', 'running') for r in results):
+                    break
+                    
+                cond.wait(1.0 if timeout else None)
+        
+        self.report(results)
+        return results
+        
+        
+    def report(self, results):
+        print('\n\nTarget fetch results:')
+        for result in results:
+            print('%-40s %-10s %-8s %8.2f s %s' % (
+                result.name, result.type, result.status, result.elapsed(), 
+                result.error if result.error is not None else ''))
+
 
+
+class TargetFetchResult(object):
+    '''
+    Outcome of fetching a single target.
+    
+    status is one of 'pending', 'running', 'ok', 'error' or 'timeout'.
+    '''
+    def __init__(self, handler):
+        self.handler = handler
+        self.name = getattr(handler, 'name', None)
+        self.type = getattr(handler, 'type', None)
+        self.status = 'pending'
+        self.error = None
+        self.started = None
+        self.finished = None
         
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
@@ -0,0 +1,61 @@
+'''
+Python equivalent of the text pipeline stages in Lda.scala - Spark's Tokenizer and
+StopWordsRemover - so that documents are turned into the same terms whether the Spark
+job or a Python component processes them.
+'''
+from __future__ import print_function
+import os.path
+import re
+
+# Spark's default English stop words list used by StopWordsRemover
+# (org/apache/spark/ml/feature/stopwords/english.txt in Spark 2.1).
+SPARK_DEFAULT_STOP_WORDS = '''
+i me my myself we our ours ourselves you your yours yourself yourselves he him his himself
+she her hers herself it its itself they them their theirs themselves what which who whom
+this that these those am is are was were be been being have has had having do does did
+doing a an the and but if or because as until while of at by for with about against between
+into through during before after above below to from up down in out on off over under again
+further then once here there when where why how all any both each few more most other some
+such no nor not only own same so than too very s t can will just don should now i'll you'll
+he'll she'll we'll they'll i'd you'd he'd she'd we'd they'd i'm you're he's she's it's we're
+they're i've we've you've they've isn't aren't wasn't weren't haven't hasn't hadn't don't
+doesn't didn't won't wouldn't shan't shouldn't mustn't can't couldn't cannot could here's
+how's let's ought that's there's what's when's where's who's why's would
+'''.split()
+
+# Java's \s, which Spark's Tokenizer splits on. Unlike str.split(), it's only ASCII whitespace,
+# so a non-breaking space doesn't split a token.
+WHITESPACE = re.compile('[ \t\n\x0b\f\r]')
+
+CUSTOM_STOP_WORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'custom_stopwords.txt')
+
+
+def load_stop_words(custom_stop_words_file=CUSTOM_STOP_WORDS_FILE):
+    '''
+    Returns the set of stop words used by Lda.scala: Spark's default list, plus the
+    custom list, plus the empty strings that Spark's Tokenizer produces.
+    '''
+    stop_words = set(SPARK_DEFAULT_STOP_WORDS)
+
+    if custom_stop_words_file:
+        with open(custom_stop_words_file, 'r') as f:
+            stop_words.update(line.rstrip('\r\n') for line in f)
+
+    stop_words.update([' ', ''])
+    return stop_words
+
+
+def tokenize(text):
+    '''
+    Same as Spark's Tokenizer: lower cases the text and splits it on ASCII whitespace.
+    Spark keeps the empty tokens between repeated whitespace, for StopWordsRemover to
+    remove. They're dropped here.
+    '''
+    return [ t for t in WHITESPACE.split(text.lower()) if t ]
+
+
+def terms(text, stop_words):
+    '''
+    Returns the terms of a text document after tokenizing it and removing stop words.
+    '''
+    return [ t for t in tokenize(text) if t not in stop_words ]
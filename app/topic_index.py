@@ -0,0 +1,203 @@
+'''
+Index of document topic vectors, for finding nearest documents by topic distribution.
+
+An index is a directory holding:
+
+    topics.f32  : topic distributions of all documents, as a row-major float32 matrix.
+                  It's memory-mapped when the index is opened, so opening a large index
+                  is instant and only the pages actually searched are read.
+    docs.json   : the 'id', 'title' and 'url' of each document, in the same order.
+    meta.json   : the shape of the matrix. Written last, so an index without it is
+                  incomplete and ignored.
+
+Searches are exact. Queries are compared with all indexed documents a block at a time,
+as a single matrix product per block, so memory use is bounded by the block size
+regardless of the number of documents.
+'''
+from __future__ import print_function
+import os
+import os.path
+import json
+import shutil
+import tempfile
+
+import numpy as np
+
+TOPICS_FILE = 'topics.f32'
+DOCS_FILE = 'docs.json'
+META_FILE = 'meta.json'
+
+SIMILARITY_METRICS = ('euclidean', 'cosine', 'hellinger')
+
+DEFAULT_BLOCK_SIZE = 4096
+
+
+class TopicIndex(object):
+    '''
+    topics: numpy array or memmap of shape (number of docs, number of topics).
+    docs: list of document metadata dicts with 'id', 'title' and 'url'.
+    '''
+    def __init__(self, topics, docs):
+        self.topics = topics
+        self.docs = docs
+
+
+    def __len__(self):
+        return self.topics.shape[0]
+
+
+    @classmethod
+    def create(cls, path, topics, docs):
+        '''
+        Saves topics and docs as an index at path, replacing any index there,
+        and returns the opened index.
+        '''
+        parent = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+
+        # Written to a temporary directory that's then renamed, so a partially
+        # written index is never seen at path.
+        tmp_path = tempfile.mkdtemp(dir=parent, prefix='.tmp-index-')
+        try:
+            topics = np.ascontiguousarray(topics, dtype=np.float32)
+            topics.tofile(os.path.join(tmp_path, TOPICS_FILE))
+
+            with open(os.path.join(tmp_path, DOCS_FILE), 'w') as f:
+                json.dump(docs, f)
+
+            with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+                json.dump({ 'num_docs' : topics.shape[0], 'num_topics' : topics.shape[1] }, f)
+
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.rename(tmp_path, path)
+
+        except:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        return cls.open(path)
+
+
+    @classmethod
+    def open(cls, path):
+        '''
+        Returns the index at path, or None if there's no complete index there.
+        '''
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+
+        with open(os.path.join(path, DOCS_FILE), 'r') as f:
+            docs = json.load(f)
+
+        shape = (meta['num_docs'], meta['num_topics'])
+        if shape[0] == 0:
+            # A zero length file can't be memory-mapped.
+            topics = np.zeros(shape, dtype=np.float32)
+        else:
+            topics = np.memmap(os.path.join(path, TOPICS_FILE), dtype=np.float32, mode='r', shape=shape)
+
+        return cls(topics, docs)
+
+
+    def nearest(self, queries, k=1, metric='euclidean', block_size=DEFAULT_BLOCK_SIZE):
+        '''
+        For every query topic vector, finds the k nearest documents in this index.
+
+        Returns an (indices, distances) tuple of arrays of shape (number of queries, k),
+        nearest first.
+        '''
+        return top_k(queries, self.topics, k, metric, block_size)
+
+
+
+def prepare(topics, metric):
+    '''
+    Transforms topic vectors so that the metric is the euclidean distance between them,
+    or, for cosine, 1 - their dot product.
+    '''
+    topics = np.asarray(topics, dtype=np.float32)
+    if metric == 'hellinger':
+        return np.sqrt(topics) / np.float32(np.sqrt(2))
+    elif metric == 'cosine':
+        return topics / np.maximum(np.linalg.norm(topics, axis=1), 1e-30)[:, np.newaxis]
+    return topics
+
+
+def block_distances(queries, index_block, index_sq_norms, metric):
+    products = queries @ index_block.T
+    if metric == 'cosine':
+        return 1.0 - products
+
+    distances = np.sum(queries ** 2, axis=1)[:, np.newaxis] + index_sq_norms[np.newaxis, :] - 2 * products
+    return np.sqrt(np.maximum(distances, 0.0))
+
+
+def top_k(queries, index_topics, k=1, metric='euclidean', block_size=DEFAULT_BLOCK_SIZE):
+    '''
+    Exact k nearest neighbours of each query among index_topics.
+
+    Both queries and index are processed a block at a time, and only the best k
+    candidates of each query are carried from one index block to the next.
+    '''
+    if metric not in SIMILARITY_METRICS:
+        raise ValueError('Unknown metric %s' % (metric))
+
+    num_queries = np.shape(queries)[0]
+    k = min(k, index_topics.shape[0])
+    indices = np.zeros((num_queries, k), dtype=np.int64)
+    distances = np.zeros((num_queries, k), dtype=np.float32)
+    if k == 0 or num_queries == 0:
+        return indices, distances
+
+    for q_start in range(0, num_queries, block_size):
+        q_block = prepare(queries[q_start:q_start + block_size], metric)
+
+        best_indices = np.zeros((q_block.shape[0], 0), dtype=np.int64)
+        best_distances = np.zeros((q_block.shape[0], 0), dtype=np.float32)
+
+        for i_start in range(0, index_topics.shape[0], block_size):
+            i_block = prepare(index_topics[i_start:i_start + block_size], metric)
+            i_sq_norms = np.sum(i_block ** 2, axis=1)
+
+            # Candidates are the best so far plus everything in this block.
+            cand_distances = np.hstack([ best_distances, block_distances(q_block, i_block, i_sq_norms, metric) ])
+            cand_indices = np.hstack([ best_indices,
+                np.broadcast_to(np.arange(i_start, i_start + i_block.shape[0]), (q_block.shape[0], i_block.shape[0])) ])
+
+            if cand_distances.shape[1] > k:
+                part = np.argpartition(cand_distances, k - 1, axis=1)[:, :k]
+                cand_distances = np.take_along_axis(cand_distances, part, axis=1)
+                cand_indices = np.take_along_axis(cand_indices, part, axis=1)
+
+            best_distances, best_indices = cand_distances, cand_indices
+
+        order = np.argsort(best_distances, axis=1, kind='stable')
+        distances[q_start:q_start + block_size] = np.take_along_axis(best_distances, order, axis=1)
+        indices[q_start:q_start + block_size] = np.take_along_axis(best_indices, order, axis=1)
+
+    return indices, distances
+
+
+def recommendations(history_index, target_index, num, metric='euclidean', block_size=DEFAULT_BLOCK_SIZE):
+    '''
+    Returns the num targets nearest to any history document as a list of
+    (target index, history index, distance) tuples, nearest first.
+    '''
+    if len(history_index) == 0 or len(target_index) == 0:
+        return []
+
+    nearest, distances = history_index.nearest(target_index.topics, 1, metric, block_size)
+    nearest = nearest[:, 0]
+    distances = distances[:, 0]
+
+    num = min(num, len(distances))
+    top = np.argpartition(distances, num - 1)[:num]
+    top = top[np.argsort(distances[top], kind='stable')]
+
+    return [ (int(t), int(nearest[t]), float(distances[t])) for t in top ]
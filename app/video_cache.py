@@ -0,0 +1,130 @@
+from __future__ import print_function
+import json
+import os
+import os.path
+import sqlite3
+import threading
+import time
+
+
+class VideoMetadataCache(object):
+    '''
+    A persistent local cache of YouTube video metadata (title, description and tags),
+    keyed by video id and shared by the YouTube history handler and target fetcher.
+
+    Fetching video details costs API quota, so anything already known is taken from
+    here and only cache misses are requested from the API.
+
+    Videos are marked 'complete' if their metadata came from videos.list. Metadata from
+    search.list snippets lacks tags and has truncated descriptions, so it's cached as
+    incomplete, and never overwrites complete metadata.
+
+    The cache is a SQLite database at CACHE_DIR/youtube_videos.sqlite. Once it holds more
+    than YOUTUBE_CACHE_MAX_VIDEOS (from conf.yml) videos, the least recently used ones
+    are evicted.
+    '''
+
+    DEFAULT_MAX_VIDEOS = 100000
+    CACHE_FILE = 'youtube_videos.sqlite'
+
+    # SQLite limits the number of parameters in a single statement.
+    MAX_QUERY_IDS = 500
+
+    def __init__(self, app_conf):
+        self.max_videos = int(app_conf.get('YOUTUBE_CACHE_MAX_VIDEOS', self.DEFAULT_MAX_VIDEOS))
+
+        os.makedirs(app_conf['CACHE_DIR'], exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(app_conf['CACHE_DIR'], self.CACHE_FILE),
+            check_same_thread=False)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS videos (
+            video_id TEXT PRIMARY KEY,
+            title TEXT,
+            description TEXT,
+            tags TEXT,
+            complete INTEGER,
+            last_used REAL)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS videos_last_used ON videos (last_used)')
+        self.conn.commit()
+
+
+    def get_many(self, video_ids, complete_only=True):
+        '''
+        Returns a dict of video id -> snippet dict with 'title', 'description' and 'tags'
+        for every video id found in the cache.
+        '''
+        found = {}
+        video_ids = list(video_ids)
+
+        with self.lock:
+            for i in range(0, len(video_ids), self.MAX_QUERY_IDS):
+                batch = video_ids[i:i+self.MAX_QUERY_IDS]
+                query = 'SELECT video_id, title, description, tags FROM videos WHERE video_id IN (%s)' % (
+                    ','.join('?' * len(batch)))
+                if complete_only:
+                    query += ' AND complete = 1'
+
+                for video_id, title, description, tags in self.conn.execute(query, batch):
+                    found[video_id] = {
+                        'title' : title,
+                        'description' : description,
+                        'tags' : json.loads(tags) if tags else None
+                    }
+
+            if found:
+                now = time.time()
+                self.conn.executemany('UPDATE videos SET last_used = ? WHERE video_id = ?',
+                    [ (now, video_id) for video_id in found ])
+                self.conn.commit()
+
+        return found
+
+
+    def put_many(self, snippets, complete=True):
+        '''
+        snippets: a dict of video id -> snippet dict, as returned by the API.
+        complete: True if snippets came from videos.list. Incomplete snippets don't
+            replace anything already cached.
+        '''
+        if not snippets:
+            return
+
+        now = time.time()
+        rows = [ (video_id, s.get('title', ''), s.get('description', ''),
+                    json.dumps(s['tags']) if s.get('tags', None) else None,
+                    1 if complete else 0, now)
+                for video_id, s in snippets.items() ]
+
+        statement = 'INSERT OR REPLACE' if complete else 'INSERT OR IGNORE'
+        with self.lock:
+            self.conn.executemany(statement + ' INTO videos VALUES (?,?,?,?,?,?)', rows)
+            self.evict()
+            self.conn.commit()
+
+
+    def evict(self):
+        count = self.conn.execute('SELECT COUNT(*) FROM videos').fetchone()[0]
+        if count > self.max_videos:
+            self.conn.execute('''DELETE FROM videos WHERE video_id IN
+                (SELECT video_id FROM videos ORDER BY last_used LIMIT ?)''', (count - self.max_videos,))
+
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+
+def video_contents(snippet):
+    '''
+    Combines a video snippet's title, description and tags into a single text document.
+    '''
+    title = snippet.get('title','')
+    desc = snippet.get('description','')
+    tags = snippet.get('tags', None)
+    tags = ' '.join(tags) if tags else ''
+
+    # Since LDA is a bag of words model, things like newlines and order of terms don't matter.
+    # Just combine all the attributes into a single string.
+    return ' '.join([title, desc, tags])
@@ -0,0 +1,134 @@
+'''
+Term counts of entries computed once at store time, against a shared vocabulary.
+
+With VOCABULARY_FILE configured in conf.yml, HistoryStore and TargetStore run every entry's
+contents through the same tokenizer and stop words as the LDA job (see text_pipeline.py),
+and store the result with the entry as two parallel lists:
+
+    term_ids    : ids of the distinct terms in the entry, in ascending order.
+    term_counts : number of times each of those terms occurs.
+
+A term's id is its line number (from 0) in the vocabulary file. The file is only ever
+appended to, so ids never change once assigned, and entries stored on any date remain
+valid. It's shared by all stores and processes, and appends are serialized with a file lock.
+
+Because stop words are removed before counting, changing custom_stopwords.txt has no
+effect on entries that were already stored.
+'''
+from __future__ import print_function
+import fcntl
+import os
+import os.path
+import threading
+from collections import Counter
+
+import text_pipeline
+
+
+class Vocabulary(object):
+    '''
+    An append-only list of terms, kept in a text file with one term per line.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.terms = []
+        self.term_ids = {}
+
+        # Bytes of the file already read into terms.
+        self.offset = 0
+
+        self.lock = threading.Lock()
+
+        dirname = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(dirname, exist_ok=True)
+
+        with open(filename, 'ab+') as f:
+            self.read_new_terms(f)
+
+
+    def read_new_terms(self, f):
+        '''
+        Reads terms appended to the file since it was last read, possibly by another process.
+        '''
+        f.seek(self.offset)
+        for line in f:
+            # A line without a newline is still being written by another process.
+            if not line.endswith(b'\n'):
+                break
+
+            term = line[:-1].decode('utf-8')
+            self.term_ids[term] = len(self.terms)
+            self.terms.append(term)
+            self.offset += len(line)
+
+
+    def ids(self, terms):
+        '''
+        Returns a dict of term to term id for all terms, adding any new ones to the vocabulary.
+        '''
+        with self.lock:
+            new_terms = set(t for t in terms if t not in self.term_ids)
+
+            if new_terms:
+                with open(self.filename, 'ab+') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    try:
+                        # Another process may have added some of them already.
+                        self.read_new_terms(f)
+                        new_terms = sorted(t for t in new_terms if t not in self.term_ids)
+
+                        f.seek(0, os.SEEK_END)
+                        f.write(b''.join((t + '\n').encode('utf-8') for t in new_terms))
+                        f.flush()
+                        self.read_new_terms(f)
+                    finally:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+            return { t : self.term_ids[t] for t in terms }
+
+
+
+class TermCounter(object):
+    '''
+    Adds term_ids and term_counts to entries before they're stored.
+    '''
+
+    def __init__(self, vocabulary_file, custom_stop_words_file=text_pipeline.CUSTOM_STOP_WORDS_FILE):
+        self.vocabulary = Vocabulary(vocabulary_file)
+        self.stop_words = text_pipeline.load_stop_words(custom_stop_words_file)
+
+
+    def add_term_counts(self, entries):
+        entry_counts = [ Counter(text_pipeline.terms(e.get('contents', None) or '', self.stop_words))
+                            for e in entries ]
+
+        # New terms of all entries are added to the vocabulary together.
+        all_terms = set()
+        for counts in entry_counts:
+            all_terms.update(counts)
+        term_ids = self.vocabulary.ids(all_terms)
+
+        for e, counts in zip(entries, entry_counts):
+            id_counts = sorted((term_ids[t], c) for t, c in counts.items())
+            e['term_ids'] = [ i for i, c in id_counts ]
+            e['term_counts'] = [ c for i, c in id_counts ]
+
+
+
+def create_term_counter(app_conf):
+    '''
+    Returns a TermCounter if VOCABULARY_FILE is configured, else None.
+    '''
+    vocabulary_file = app_conf.get('VOCABULARY_FILE', None)
+    if not vocabulary_file:
+        return None
+
+    return TermCounter(vocabulary_file)
+
+
+def load_terms(vocabulary_file):
+    '''
+    Returns the list of all terms in a vocabulary file, indexed by term id.
+    '''
+    return Vocabulary(vocabulary_file).terms
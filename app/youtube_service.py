@@ -0,0 +1,115 @@
+'''
+YouTube Data API clients for the YouTube history handler and target fetcher.
+
+Building an API client needs the API's discovery document, which the client library
+would otherwise download on every run. Here it's downloaded once and kept in
+CACHE_DIR/discovery/youtube-v3.json, and clients are built from that local copy.
+It's downloaded again once it's older than DISCOVERY_MAX_AGE. If that fails, the old
+copy keeps being used, so only the first run ever needs network access to build a client.
+
+Clients are built from the document without any network access. They aren't shared
+between handlers, since the HTTP client underneath isn't thread safe.
+'''
+from __future__ import print_function
+import json
+import os
+import os.path
+import threading
+import time
+
+import requests
+import yaml
+
+API_NAME = 'youtube'
+API_VERSION = 'v3'
+API_KEY_FILE = 'yt_api_key.yml'
+
+DEFAULT_DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/{api}/{apiVersion}/rest'
+DISCOVERY_MAX_AGE = 7 * 24 * 3600     # Seconds
+DISCOVERY_TIMEOUT = 30
+
+KEY_ERROR = ("Error: YouTube API key file conf/yt_api_key.yml not found or API key is not present in that file.\n"
+        "Obtain an API key as explained in https://developers.google.com/youtube/v3/getting-started#before-you-start.\n"
+        "Then create a copy of conf/yt_api_key_template.yml as conf/yt_api_key.yml and insert the key in it.")
+
+# discovery url -> discovery document
+_documents = {}
+_documents_lock = threading.Lock()
+
+
+def get_youtube_service(app_conf):
+    '''
+    Returns a YouTube Data API client.
+
+    YOUTUBE_DISCOVERY_URL in conf.yml can point the client at another server,
+    like a local stand-in server for benchmarks.
+    '''
+    # Imported here, since importing the client library itself takes a while.
+    from apiclient import discovery
+
+    api_key = read_api_key(app_conf)
+    discovery_url = app_conf.get('YOUTUBE_DISCOVERY_URL', None) or DEFAULT_DISCOVERY_URL
+
+    with _documents_lock:
+        document = _documents.get(discovery_url, None)
+        if document is None:
+            document = _documents[discovery_url] = get_discovery_document(app_conf, discovery_url)
+
+    return discovery.build_from_document(document, developerKey=api_key)
+
+
+def read_api_key(app_conf):
+    yt_api_key_file = os.path.join(app_conf['CONF_DIR'], API_KEY_FILE)
+    if not os.path.exists(yt_api_key_file):
+        raise RuntimeError(KEY_ERROR)
+
+    with open(yt_api_key_file, 'r') as cred_file:
+        creds = yaml.safe_load(cred_file) or {}
+    api_key = creds.get('key', '')
+    if not api_key:
+        raise RuntimeError(KEY_ERROR)
+
+    return api_key
+
+
+def get_discovery_document(app_conf, discovery_url):
+    '''
+    Returns the discovery document as a string, from the local copy if it's fresh enough.
+    '''
+    url = discovery_url.replace('{api}', API_NAME).replace('{apiVersion}', API_VERSION)
+
+    cache_dir = os.path.join(app_conf['CACHE_DIR'], 'discovery')
+    cache_file = os.path.join(cache_dir, '%s-%s.json' % (API_NAME, API_VERSION))
+    meta_file = cache_file + '.url'
+
+    cached = None
+    if os.path.exists(cache_file) and os.path.exists(meta_file):
+        with open(meta_file, 'r') as f:
+            cached_url = f.read().strip()
+        # A copy downloaded from another discovery URL is of no use.
+        if cached_url == url:
+            with open(cache_file, 'r') as f:
+                cached = f.read()
+            if time.time() - os.path.getmtime(cache_file) < DISCOVERY_MAX_AGE:
+                return cached
+
+    try:
+        resp = requests.get(url, timeout=DISCOVERY_TIMEOUT)
+        resp.raise_for_status()
+        document = resp.text
+        # Validates it before it replaces a good copy.
+        json.loads(document)
+    except Exception as e:
+        if cached is not None:
+            print('Could not refresh YouTube API discovery document, using cached copy. Reason:', e)
+            return cached
+        raise
+
+    os.makedirs(cache_dir, exist_ok=True)
+    for filename, text in ((cache_file, document), (meta_file, url)):
+        tmp_file = filename + '.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(text)
+        os.replace(tmp_file, filename)
+
+    return document
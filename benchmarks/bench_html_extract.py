@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+'''
+Micro-benchmark of HackerNews comment extraction with each installed HTML parser
+(see app/html_extract.py), compared with the original BeautifulSoup code of the HN handler.
+
+On recorded pages:
+
+    python3 bench_html_extract.py --record 14563000 14564000 --pages pages/
+    python3 bench_html_extract.py --pages pages/
+
+--record downloads item pages from news.ycombinator.com into the pages directory, once.
+Without --pages, synthetic pages marked up like HN's are used, with --comments comments each.
+
+Every parser's output is checked against the original code's before it's timed.
+'''
+from __future__ import print_function
+import argparse
+import glob
+import os
+import os.path
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARKS_DIR), 'app'))
+
+import html_extract
+import synthetic
+from stub_servers import hn_item_page
+
+
+def original_extract(content):
+    # HackerNewsHistoryHandler.fetch_contents before html_extract.
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'html.parser')
+    for s in soup.find_all('div', attrs={'class':'reply'}):
+        s.decompose()
+
+    comments = soup.find_all('div', attrs={'class':'comment'})
+    return ' '.join([s.get_text() for s in comments])
+
+
+def record(item_ids, pages_dir):
+    import requests
+    os.makedirs(pages_dir, exist_ok=True)
+    for item_id in item_ids:
+        resp = requests.get('https://news.ycombinator.com/item?id=%s' % (item_id), timeout=30)
+        resp.raise_for_status()
+        with open(os.path.join(pages_dir, '%s.html' % (item_id)), 'wb') as f:
+            f.write(resp.content)
+        print('Recorded item', item_id, len(resp.content), 'bytes')
+        # Within HN's crawl limits.
+        time.sleep(1)
+
+
+def load_pages(args):
+    if args.pages:
+        pages = []
+        for filename in sorted(glob.glob(os.path.join(args.pages, '*.html'))):
+            with open(filename, 'rb') as f:
+                pages.append(f.read())
+        if not pages:
+            sys.exit('No *.html pages in %s' % (args.pages))
+        return pages
+
+    corpus = synthetic.SyntheticCorpus(args.seed)
+    pages = []
+    for i in range(args.num_pages):
+        comments = corpus.hn_comments(i, num_comments=args.comments)
+        pages.append(hn_item_page(str(i), comments).encode('utf-8'))
+    return pages
+
+
+def time_extract(extract, pages, repeat):
+    best = None
+    for r in range(repeat):
+        t0 = time.perf_counter()
+        for page in pages:
+            extract(page)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark HTML comment extraction')
+    parser.add_argument('--pages', help='Directory of recorded HN item pages (*.html)')
+    parser.add_argument('--record', nargs='+', metavar='ITEM-ID',
+        help='Download these HN items into the --pages directory first')
+    parser.add_argument('--num-pages', dest='num_pages', type=int, default=50,
+        help='Number of synthetic pages, without --pages. Default: 50')
+    parser.add_argument('--comments', type=int, default=200,
+        help='Comments per synthetic page. Default: 200')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3, help='Best of this many runs is reported. Default: 3')
+    args = parser.parse_args()
+
+    if args.record:
+        if not args.pages:
+            sys.exit('--record needs --pages')
+        record(args.record, args.pages)
+
+    pages = load_pages(args)
+    total_bytes = sum(len(p) for p in pages)
+    print('%d pages, %.1f MB' % (len(pages), total_bytes / 1e6))
+
+    expected = [ original_extract(p) for p in pages ]
+
+    candidates = [ ('original bs4', original_extract) ]
+    for name in html_extract.available_parsers():
+        extractor = html_extract.TextExtractor('div', 'comment', exclude_class='reply', parser=name)
+        extract = lambda page, extractor=extractor: ' '.join(extractor.extract(page))
+        mismatches = sum(1 for p, e in zip(pages, expected) if extract(p) != e)
+        if mismatches:
+            print('WARNING: %s differs from the original on %d pages' % (name, mismatches))
+        candidates.append((name, extract))
+
+    print('\n%-16s %10s %10s %10s %8s' % ('parser', 'seconds', 'pages/s', 'MB/s', 'speedup'))
+    baseline = None
+    for name, extract in candidates:
+        seconds = time_extract(extract, pages, args.repeat)
+        baseline = baseline or seconds
+        print('%-16s %10.3f %10.1f %10.2f %7.1fx' % (name, seconds, len(pages) / seconds,
+            total_bytes / 1e6 / seconds, baseline / seconds))
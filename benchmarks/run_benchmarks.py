@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+'''
+Benchmarks of the recommender's hot paths, on a synthetic corpus, against local stand-in
+servers for HackerNews, RSS feeds and the YouTube API (see stub_servers.py).
+
+    python3 run_benchmarks.py --scale 10000 --report reports/10k.json
+    python3 run_benchmarks.py --scale 10000 --compare reports/10k.json
+
+Benchmarks:
+
+    store-write-files       TargetStore writes of synthetic entries, with each backend.
+    store-write-segments
+    upload                  Processing a synthetic Chrome history export of SCALE entries,
+                            including fetching HackerNews items and YouTube videos.
+    fetch                   Fetching all targets: SCALE feed items in total, and YouTube searches.
+    fetch-incremental       Fetching again, when nothing has changed.
+    recommend-local         The local LDA engine on what upload and fetch stored.
+    recommend-local-saved   The same again, reusing the model saved by the previous run.
+    recommend-spark         The Spark job, only if --spark-dir and --spark-jar are given.
+
+Everything runs in a temporary work directory with its own configuration, based on
+app/conf/conf.yml. Nothing under the app's own data directories is touched.
+
+The report is a JSON file with the seconds taken and items processed by each benchmark,
+plus stage timings of recommend. With --compare, each benchmark is compared with a
+previous report, and any that got slower by more than --tolerance are reported as
+regressions.
+'''
+from __future__ import print_function
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import os.path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'app')
+sys.path.insert(0, APP_DIR)
+
+import synthetic
+from stub_servers import StubServer
+
+REPORT_VERSION = 1
+
+NUM_FEEDS = 4
+STORE_BATCH_SIZE = 100
+
+
+def make_conf(work_dir, stub, scale, youtube_results):
+    '''
+    Returns an app configuration like conf.yml, but with all data under work_dir
+    and all targets served by the stub server.
+    '''
+    with open(os.path.join(APP_DIR, 'conf', 'conf.yml'), 'r') as f:
+        app_conf = yaml.safe_load(f)
+
+    conf_dir = os.path.join(work_dir, 'conf')
+    os.makedirs(conf_dir)
+    with open(os.path.join(conf_dir, 'yt_api_key.yml'), 'w') as f:
+        f.write('key: "benchmark"\n')
+
+    app_conf.update({
+        'HISTORY_DIR' : os.path.join(work_dir, 'historydata'),
+        'TARGET_DIR' : os.path.join(work_dir, 'targetdata'),
+        'CACHE_DIR' : os.path.join(work_dir, 'cache'),
+        'MODEL_DIR' : os.path.join(work_dir, 'cache', 'models'),
+        'CONF_DIR' : conf_dir,
+        'HN_BASE_URL' : stub.base_url,
+        'YOUTUBE_DISCOVERY_URL' : stub.discovery_url,
+        # Benchmarks measure the app, not how politely it waits for real servers.
+        'RATE_LIMITS' : {},
+        'TARGETS' : [ { 'name' : name, 'type' : 'feed', 'url' : stub.feed_url(name) } for name in sorted(stub.feeds) ]
+                    + [ { 'name' : 'youtube-latest', 'type' : 'youtube', 'period' : 6 } ]
+    })
+    if app_conf.get('VOCABULARY_FILE', None):
+        app_conf['VOCABULARY_FILE'] = os.path.join(work_dir, 'vocabulary.txt')
+
+    return app_conf
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    '''
+    Hides everything the app prints while a benchmark runs.
+    '''
+    if not enabled:
+        yield
+        return
+
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            yield
+
+
+def timed(name, items, func, verbose=False):
+    print('Running %s...' % (name), file=sys.stderr)
+    t0 = time.time()
+    with quiet(not verbose):
+        extra = func() or {}
+    seconds = time.time() - t0
+
+    result = {
+        'seconds' : seconds,
+        'items' : items,
+        'items_per_second' : items / seconds if seconds > 0 and items else None
+    }
+    result.update(extra)
+    print('    %.2f s' % (seconds), file=sys.stderr)
+    return result
+
+
+def bench_store_write(app_conf, corpus, scale, backend):
+    from target_store import TargetStore
+
+    conf = dict(app_conf)
+    conf.update({
+        'STORAGE_BACKEND' : backend,
+        'DEDUP_INDEX' : False,
+        'TARGET_DIR' : os.path.join(os.path.dirname(app_conf['TARGET_DIR']), 'store-write-' + backend)
+    })
+    entries = list(corpus.targets(scale))
+
+    def run():
+        store = TargetStore(conf)
+        store_path = store.prepare_to_store('benchmark')
+        for start in range(0, len(entries), STORE_BATCH_SIZE):
+            store.store_content('benchmark', entries[start:start + STORE_BATCH_SIZE], store_path)
+        store.close()
+
+    return run
+
+
+def bench_upload(app_conf, history_filename):
+    from history import HistoryProcessor
+    from history_store import HistoryStore
+
+    def run():
+        store = HistoryStore(app_conf)
+        HistoryProcessor(app_conf).process_history(history_filename, store)
+        store.close()
+
+    return run
+
+
+def bench_fetch(app_conf):
+    from targets import TargetsProcessor
+    from target_store import TargetStore
+
+    def run():
+        store = TargetStore(app_conf)
+        TargetsProcessor(app_conf).fetch(store)
+        store.close()
+
+    return run
+
+
+def bench_recommend_local(app_conf, num_topics, num_iterations, model_dir=None):
+    import local_lda
+
+    def run():
+        stages = {}
+        for record in local_lda.iter_results(app_conf['HISTORY_DIR'], app_conf['TARGET_DIR'],
+                num_topics, num_iterations, model_dir=model_dir,
+                vocabulary_file=app_conf.get('VOCABULARY_FILE', None)):
+            if record['type'] == 'stage':
+                stages[record['name']] = record['seconds']
+        return { 'stages' : stages }
+
+    return run
+
+
+def bench_recommend_spark(app_conf, num_topics, num_iterations, spark_dir, spark_jar, work_dir):
+    from results import follow_records
+
+    def run():
+        results_filename = os.path.join(work_dir, 'spark-results.jsonl')
+        open(results_filename, 'w').close()
+        proc_args = [
+            os.path.join(spark_dir, 'bin', 'spark-submit'),
+            spark_jar,
+            app_conf['HISTORY_DIR'],
+            app_conf['TARGET_DIR'],
+            str(num_topics),
+            str(num_iterations),
+            'em',
+            os.path.join(APP_DIR, 'custom_stopwords.txt'),
+            '--results', results_filename
+        ]
+        with open(os.path.join(work_dir, 'spark.log'), 'w') as log_file:
+            p = subprocess.Popen(proc_args, stdout=log_file, stderr=subprocess.STDOUT)
+            stages = {}
+            done = False
+            for record in follow_records(results_filename, p):
+                if record['type'] == 'stage':
+                    stages[record['name']] = record['seconds']
+                done = done or record['type'] == 'done'
+            p.wait()
+
+        if not done:
+            raise RuntimeError('Spark job failed. See %s' % (os.path.join(work_dir, 'spark.log')))
+        return { 'stages' : stages }
+
+    return run
+
+
+def count_entries(data_dir):
+    from storage_backends import iter_partition_entries
+    count = 0
+    for partition in os.listdir(data_dir):
+        partition_path = os.path.join(data_dir, partition)
+        if os.path.isdir(partition_path) and not partition.startswith('_'):
+            count += sum(1 for e in iter_partition_entries(partition_path))
+    return count
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BENCHMARKS_DIR,
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    only = set(args.only.split(',')) if args.only else None
+    selected = lambda name: only is None or name in only
+
+    work_dir = tempfile.mkdtemp(prefix='recommender-bench-')
+    corpus = synthetic.SyntheticCorpus(args.seed)
+    stub = StubServer(corpus,
+        feeds={ 'feed-%d' % (i) : max(1, args.scale // NUM_FEEDS) for i in range(NUM_FEEDS) },
+        search_results=args.youtube_results, latency=args.latency).start()
+
+    # Plugins are loaded from directories relative to the app directory.
+    cwd = os.getcwd()
+    os.chdir(APP_DIR)
+
+    results = {}
+    try:
+        app_conf = make_conf(work_dir, stub, args.scale, args.youtube_results)
+        if args.parse_workers:
+            app_conf['PARSE_WORKERS'] = args.parse_workers
+
+        history_filename = os.path.join(work_dir, 'history.json')
+        synthetic.write_history(history_filename, corpus.history(args.scale))
+
+        for backend in ('files', 'segments'):
+            name = 'store-write-' + backend
+            if selected(name):
+                results[name] = timed(name, args.scale,
+                    bench_store_write(app_conf, corpus, args.scale, backend), args.verbose)
+
+        # Everything after upload and fetch works on what they store,
+        # so they always run.
+        results['upload'] = timed('upload', args.scale, bench_upload(app_conf, history_filename), args.verbose)
+        results['fetch'] = timed('fetch', args.scale + args.youtube_results, bench_fetch(app_conf), args.verbose)
+        if selected('fetch-incremental'):
+            results['fetch-incremental'] = timed('fetch-incremental', 0, bench_fetch(app_conf), args.verbose)
+
+        num_docs = count_entries(app_conf['HISTORY_DIR']) + count_entries(app_conf['TARGET_DIR'])
+
+        if 'local' in args.engines:
+            if selected('recommend-local'):
+                results['recommend-local'] = timed('recommend-local', num_docs,
+                    bench_recommend_local(app_conf, args.topics, args.iterations), args.verbose)
+
+            if selected('recommend-local-saved'):
+                # The first run saves the model, and the second one reuses it.
+                bench_recommend_local(app_conf, args.topics, args.iterations, app_conf['MODEL_DIR'])()
+                results['recommend-local-saved'] = timed('recommend-local-saved', num_docs,
+                    bench_recommend_local(app_conf, args.topics, args.iterations, app_conf['MODEL_DIR']), args.verbose)
+
+        if 'spark' in args.engines and selected('recommend-spark'):
+            if not args.spark_dir or not args.spark_jar:
+                print('Skipping recommend-spark: --spark-dir and --spark-jar are required', file=sys.stderr)
+            else:
+                results['recommend-spark'] = timed('recommend-spark', num_docs,
+                    bench_recommend_spark(app_conf, args.topics, args.iterations,
+                        args.spark_dir, args.spark_jar, work_dir), args.verbose)
+
+    finally:
+        os.chdir(cwd)
+        stub.stop()
+        if args.keep:
+            print('Work directory kept at', work_dir, file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'version' : REPORT_VERSION,
+        'created' : datetime.datetime.utcnow().isoformat('T') + 'Z',
+        'git_commit' : git_commit(),
+        'python' : platform.python_version(),
+        'platform' : platform.platform(),
+        'cpu_count' : os.cpu_count(),
+        'params' : {
+            'scale' : args.scale,
+            'seed' : args.seed,
+            'latency' : args.latency,
+            'youtube_results' : args.youtube_results,
+            'topics' : args.topics,
+            'iterations' : args.iterations
+        },
+        'stub_requests' : dict(stub.request_counts),
+        'results' : results
+    }
+
+
+def compare(report, baseline, tolerance):
+    '''
+    Prints how each benchmark compares with the baseline report,
+    and returns the names of those that got slower by more than tolerance.
+    '''
+    if report['params'] != baseline.get('params', None):
+        print('Warning: baseline was run with different parameters:', baseline.get('params', None))
+
+    regressions = []
+    print('\n%-24s %12s %12s %8s' % ('benchmark', 'baseline s', 'current s', 'ratio'))
+    for name, result in sorted(report['results'].items()):
+        base = baseline['results'].get(name, None)
+        if base is None:
+            print('%-24s %12s %12.2f' % (name, '-', result['seconds']))
+            continue
+
+        ratio = result['seconds'] / base['seconds'] if base['seconds'] > 0 else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('%-24s %12.2f %12.2f %8.2f%s' % (name, base['seconds'], result['seconds'], ratio, flag))
+
+    return regressions
+
+
+def print_summary(report):
+    print('\n%-24s %12s %10s %14s' % ('benchmark', 'seconds', 'items', 'items/s'))
+    for name, result in sorted(report['results'].items()):
+        print('%-24s %12.2f %10d %14s' % (name, result['seconds'], result['items'],
+            '%.1f' % (result['items_per_second']) if result['items_per_second'] else '-'))
+        for stage, seconds in sorted(result.get('stages', {}).items(), key=lambda s: -s[1]):
+            print('    %-20s %12.2f' % (stage, seconds))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run benchmarks on a synthetic corpus')
+    parser.add_argument('--scale', type=int, default=1000,
+        help='Number of history entries, and of feed items. From 1000 to 1000000. Default: 1000')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the synthetic corpus. Default: 1')
+    parser.add_argument('--latency', type=float, default=0.0,
+        help='Seconds added to every stub server response. Default: 0')
+    parser.add_argument('--youtube-results', dest='youtube_results', type=int, default=200,
+        help='Number of videos found by YouTube target searches. Default: 200')
+    parser.add_argument('--parse-workers', dest='parse_workers', type=int,
+        help='Number of parse worker processes during upload. Default: PARSE_WORKERS from conf.yml')
+    parser.add_argument('--engines', default='local',
+        help='Comma separated recommend engines to benchmark: local, spark. Default: local')
+    parser.add_argument('--topics', type=int, default=20, help='Number of topics for recommend. Default: 20')
+    parser.add_argument('--iterations', type=int, default=20, help='Number of LDA iterations. Default: 20')
+    parser.add_argument('--spark-dir', dest='spark_dir', help='Path of a Spark installation, for recommend-spark')
+    parser.add_argument('--spark-jar', dest='spark_jar', help='Path of the Spark job JAR, for recommend-spark')
+    parser.add_argument('--only', help='Comma separated names of benchmarks to run. upload and fetch always run.')
+    parser.add_argument('--report', help='Write the JSON report to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare results with an earlier JSON report')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+        help='Fraction by which a benchmark may be slower than baseline before it\'s a regression. Default: 0.2')
+    parser.add_argument('--keep', action='store_true', help='Keep the work directory with all generated data')
+    parser.add_argument('--verbose', action='store_true', help='Show everything the app prints')
+    args = parser.parse_args()
+    args.engines = args.engines.split(',')
+
+    report = run(args)
+    print_summary(report)
+
+    if args.report:
+        report_dir = os.path.dirname(os.path.abspath(args.report))
+        os.makedirs(report_dir, exist_ok=True)
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print('\nReport written to', args.report)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
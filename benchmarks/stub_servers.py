@@ -0,0 +1,270 @@
+'''
+Local stand-in for the web services the recommender fetches from, for benchmarks.
+
+A single threaded HTTP server on the loopback interface serves:
+
+    /item?id=N                      HackerNews item pages, with comments in <div class="comment">
+                                    (point HN_BASE_URL in the app configuration here).
+    /feeds/<name>.rss               RSS feeds, with ETag validators so that conditional
+                                    requests get a 304 when nothing has changed.
+    /discovery/youtube/v3           A minimal YouTube Data API v3 discovery document,
+                                    describing only the videos.list and search.list methods
+                                    (point YOUTUBE_DISCOVERY_URL here).
+    /youtube/v3/videos              videos.list
+    /youtube/v3/search              search.list, in pages of 50 results.
+
+All content comes from a SyntheticCorpus, so it's the same on every run. An optional
+latency is added to every response to model a real network.
+'''
+from __future__ import print_function
+import json
+import threading
+import time
+from collections import Counter
+from xml.sax.saxutils import escape
+
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer as ThreadingHTTPServer
+    from urlparse import urlparse, parse_qs
+
+import synthetic
+
+SEARCH_PAGE_SIZE = 50
+
+
+def discovery_document(root_url):
+    string_param = lambda required=False: { 'type' : 'string', 'location' : 'query', 'required' : required }
+    return {
+        'kind' : 'discovery#restDescription',
+        'discoveryVersion' : 'v1',
+        'id' : 'youtube:v3',
+        'name' : 'youtube',
+        'version' : 'v3',
+        'rootUrl' : root_url,
+        'servicePath' : 'youtube/v3/',
+        'baseUrl' : root_url + 'youtube/v3/',
+        'batchPath' : 'batch',
+        'protocol' : 'rest',
+        'parameters' : {
+            'key' : string_param(),
+            'alt' : { 'type' : 'string', 'location' : 'query', 'default' : 'json' }
+        },
+        'schemas' : {
+            'VideoListResponse' : {
+                'id' : 'VideoListResponse', 'type' : 'object',
+                'properties' : { 'items' : { 'type' : 'array', 'items' : { 'type' : 'object' } } }
+            },
+            'SearchListResponse' : {
+                'id' : 'SearchListResponse', 'type' : 'object',
+                'properties' : {
+                    'nextPageToken' : { 'type' : 'string' },
+                    'items' : { 'type' : 'array', 'items' : { 'type' : 'object' } }
+                }
+            }
+        },
+        'resources' : {
+            'videos' : {
+                'methods' : {
+                    'list' : {
+                        'id' : 'youtube.videos.list',
+                        'path' : 'videos',
+                        'httpMethod' : 'GET',
+                        'parameters' : { 'part' : string_param(True), 'id' : string_param() },
+                        'parameterOrder' : [ 'part' ],
+                        'response' : { '$ref' : 'VideoListResponse' }
+                    }
+                }
+            },
+            'search' : {
+                'methods' : {
+                    'list' : {
+                        'id' : 'youtube.search.list',
+                        'path' : 'search',
+                        'httpMethod' : 'GET',
+                        'parameters' : {
+                            'part' : string_param(True),
+                            'type' : string_param(),
+                            'q' : string_param(),
+                            'publishedAfter' : string_param(),
+                            'pageToken' : string_param()
+                        },
+                        'parameterOrder' : [ 'part' ],
+                        'response' : { '$ref' : 'SearchListResponse' }
+                    }
+                }
+            }
+        }
+    }
+
+
+def hn_item_page(item_id, comments):
+    '''
+    Returns a HackerNews item page with the given comments, marked up like the real ones.
+    '''
+    rows = ''.join(
+        '<tr class="athing comtr" id="%s%d"><td><table border="0"><tr>'
+        '<td class="ind"><img src="s.gif" height="1" width="%d"></td>'
+        '<td class="default"><div style="margin-top:2px; margin-bottom:-10px;">'
+        '<span class="comhead"><a href="user?id=user%d" class="hnuser">user%d</a> '
+        '<span class="age"><a href="item?id=%s%d">1 hour ago</a></span></span></div><br>'
+        '<div class="comment"><span class="commtext c00">%s</span>'
+        '<div class="reply"><p><font size="1"><u><a href="reply?id=%s%d&amp;goto=item%%3Fid%%3D%s">reply</a></u></font></p></div>'
+        '</div></td></tr></table></td></tr>\n' % (
+            item_id, i, (i % 4) * 40, i, i, item_id, i, escape(c), item_id, i, item_id)
+        for i, c in enumerate(comments))
+    return ('<html lang="en" op="item"><head><meta name="referrer" content="origin">'
+        '<link rel="stylesheet" type="text/css" href="news.css"><title>Item %s | Hacker News</title></head>'
+        '<body><center><table id="hnmain" border="0" cellpadding="0" cellspacing="0" width="85%%">'
+        '<tr><td><table class="comment-tree" border="0">\n%s</table></td></tr></table></center></body></html>') % (item_id, rows)
+
+
+class StubServer(object):
+    '''
+    corpus: the SyntheticCorpus content is generated from.
+    feeds: dict of feed name to number of items in that feed.
+    search_results: total number of videos returned by YouTube searches.
+    latency: seconds added to every response.
+    '''
+
+    def __init__(self, corpus, feeds=None, search_results=200, latency=0.0):
+        self.corpus = corpus
+        self.feeds = feeds or {}
+        self.search_results = search_results
+        self.latency = latency
+        self.request_counts = Counter()
+        self.lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:%d' % (self.server.server_address[1])
+
+
+    @property
+    def discovery_url(self):
+        # Expanded by the API client with the API name and version.
+        return self.base_url + '/discovery/{api}/{apiVersion}'
+
+
+    def feed_url(self, name):
+        return '%s/feeds/%s.rss' % (self.base_url, name)
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def handle(self, request):
+        url = urlparse(request.path)
+        params = parse_qs(url.query)
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        route = url.path.strip('/').split('/')[0]
+        with self.lock:
+            self.request_counts[route] += 1
+
+        if url.path == '/item':
+            self.send(request, 200, 'text/html', self.hn_item(params['id'][0]))
+        elif url.path.startswith('/feeds/'):
+            self.feed(request, url.path[len('/feeds/'):-len('.rss')])
+        elif url.path == '/discovery/youtube/v3':
+            self.send(request, 200, 'application/json', json.dumps(discovery_document(self.base_url + '/')))
+        elif url.path == '/youtube/v3/videos':
+            self.send(request, 200, 'application/json', json.dumps(self.videos(params)))
+        elif url.path == '/youtube/v3/search':
+            self.send(request, 200, 'application/json', json.dumps(self.search(params)))
+        else:
+            self.send(request, 404, 'text/plain', 'Not found')
+
+
+    def send(self, request, status, content_type, body, headers=None):
+        body = body.encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', content_type + '; charset=utf-8')
+        request.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(body)
+
+
+    def hn_item(self, item_id):
+        return hn_item_page(item_id, self.corpus.hn_comments(item_id))
+
+
+    def feed(self, request, name):
+        num_items = self.feeds.get(name, None)
+        if num_items is None:
+            self.send(request, 404, 'text/plain', 'Not found')
+            return
+
+        etag = '"%s-%d"' % (name, num_items)
+        if request.headers.get('If-None-Match', None) == etag:
+            request.send_response(304)
+            request.send_header('ETag', etag)
+            request.end_headers()
+            return
+
+        items = ''.join(
+            '<item><guid>%s</guid><title>%s</title><link>%s</link><description>%s</description></item>\n' % (
+                escape(guid), escape(title), escape(link), escape(desc))
+            for guid, title, link, desc in self.corpus.feed_items(name, num_items))
+        body = ('<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0"><channel>'
+            '<title>%s</title><link>%s</link><description>%s</description>\n%s</channel></rss>') % (
+                name, self.feed_url(name), name, items)
+
+        self.send(request, 200, 'application/rss+xml', body, { 'ETag' : etag })
+
+
+    def videos(self, params):
+        ids = params.get('id', [''])[0].split(',')
+        return {
+            'kind' : 'youtube#videoListResponse',
+            'items' : [ { 'kind' : 'youtube#video', 'id' : vid, 'snippet' : self.corpus.video_snippet(vid) }
+                        for vid in ids if vid ]
+        }
+
+
+    def search(self, params):
+        start = int(params.get('pageToken', ['0'])[0])
+        end = min(start + SEARCH_PAGE_SIZE, self.search_results)
+
+        items = []
+        for i in range(start, end):
+            vid = synthetic.video_id(10 ** 9 + i)
+            snippet = self.corpus.video_snippet(vid)
+            # Search results don't include tags.
+            del snippet['tags']
+            items.append({ 'kind' : 'youtube#searchResult', 'id' : { 'kind' : 'youtube#video', 'videoId' : vid },
+                           'snippet' : snippet })
+
+        resp = { 'kind' : 'youtube#searchListResponse', 'items' : items }
+        if end < self.search_results:
+            resp['nextPageToken'] = str(end)
+        return resp
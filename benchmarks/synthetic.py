@@ -0,0 +1,198 @@
+'''
+Synthetic corpus generator for benchmarks.
+
+Generates text with a latent topic structure, so that LDA has something to find:
+a vocabulary of made-up words, a number of topics each favouring a different Zipf-ranked
+subset of the vocabulary, and documents that mix a few topics each.
+
+Everything is generated from a seed, so the same scale and seed always generate
+the same corpus, and benchmark results of different runs remain comparable.
+
+Can also be run as a script to write a corpus to disk:
+
+    python3 synthetic.py --scale 10000 --out /tmp/corpus
+
+which writes history.json (a Chrome History Export file) and targets.jsonl
+(target entries, one JSON document per line).
+'''
+from __future__ import print_function
+import argparse
+import datetime
+import json
+import os
+import os.path
+import random
+
+CONSONANTS = 'bcdfghjklmnprstvwz'
+VOWELS = 'aeiou'
+
+DEFAULT_VOCAB_SIZE = 20000
+DEFAULT_NUM_TOPICS = 20
+
+# Fractions of history entries that are HackerNews items and YouTube videos.
+# The rest are URLs that no handler accepts.
+HN_FRACTION = 0.5
+YOUTUBE_FRACTION = 0.3
+
+
+class SyntheticCorpus(object):
+    '''
+    seed: seed of all random choices.
+    vocab_size: number of distinct words.
+    num_topics: number of latent topics.
+    '''
+
+    def __init__(self, seed=1, vocab_size=DEFAULT_VOCAB_SIZE, num_topics=DEFAULT_NUM_TOPICS):
+        self.seed = seed
+        rng = random.Random(seed)
+
+        words = set()
+        while len(words) < vocab_size:
+            syllables = rng.randint(2, 4)
+            words.add(''.join(rng.choice(CONSONANTS) + rng.choice(VOWELS) for i in range(syllables)))
+        self.vocabulary = sorted(words)
+
+        # Each topic ranks the whole vocabulary differently, and picks words by
+        # Zipf-like weights on that ranking.
+        zipf_weights = [ 1.0 / (rank + 1) for rank in range(vocab_size) ]
+        self.topic_words = []
+        for t in range(num_topics):
+            ranking = list(self.vocabulary)
+            rng.shuffle(ranking)
+            self.topic_words.append(ranking)
+        self.cum_weights = []
+        total = 0.0
+        for w in zipf_weights:
+            total += w
+            self.cum_weights.append(total)
+
+
+    def text(self, rng, num_words, topics_per_doc=3):
+        '''
+        Returns a document of num_words words drawn from a few random topics.
+        '''
+        topics = [ self.topic_words[rng.randrange(len(self.topic_words))] for i in range(topics_per_doc) ]
+
+        # Word order doesn't matter to LDA, so words of each topic are drawn together.
+        words = []
+        for t, topic in enumerate(topics):
+            count = num_words // topics_per_doc + (1 if t < num_words % topics_per_doc else 0)
+            words.extend(rng.choices(topic, cum_weights=self.cum_weights, k=count))
+        return ' '.join(words)
+
+
+    def title(self, rng):
+        return self.text(rng, rng.randint(4, 10), topics_per_doc=1).capitalize()
+
+
+    def history(self, num_entries, start_id=1):
+        '''
+        Yields entries of a Chrome History Export file.
+
+        HackerNews items have ids starting from start_id, and YouTube videos have
+        ids derived from the entry number, so that both are unique within a corpus.
+        '''
+        rng = random.Random(self.seed * 7919 + 1)
+        now = datetime.datetime(2017, 6, 28)
+
+        for i in range(num_entries):
+            r = rng.random()
+            if r < HN_FRACTION:
+                url = 'https://news.ycombinator.com/item?id=%d' % (start_id + i)
+            elif r < HN_FRACTION + YOUTUBE_FRACTION:
+                url = 'https://www.youtube.com/watch?v=%s' % (video_id(i))
+            else:
+                url = 'https://example.com/%s/%d' % (rng.choice(self.vocabulary), i)
+
+            visit_time = now - datetime.timedelta(seconds=i * 37)
+            yield {
+                'id' : str(i + 1),
+                'lastVisitTime' : visit_time.strftime('%d/%m/%Y, %H:%M:%S'),
+                'lastVisitTimeTimestamp' : (visit_time - datetime.datetime(1970, 1, 1)).total_seconds() * 1000.0,
+                'title' : self.title(rng),
+                'typedCount' : 0,
+                'url' : url,
+                'visitCount' : rng.randint(1, 5)
+            }
+
+
+    def targets(self, num_entries, name='synthetic', words_per_doc=120):
+        '''
+        Yields target entries, like those a target handler stores.
+        '''
+        rng = random.Random(self.seed * 7919 + 2)
+        for i in range(num_entries):
+            title = self.title(rng)
+            yield {
+                'id' : '%s-%d' % (name, i),
+                'url' : 'https://example.org/%s/%d' % (name, i),
+                'title' : title,
+                'details' : '',
+                'contents' : title + ' ' + self.text(rng, words_per_doc)
+            }
+
+
+    def hn_comments(self, item_id, num_comments=20, words_per_comment=40):
+        '''
+        Returns the comments of a HackerNews item. Same item id always gets the same comments.
+        '''
+        rng = random.Random(self.seed * 7919 + 3 + int(item_id) * 31)
+        return [ self.text(rng, rng.randint(words_per_comment // 2, words_per_comment * 2))
+                    for i in range(num_comments) ]
+
+
+    def video_snippet(self, vid, words=60):
+        '''
+        Returns a YouTube API video snippet. Same video id always gets the same snippet.
+        '''
+        rng = random.Random('%d-%s' % (self.seed, vid))
+        return {
+            'title' : self.title(rng),
+            'description' : self.text(rng, words),
+            'tags' : [ rng.choice(self.vocabulary) for i in range(5) ],
+            'publishedAt' : '2017-06-28T00:00:00.000Z'
+        }
+
+
+    def feed_items(self, name, num_items, words=60):
+        '''
+        Returns the items of an RSS feed as (guid, title, link, description) tuples.
+        '''
+        rng = random.Random('%d-%s' % (self.seed, name))
+        return [ ('%s-%d' % (name, i), self.title(rng), 'https://example.net/%s/%d' % (name, i), self.text(rng, words))
+                    for i in range(num_items) ]
+
+
+
+def video_id(i):
+    # YouTube video ids are 11 characters long.
+    return ('v%010d' % (i))[-11:]
+
+
+def write_history(filename, entries):
+    '''
+    Writes history entries as a JSON array, one entry at a time.
+    '''
+    with open(filename, 'w') as f:
+        f.write('[\n')
+        for i, entry in enumerate(entries):
+            if i > 0:
+                f.write(',\n')
+            json.dump(entry, f)
+        f.write('\n]\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic corpus')
+    parser.add_argument('--scale', type=int, default=1000, help='Number of history entries and target entries')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', required=True, help='Output directory')
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    corpus = SyntheticCorpus(args.seed)
+
+    write_history(os.path.join(args.out, 'history.json'), corpus.history(args.scale))
+    with open(os.path.join(args.out, 'targets.jsonl'), 'w') as f:
+        for entry in corpus.targets(args.scale):
+            f.write(json.dumps(entry) + '\n')
@@ -43,7 +43,7 @@ install_master_node_prerequisites() {
     apt-get -y install openjdk-8-jre-headless dstat python3 python3-pip git
     
     # Create Python environment for recommender app.
-    pip3 install google-api-python-client beautifulsoup4 feedparser PyYAML requests
+    pip3 install google-api-python-client beautifulsoup4 lxml feedparser PyYAML requests numpy scipy
     
     apt-get -y install sbt
 }
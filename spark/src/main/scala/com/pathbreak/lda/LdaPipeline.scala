@@ -0,0 +1,520 @@
+package com.pathbreak.lda
+
+import java.security.MessageDigest
+
+import scala.collection.mutable.WrappedArray
+
+import org.apache.hadoop.fs.{FileSystem, Path}
+import org.apache.spark.ml.{Pipeline, PipelineModel, PipelineStage}
+import org.apache.spark.ml.feature.{CountVectorizer, CountVectorizerModel, HashingTF, Tokenizer, StopWordsRemover}
+import org.apache.spark.mllib.feature.{HashingTF => MLlibHashingTF}
+import org.apache.spark.ml.linalg.Vector
+import org.apache.spark.ml.clustering.{LDA, LDAModel}
+import org.apache.spark.sql.{DataFrame, SparkSession}
+import org.apache.spark.sql.functions.{coalesce, col, lit, udf}
+import org.apache.spark.sql.types.{ArrayType, LongType, StringType}
+
+/**
+ * Everything fitted on history documents that's needed to recommend targets.
+ *
+ * trainSetTopics: the history documents with their topic distributions in the "topics" column.
+ *
+ * hashedTerms: with feature hashing, which has no vocabulary, labels of the top features
+ *      of every topic, made of the history terms that hash to them (see hashedTermLabels).
+ *
+ * vocabularyStats: size and sparsity of the history term counts, if the model was fitted
+ *      rather than loaded.
+ */
+case class FittedModel(
+    pipelineModel: PipelineModel,
+    ldaModel: LDAModel,
+    trainSetTopics: DataFrame,
+    hashedTerms: Map[Int, String] = Map(),
+    vocabularyStats: Option[VocabularyStats] = None) {
+
+    // None with feature hashing.
+    lazy val vocabulary: Option[Array[String]] = pipelineModel.stages.last match {
+        case m: CountVectorizerModel => Some(m.vocabulary)
+        case _ => None
+    }
+
+    def termLabel(index: Int): String = vocabulary match {
+        case Some(v) => v(index)
+        case None => hashedTerms.getOrElse(index, s"#$index")
+    }
+
+    // (topic, top terms with their weights) of every topic
+    lazy val topics: Array[(Int, Seq[(String, Double)])] = LdaPipeline.describeTopics(ldaModel, termLabel)
+
+    lazy val topicsText: String = LdaPipeline.formatTopics(topics)
+}
+
+
+/**
+ * Controls of the term counts stage, given as options of the Lda job and LdaServer:
+ *
+ *      --vocab-size N      Keep only the N terms most frequent across history. Default: 262144
+ *      --min-df X          Keep only terms in at least X history documents, or at least
+ *                          that fraction of them if X is below 1. Default: 1
+ *      --min-tf X          Count a term in a document only if it occurs at least X times,
+ *                          or at least that fraction of its terms if X is below 1. Default: 1
+ *      --max-df X          Leave out terms in more than X history documents, or more than
+ *                          that fraction of them if X is below 1. Default: no limit
+ *      --hashing-features N
+ *                          Hash terms into N features with HashingTF, instead of fitting a
+ *                          vocabulary. The other options then don't apply.
+ *
+ * LDA keeps a vector of topic weights for every term, so the vocabulary size bounds the
+ * memory and time of every iteration.
+ */
+case class VocabularyOptions(
+    vocabSize: Int = 1 << 18,
+    minDF: Double = 1.0,
+    minTF: Double = 1.0,
+    maxDF: Option[Double] = None,
+    hashingFeatures: Option[Int] = None) {
+
+    def fingerprint: String =
+        s"vocabSize=$vocabSize,minDF=$minDF,minTF=$minTF,maxDF=${maxDF.getOrElse("")},hashing=${hashingFeatures.getOrElse("")}"
+}
+
+object VocabularyOptions {
+    def fromOptions(options: Map[String, String]): VocabularyOptions = {
+        val defaults = VocabularyOptions()
+        VocabularyOptions(
+            options.get("vocab-size").map(_.toInt).getOrElse(defaults.vocabSize),
+            options.get("min-df").map(_.toDouble).getOrElse(defaults.minDF),
+            options.get("min-tf").map(_.toDouble).getOrElse(defaults.minTF),
+            options.get("max-df").map(_.toDouble),
+            options.get("hashing-features").map(_.toInt))
+    }
+}
+
+
+/**
+ * Size and sparsity of the term count vectors of history documents.
+ *
+ * features: vocabulary size, or number of hashed features.
+ * nonzeros: number of distinct terms of all documents, summed. EM LDA has an edge per nonzero.
+ */
+case class VocabularyStats(features: Int, documents: Long, nonzeros: Long, numTopics: Int, hashing: Boolean) {
+
+    def density: Double = if (documents == 0 || features == 0) 0.0 else nonzeros.toDouble / (documents * features.toDouble)
+
+    def termsPerDocument: Double = if (documents == 0) 0.0 else nonzeros.toDouble / documents
+
+    // Topic weights of every term, as doubles.
+    def topicMatrixBytes: Long = features.toLong * numTopics * 8
+
+    def text: String =
+        f"Vocabulary: $features%d ${if (hashing) "hashed features" else "terms"}, $documents%d documents, " +
+        f"$termsPerDocument%.1f terms per document, density ${density * 100}%.4f%%, " +
+        f"topic matrix ${topicMatrixBytes / 1e6}%.1f MB"
+}
+
+
+/**
+ * A target document recommended because its topic distribution is near that of a history document.
+ */
+case class Recommendation(
+    targetTitle: String,
+    targetUrl: String,
+    targetTopics: Vector,
+    historyTitle: String,
+    historyUrl: String,
+    historyTopics: Vector,
+    distance: Double)
+
+
+/**
+ * The stages of the LDA recommendation job, shared by the one-shot job (Lda) and
+ * the long-running server (LdaServer).
+ */
+object LdaPipeline {
+
+    // The only columns of a stored history or target entry the job needs.
+    // Entries stored by different handlers have different fields, so documents are always
+    // narrowed down to these columns, which also lets them be union-ed together.
+    val DocumentColumns = Seq("id", "title", "url", "contents")
+
+    // Term counts stored with entries by the recommender app when VOCABULARY_FILE is configured:
+    // ids of terms in the shared vocabulary file, and the number of times each occurs.
+    val TermColumns = Seq("term_ids", "term_counts")
+
+    // Id of the target that an entry is a near-duplicate of, set by the recommender app's near_dup.py.
+    val NearDuplicateColumn = "near_duplicate_of"
+
+    val NumRecommendations = 20
+    val TermsPerTopic = 10
+
+    def readDocuments(spark: SparkSession, path: String, fileFormat: String = "json", withTermCounts: Boolean = false): DataFrame = {
+        import spark.implicits._
+
+        val raw =
+            if (fileFormat == "json")
+                spark.read.json(path)
+            else
+                spark.sparkContext.wholeTextFiles(path).toDF("id", "contents")
+
+        // Targets stored as near-duplicates of another target (NEAR_DUP in conf.yml) are left out,
+        // so that only one of each cluster of near-duplicates can be recommended.
+        val representatives =
+            if (raw.columns.contains(NearDuplicateColumn)) raw.filter(col(NearDuplicateColumn).isNull)
+            else raw
+
+        selectDocumentColumns(representatives, withTermCounts)
+    }
+
+    def selectDocumentColumns(df: DataFrame, withTermCounts: Boolean = false): DataFrame = {
+        val columns = DocumentColumns.map { c =>
+            val column = if (df.columns.contains(c)) col(c).cast(StringType) else lit(null).cast(StringType)
+            if (c == "contents") coalesce(column, lit("")).as(c) else column.as(c)
+        }
+        val termColumns = if (!withTermCounts) Seq() else TermColumns.map { c =>
+            val column = if (df.columns.contains(c)) col(c) else lit(null)
+            column.cast(ArrayType(LongType)).as(c)
+        }
+        df.select(columns ++ termColumns: _*)
+    }
+
+    /**
+     * Adds the "tokens" column that the Tokenizer and StopWordsRemover stages would produce,
+     * from term counts stored with documents. Stored term counts already had stop words
+     * removed when they were stored.
+     *
+     * Documents stored without term counts are tokenized as usual.
+     *
+     * vocabulary: all terms of the shared vocabulary file, indexed by term id.
+     */
+    def withStoredTokens(docs: DataFrame, vocabulary: Array[String], customStops: Array[String]): DataFrame = {
+        val sc = docs.sparkSession.sparkContext
+        val vocabularyBc = sc.broadcast(vocabulary)
+        val stopWordsBc = sc.broadcast(
+            (StopWordsRemover.loadDefaultStopWords("english") ++ customStops ++ Array(" ", "")).map(_.toLowerCase).toSet)
+
+        val tokens = udf { (contents: String, termIds: Seq[Long], termCounts: Seq[Long]) =>
+            if (termIds != null && termCounts != null) {
+                val vocabulary = vocabularyBc.value
+                // Ids of terms added to the vocabulary after it was read are skipped.
+                termIds.zip(termCounts).filter(_._1 < vocabulary.length).flatMap { case (id, count) =>
+                    Seq.fill(count.toInt)(vocabulary(id.toInt))
+                }
+            } else {
+                // Same as Tokenizer followed by StopWordsRemover, and text_pipeline.terms.
+                contents.toLowerCase.split("\\s").filter(t => t.nonEmpty && !stopWordsBc.value.contains(t)).toSeq
+            }
+        }
+
+        docs.withColumn("tokens", tokens(col("contents"), col("term_ids"), col("term_counts")))
+    }
+
+    def readVocabulary(spark: SparkSession, vocabularyFile: String): Array[String] = {
+        spark.sparkContext.textFile(vocabularyFile).collect()
+    }
+
+    def readCustomStops(spark: SparkSession, customStopsFile: String): Array[String] = {
+        if (customStopsFile != null)
+            spark.sparkContext.textFile(customStopsFile).collect()
+        else
+            Array[String]()
+    }
+
+    /**
+     * withStoredTokens: if true, documents already have the "tokens" column
+     * (see withStoredTokens), and only the term counts vectorizer stage is needed.
+     *
+     * frequentTerms: terms in more than vocab.maxDF history documents (see frequentTerms),
+     * which are removed along with stop words.
+     */
+    def textPipeline(customStops: Array[String], withStoredTokens: Boolean = false,
+            vocab: VocabularyOptions = VocabularyOptions(), frequentTerms: Array[String] = Array()): Pipeline = {
+        // Tokenizer
+        val tokenizer = new Tokenizer().setInputCol("contents").setOutputCol("rawTokens")
+
+        // Stop words remover
+        val stopsRemover = new StopWordsRemover().setInputCol("rawTokens").setOutputCol("tokens")
+        stopsRemover.setStopWords(stopsRemover.getStopWords  union  customStops union frequentTerms union Array(" ", ""))
+
+        // Stored tokens already had stop words removed, but not frequent terms.
+        val frequentTermsRemover = new StopWordsRemover().setInputCol("tokens").setOutputCol("keptTokens")
+            .setStopWords(frequentTerms)
+
+        val tokenStages: Array[PipelineStage] =
+            if (!withStoredTokens) Array(tokenizer, stopsRemover)
+            else if (frequentTerms.nonEmpty) Array(frequentTermsRemover)
+            else Array()
+        val tokensColumn = if (withStoredTokens && frequentTerms.nonEmpty) "keptTokens" else "tokens"
+
+        // Term counts vectorizer
+        val vectorizer: PipelineStage = vocab.hashingFeatures match {
+            case Some(numFeatures) =>
+                new HashingTF().setInputCol(tokensColumn).setOutputCol("counts").setNumFeatures(numFeatures)
+            case None =>
+                new CountVectorizer().setInputCol(tokensColumn).setOutputCol("counts")
+                    .setVocabSize(vocab.vocabSize).setMinDF(vocab.minDF).setMinTF(vocab.minTF)
+        }
+
+        new Pipeline().setStages(tokenStages :+ vectorizer)
+    }
+
+    /**
+     * Returns the terms in more than maxDF documents, or more than that fraction of them
+     * if maxDF is below 1. CountVectorizer itself has no maxDF until Spark 2.4.
+     *
+     * tokenized: documents with the "tokens" column.
+     */
+    def frequentTerms(tokenized: DataFrame, maxDF: Double): Array[String] = {
+        val numDocs = tokenized.count()
+        val maxDocs = if (maxDF >= 1.0) maxDF else maxDF * numDocs
+
+        tokenized.select("tokens").rdd
+            .flatMap(r => Option(r.getSeq[String](0)).getOrElse(Seq()).distinct)
+            .map((_, 1L))
+            .reduceByKey(_ + _)
+            .filter(_._2 > maxDocs)
+            .keys
+            .collect()
+    }
+
+    /**
+     * Splits command line arguments into positional arguments and "--name value" options.
+     */
+    def parseArgs(args: Array[String]): (Array[String], Map[String, String]) = {
+        val positional = scala.collection.mutable.ArrayBuffer[String]()
+        val options = scala.collection.mutable.Map[String, String]()
+        var i = 0
+        while (i < args.length) {
+            if (args(i).startsWith("--")) {
+                if (i + 1 >= args.length)
+                    throw new IllegalArgumentException(s"Missing value for option ${args(i)}")
+                options(args(i).stripPrefix("--")) = args(i + 1)
+                i += 2
+            } else {
+                positional += args(i)
+                i += 1
+            }
+        }
+        (positional.toArray, options.toMap)
+    }
+
+    /**
+     * Fits the text pipeline and LDA models on history documents.
+     */
+    def fit(rawTrain: DataFrame, customStops: Array[String], numTopics: Int, iterations: Int, algo: String,
+            withStoredTokens: Boolean = false, vocab: VocabularyOptions = VocabularyOptions()): FittedModel = {
+        val frequent = vocab.maxDF match {
+            case Some(maxDF) if vocab.hashingFeatures.isEmpty =>
+                // Only the tokenizing stages, which don't need fitting.
+                val tokenized =
+                    if (withStoredTokens) rawTrain
+                    else new Pipeline().setStages(textPipeline(customStops).getStages.dropRight(1)).fit(rawTrain).transform(rawTrain)
+                frequentTerms(tokenized, maxDF)
+            case _ => Array[String]()
+        }
+
+        // Get term count matrix
+        val pipelineModel = textPipeline(customStops, withStoredTokens, vocab, frequent).fit(rawTrain)
+
+        /* Term counts RDD for use with o.a.s.mll.clustering:*/
+        val termCounts = pipelineModel.transform(rawTrain)
+        termCounts.cache()
+
+        val stats = vocabularyStats(pipelineModel, termCounts, numTopics)
+
+        // Run LDA.
+        val ldaModel = fitLda(termCounts, numTopics, iterations, algo)
+        val trainSetTopics = ldaModel.transform(termCounts)
+        trainSetTopics.cache()
+
+        val hashedTerms = pipelineModel.stages.last match {
+            case hashingTF: HashingTF => hashedTermLabels(termCounts, hashingTF, topicTermIndices(ldaModel))
+            case _ => Map[Int, String]()
+        }
+
+        FittedModel(pipelineModel, ldaModel, trainSetTopics, hashedTerms, Some(stats))
+    }
+
+    def vocabularyStats(pipelineModel: PipelineModel, termCounts: DataFrame, numTopics: Int): VocabularyStats = {
+        val (features, hashing) = pipelineModel.stages.last match {
+            case m: CountVectorizerModel => (m.vocabulary.length, false)
+            case h: HashingTF => (h.getNumFeatures, true)
+        }
+
+        val (documents, nonzeros) = termCounts.select("counts").rdd
+            .map(r => (1L, r.getAs[Vector](0).numNonzeros.toLong))
+            .fold((0L, 0L)) { case ((d1, n1), (d2, n2)) => (d1 + d2, n1 + n2) }
+
+        VocabularyStats(features, documents, nonzeros, numTopics, hashing)
+    }
+
+    def topicTermIndices(ldaModel: LDAModel): Set[Int] = {
+        ldaModel.describeTopics(maxTermsPerTopic = TermsPerTopic).collect
+            .flatMap(_.getAs[WrappedArray[Int]]("termIndices")).toSet
+    }
+
+    /**
+     * HashingTF has no vocabulary to describe topics with. Instead, each of the given
+     * feature indices is labelled with the most frequent history terms that hash to it,
+     * like "apple" or, if two terms collide, "apple|orange".
+     */
+    def hashedTermLabels(termCounts: DataFrame, hashingTF: HashingTF, indices: Set[Int]): Map[Int, String] = {
+        // HashingTF hashes terms with the RDD-based HashingTF underneath.
+        val hashing = new MLlibHashingTF(hashingTF.getNumFeatures)
+        val indicesBc = termCounts.sparkSession.sparkContext.broadcast(indices)
+
+        val labels = termCounts.select(hashingTF.getInputCol).rdd
+            .flatMap(r => Option(r.getSeq[String](0)).getOrElse(Seq()))
+            .map(term => ((hashing.indexOf(term), term), 1L))
+            .filter { case ((index, _), _) => indicesBc.value.contains(index) }
+            .reduceByKey(_ + _)
+            .map { case ((index, term), count) => (index, (term, count)) }
+            .groupByKey()
+            .mapValues(_.toSeq.sortBy(-_._2).take(2).map(_._1).mkString("|"))
+            .collect()
+            .toMap
+
+        indicesBc.destroy()
+        labels
+    }
+
+    def fitLda(termCounts: DataFrame, numTopics: Int, iterations: Int, algo: String): LDAModel = {
+        // Input is the "counts" column of DF passed to fit.
+        // The topic distribution for each document is output in "topics" column
+        val lda = new LDA()
+            .setOptimizer(algo)
+            .setFeaturesCol("counts")
+            .setTopicDistributionCol("topics")
+            .setK(numTopics)
+            .setMaxIter(iterations)
+
+        lda.fit(termCounts)
+    }
+
+    /**
+     * Returns the k target documents nearest to any history document, by euclidean distance
+     * between topic distributions, nearest first. Every target is recommended based on
+     * its nearest history document.
+     *
+     * This is an exact search. The topic vectors of history documents are small enough to
+     * be broadcast to every executor, where each partition of targets is compared with all
+     * of them and only its own k nearest are kept. The driver then merges those, so nothing
+     * is shuffled.
+     */
+    def similar(trainSetTopics: DataFrame, testsetTopics: DataFrame, k: Int = NumRecommendations): Array[Recommendation] = {
+        val history = trainSetTopics.select("title", "url", "topics").collect()
+        if (history.isEmpty)
+            return Array()
+
+        val numTopics = history(0).getAs[Vector](2).size
+
+        // All history topic vectors, one after another in a single array.
+        val historyMatrix = new Array[Double](history.length * numTopics)
+        history.zipWithIndex.foreach { case (r, i) =>
+            r.getAs[Vector](2).toArray.copyToArray(historyMatrix, i * numTopics)
+        }
+        val historyMatrixBc = testsetTopics.sparkSession.sparkContext.broadcast(historyMatrix)
+
+        // (distance, index of nearest history document, target title, target url, target topics)
+        val nearest = testsetTopics.select("title", "url", "topics").rdd.map { r =>
+            val matrix = historyMatrixBc.value
+            val target = r.getAs[Vector](2).toArray
+
+            var nearestIndex = 0
+            var nearestDistSq = Double.MaxValue
+            var h = 0
+            while (h < matrix.length / numTopics) {
+                val offset = h * numTopics
+                var distSq = 0.0
+                var t = 0
+                while (t < numTopics) {
+                    val d = target(t) - matrix(offset + t)
+                    distSq += d * d
+                    t += 1
+                }
+                if (distSq < nearestDistSq) {
+                    nearestDistSq = distSq
+                    nearestIndex = h
+                }
+                h += 1
+            }
+
+            (math.sqrt(nearestDistSq), nearestIndex, r.getString(0), r.getString(1), r.getAs[Vector](2))
+        }.takeOrdered(k)(Ordering.by[(Double, Int, String, String, Vector), Double](_._1))
+
+        historyMatrixBc.destroy()
+
+        nearest.map { case (distance, h, title, url, topics) =>
+            Recommendation(title, url, topics,
+                history(h).getString(0), history(h).getString(1), history(h).getAs[Vector](2), distance)
+        }
+    }
+
+    def formatRecommendations(similar: Array[Recommendation]): String = {
+        val sb = new StringBuilder()
+        similar.foreach { r =>
+            sb.append(s"\nRecommendation:\n\t${r.targetTitle}\n\t${r.targetUrl}\n\n")
+            sb.append(s"\tTopics: ${r.targetTopics}\n\n")
+            sb.append(s"  based on:\n\t${r.historyTitle}\n\t${r.historyUrl}\n\n")
+            sb.append(s"\tTopics: ${r.historyTopics}\n\n")
+        }
+        sb.toString
+    }
+
+    // The DF returned by describeTopics() contains 3 columns:
+    //  - "topic": IntegerType: topic index
+    //  - "termIndices": ArrayType(IntegerType): term indices, sorted in order of decreasing term importance
+    //  - "termWeights": ArrayType(DoubleType): corresponding sorted term weights
+    def describeTopics(ldaModel: LDAModel, termLabel: Int => String): Array[(Int, Seq[(String, Double)])] = {
+        ldaModel.describeTopics(maxTermsPerTopic = TermsPerTopic).collect.map { x =>
+            val termIndices = x.getAs[WrappedArray[Int]]("termIndices")
+            val termWeights = x.getAs[WrappedArray[Double]]("termWeights")
+            (x.getInt(0), termIndices.map(termLabel) zip termWeights)
+        }
+    }
+
+    def formatTopics(topics: Array[(Int, Seq[(String, Double)])]): String = {
+        val sb = new StringBuilder()
+        sb.append("Topics:\n")
+        topics.foreach { case (topic, terms) =>
+            sb.append(s"\n\tTopic $topic:\n")
+            terms.foreach { case (term, termWeight) =>
+                sb.append(s"\t\t$term : $termWeight\n")
+            }
+        }
+        sb.toString
+    }
+
+    /**
+     * Returns every directory under path (which may be a glob) that directly contains
+     * data files. Each such directory is a partition, like a single date directory of a store.
+     * Like Spark, hidden files and directories (starting with _ or .) are skipped.
+     */
+    def listPartitions(spark: SparkSession, path: String): Seq[Path] = {
+        val p = new Path(path)
+        val fs = p.getFileSystem(spark.sparkContext.hadoopConfiguration)
+        val roots = Option(fs.globStatus(p)).getOrElse(Array()).filter(_.isDirectory).map(_.getPath)
+        roots.toSeq.flatMap(leafDirectories(fs, _))
+    }
+
+    private def leafDirectories(fs: FileSystem, dir: Path): Seq[Path] = {
+        val children = fs.listStatus(dir).filter(s => !isHidden(s.getPath.getName))
+        val here = if (children.exists(_.isFile)) Seq(dir) else Seq()
+        here ++ children.filter(_.isDirectory).toSeq.flatMap(s => leafDirectories(fs, s.getPath))
+    }
+
+    def isHidden(name: String): Boolean = name.startsWith("_") || name.startsWith(".")
+
+    /**
+     * A fingerprint of the data files directly under a partition directory, that changes
+     * whenever any file is added, removed or modified.
+     */
+    def partitionSignature(spark: SparkSession, dir: Path): String = {
+        val fs = dir.getFileSystem(spark.sparkContext.hadoopConfiguration)
+        val files = fs.listStatus(dir).filter(s => s.isFile && !isHidden(s.getPath.getName))
+        sha1(files.map(s => s"${s.getPath.getName}:${s.getLen}:${s.getModificationTime}").sorted.mkString("\n"))
+    }
+
+    def sha1(s: String): String = {
+        MessageDigest.getInstance("SHA-1").digest(s.getBytes("UTF-8")).map("%02x".format(_)).mkString
+    }
+}
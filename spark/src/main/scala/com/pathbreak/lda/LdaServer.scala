@@ -0,0 +1,221 @@
+package com.pathbreak.lda
+
+import java.io.{PrintWriter, StringWriter}
+import java.net.{InetAddress, InetSocketAddress, URLDecoder}
+
+import scala.collection.mutable
+
+import com.sun.net.httpserver.{HttpExchange, HttpHandler, HttpServer}
+
+import org.apache.hadoop.fs.Path
+import org.apache.spark.sql.{DataFrame, SparkSession}
+
+/**
+ * A long-running recommender that keeps a warm SparkSession, the documents it has read,
+ * and the models it has fitted, between requests.
+ *
+ * Usage: LdaServer PORT [CUSTOM-STOPWORDS-FILE] [--model-dir DIR] [--vocabulary FILE] [VOCABULARY OPTIONS]
+ *
+ * Listens only on the loopback interface for requests like
+ *
+ *      GET /recommend?history=DIR&targets=DIR&topics=20&iterations=50&algo=em
+ *
+ * and responds with the same text that the Lda job prints.
+ *
+ * Every directory that directly contains data files is a partition, and each partition
+ * is read and cached separately. On each request, only partitions whose files have changed
+ * are read again. The text pipeline and LDA model are fitted again only if history
+ * partitions or LDA parameters have changed, and target topics are computed again
+ * only for changed target partitions. A repeated request with no changes at all
+ * is answered straight from the previous result.
+ *
+ * With --model-dir, fitted models are also saved to and loaded from DIR like the Lda job does,
+ * so that a restarted server doesn't have to fit them again. With --vocabulary, term counts
+ * stored with documents are used like the Lda job does, and the vocabulary file is read
+ * again whenever it grows. Vocabulary options like --vocab-size apply to every model the
+ * server fits (see VocabularyOptions).
+ *
+ * Requests are handled one at a time.
+ */
+object LdaServer {
+    def main(args: Array[String]) {
+        val (positional, options) = LdaPipeline.parseArgs(args)
+        val port = positional(0).toInt
+        val customStopsFile = if (positional.length > 1) positional(1) else null
+
+        val spark = SparkSession.builder().appName("LDA Server").getOrCreate()
+        val recommender = new CachingRecommender(spark, LdaPipeline.readCustomStops(spark, customStopsFile),
+            options.get("model-dir"), options.get("vocabulary"), VocabularyOptions.fromOptions(options))
+
+        val server = HttpServer.create(new InetSocketAddress(InetAddress.getLoopbackAddress, port), 0)
+        server.createContext("/recommend", new HttpHandler {
+            def handle(exchange: HttpExchange) {
+                try {
+                    val params = parseQuery(exchange.getRequestURI.getRawQuery)
+                    val t0 = System.nanoTime()
+                    val result = recommender.recommend(
+                        params("history"),
+                        params("targets"),
+                        params("topics").toInt,
+                        params("iterations").toInt,
+                        params.getOrElse("algo", "em"))
+                    val t1 = System.nanoTime()
+                    respond(exchange, 200, result + s"Time taken for LDA:${(t1-t0) / (1e9)} s\n")
+
+                } catch {
+                    case e: NoSuchElementException =>
+                        respond(exchange, 400, "Missing parameter: " + e.getMessage + "\n")
+                    case e: Exception =>
+                        val trace = new StringWriter()
+                        e.printStackTrace(new PrintWriter(trace))
+                        respond(exchange, 500, trace.toString)
+                }
+            }
+        })
+
+        // The default executor handles requests one at a time on a single thread.
+        server.setExecutor(null)
+        server.start()
+        println(s"LDA server listening on ${InetAddress.getLoopbackAddress.getHostAddress}:$port")
+    }
+
+    def parseQuery(query: String): Map[String, String] = {
+        if (query == null) return Map()
+
+        query.split("&").filter(_.nonEmpty).map { kv =>
+            val parts = kv.split("=", 2)
+            val value = if (parts.length > 1) URLDecoder.decode(parts(1), "UTF-8") else ""
+            URLDecoder.decode(parts(0), "UTF-8") -> value
+        }.toMap
+    }
+
+    def respond(exchange: HttpExchange, status: Int, body: String) {
+        val bytes = body.getBytes("UTF-8")
+        exchange.getResponseHeaders.set("Content-Type", "text/plain; charset=utf-8")
+        exchange.sendResponseHeaders(status, bytes.length)
+        val out = exchange.getResponseBody
+        out.write(bytes)
+        out.close()
+    }
+}
+
+
+class CachingRecommender(spark: SparkSession, customStops: Array[String],
+        modelDir: Option[String] = None, vocabularyFile: Option[String] = None,
+        vocab: VocabularyOptions = VocabularyOptions()) {
+
+    // Partition directory -> (signature, cached documents)
+    private val documents = mutable.Map[String, (String, DataFrame)]()
+
+    // Target partition directory -> (model key, signature, cached topics)
+    private val targetTopics = mutable.Map[String, (String, String, DataFrame)]()
+
+    // (vocabulary file length, vocabulary)
+    private var vocabulary: Option[(Long, Array[String])] = None
+
+    private var model: Option[(String, FittedModel)] = None
+    private var lastResult: Option[(String, String)] = None
+
+    def recommend(historyPath: String, targetPath: String, numTopics: Int, iterations: Int, algo: String): String = synchronized {
+        val history = loadPartitions(historyPath)
+        val modelKey = LdaPipeline.sha1(
+            (history.map { case (dir, sig, _) => s"$dir=$sig" } :+ s"$numTopics/$iterations/$algo").mkString("\n"))
+
+        val fitted = model match {
+            case Some((key, m)) if key == modelKey => m
+            case _ =>
+                model.foreach { case (_, m) => m.trainSetTopics.unpersist() }
+                val m = fit(history, numTopics, iterations, algo)
+                model = Some((modelKey, m))
+                m
+        }
+
+        val targets = loadPartitions(targetPath)
+        val requestKey = LdaPipeline.sha1(
+            (modelKey +: targets.map { case (dir, sig, _) => s"$dir=$sig" }).mkString("\n"))
+
+        lastResult match {
+            case Some((key, text)) if key == requestKey => return text
+            case _ =>
+        }
+
+        val testsetTopics = targets.map { case (dir, sig, docs) =>
+            targetTopics.get(dir) match {
+                case Some((key, s, topics)) if key == modelKey && s == sig => topics
+                case previous =>
+                    previous.foreach(_._3.unpersist())
+                    val topics = fitted.ldaModel.transform(fitted.pipelineModel.transform(docs)).cache()
+                    targetTopics(dir) = (modelKey, sig, topics)
+                    topics
+            }
+        }.reduce(_ union _)
+
+        val similar = LdaPipeline.similar(fitted.trainSetTopics, testsetTopics)
+
+        val text = "\n\nRecommendations:\n\n" + LdaPipeline.formatRecommendations(similar) + fitted.topicsText +
+            fitted.vocabularyStats.map("\n" + _.text + "\n").getOrElse("")
+        lastResult = Some((requestKey, text))
+        text
+    }
+
+    private def fit(history: Seq[(String, String, DataFrame)], numTopics: Int, iterations: Int, algo: String): FittedModel = {
+        def fitNew(): FittedModel =
+            LdaPipeline.fit(history.map(_._3).reduce(_ union _), customStops, numTopics, iterations, algo,
+                vocabularyFile.isDefined, vocab)
+
+        modelDir match {
+            case Some(dir) =>
+                val fingerprint = ModelStore.fingerprint(
+                    history.map { case (d, sig, _) => (d, sig) }, customStops, numTopics, iterations, algo, "json",
+                    vocabularyFile.isDefined, vocab)
+                ModelStore.loadOrFit(spark, dir, fingerprint)(fitNew())
+
+            case None => fitNew()
+        }
+    }
+
+    /**
+     * Returns (directory, signature, documents) of every partition under path,
+     * reading only those partitions that are new or have changed since they were last read.
+     */
+    private def loadPartitions(path: String): Seq[(String, String, DataFrame)] = {
+        val partitions = LdaPipeline.listPartitions(spark, path)
+        if (partitions.isEmpty)
+            throw new IllegalArgumentException(s"No documents found in $path")
+
+        partitions.map { p =>
+            val dir = p.toString
+            val sig = LdaPipeline.partitionSignature(spark, p)
+            documents.get(dir) match {
+                case Some((s, docs)) if s == sig => (dir, sig, docs)
+                case previous =>
+                    previous.foreach(_._2.unpersist())
+                    val docs = readDocuments(dir).cache()
+                    documents(dir) = (sig, docs)
+                    (dir, sig, docs)
+            }
+        }
+    }
+
+    private def readDocuments(dir: String): DataFrame = vocabularyFile match {
+        case Some(file) =>
+            LdaPipeline.withStoredTokens(LdaPipeline.readDocuments(spark, dir, "json", true), currentVocabulary(file), customStops)
+        case None =>
+            LdaPipeline.readDocuments(spark, dir)
+    }
+
+    /**
+     * The vocabulary is only ever appended to, so it's read again only if it has grown.
+     */
+    private def currentVocabulary(file: String): Array[String] = {
+        val path = new Path(file)
+        val length = path.getFileSystem(spark.sparkContext.hadoopConfiguration).getFileStatus(path).getLen
+        vocabulary match {
+            case Some((l, terms)) if l == length => terms
+            case _ =>
+                val terms = LdaPipeline.readVocabulary(spark, file)
+                vocabulary = Some((length, terms))
+                terms
+        }
+    }
+}
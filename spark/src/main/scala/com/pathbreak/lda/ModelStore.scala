@@ -0,0 +1,128 @@
+package com.pathbreak.lda
+
+import org.apache.hadoop.fs.{FileSystem, Path}
+import org.apache.spark.ml.PipelineModel
+import org.apache.spark.ml.clustering.{DistributedLDAModel, LocalLDAModel}
+import org.apache.spark.sql.SparkSession
+
+/**
+ * Saves fitted models under a model directory and loads them back, so that models are
+ * fitted again only when history documents or LDA parameters change.
+ *
+ * Every model is saved under MODEL-DIR/v<FormatVersion>/<fingerprint>/ where the
+ * fingerprint covers the files of every history partition and all parameters that
+ * affect fitting:
+ *
+ *      pipeline/       the fitted Tokenizer, StopWordsRemover and CountVectorizer or HashingTF
+ *      lda/            the LDA model, as a LocalLDAModel
+ *      train-topics/   history documents with their topic distributions
+ *      hashed-terms/   labels of hashed features, with --hashing-features only
+ *      _COMPLETE       written last. Models without it are partially saved and ignored.
+ *
+ * Only the last KeepModels saved models are kept.
+ */
+object ModelStore {
+
+    // Changed whenever the layout of a saved model changes, so that models saved
+    // by an older version are not loaded.
+    val FormatVersion = 2
+
+    val CompleteMarker = "_COMPLETE"
+
+    val KeepModels = 3
+
+    /**
+     * history: (directory, signature) of every history partition.
+     */
+    def fingerprint(history: Seq[(String, String)], customStops: Array[String],
+            numTopics: Int, iterations: Int, algo: String, fileFormat: String, withStoredTokens: Boolean,
+            vocab: VocabularyOptions = VocabularyOptions()): String = {
+
+        val params = Seq(
+            s"topics=$numTopics",
+            s"iterations=$iterations",
+            s"algo=$algo",
+            s"format=$fileFormat",
+            s"storedTokens=$withStoredTokens",
+            s"stops=${LdaPipeline.sha1(customStops.mkString("\n"))}") ++
+            // Only if not the defaults, so that models saved before vocabulary options existed are still used.
+            (if (vocab != VocabularyOptions()) Seq(s"vocab=${vocab.fingerprint}") else Seq())
+
+        LdaPipeline.sha1((params ++ history.map { case (dir, sig) => s"$dir=$sig" }).mkString("\n"))
+    }
+
+    def historyPartitions(spark: SparkSession, historyPath: String): Seq[(String, String)] = {
+        LdaPipeline.listPartitions(spark, historyPath).map { p =>
+            (p.toString, LdaPipeline.partitionSignature(spark, p))
+        }
+    }
+
+    def load(spark: SparkSession, modelDir: String, fingerprint: String): Option[FittedModel] = {
+        val dir = modelPath(modelDir, fingerprint)
+        val fs = dir.getFileSystem(spark.sparkContext.hadoopConfiguration)
+        if (!fs.exists(new Path(dir, CompleteMarker)))
+            return None
+
+        val pipelineModel = PipelineModel.load(new Path(dir, "pipeline").toString)
+        val ldaModel = LocalLDAModel.load(new Path(dir, "lda").toString)
+        val trainSetTopics = spark.read.parquet(new Path(dir, "train-topics").toString)
+        trainSetTopics.cache()
+
+        val hashedTermsPath = new Path(dir, "hashed-terms")
+        val hashedTerms =
+            if (!fs.exists(hashedTermsPath)) Map[Int, String]()
+            else spark.read.parquet(hashedTermsPath.toString).collect().map(r => (r.getInt(0), r.getString(1))).toMap
+
+        Some(FittedModel(pipelineModel, ldaModel, trainSetTopics, hashedTerms))
+    }
+
+    def save(spark: SparkSession, modelDir: String, fingerprint: String, model: FittedModel) {
+        val dir = modelPath(modelDir, fingerprint)
+        val fs = dir.getFileSystem(spark.sparkContext.hadoopConfiguration)
+
+        // A DistributedLDAModel also saves its whole training graph,
+        // which isn't needed to transform target documents.
+        val ldaModel = model.ldaModel match {
+            case m: DistributedLDAModel => m.toLocal
+            case m: LocalLDAModel => m
+        }
+
+        model.pipelineModel.write.overwrite().save(new Path(dir, "pipeline").toString)
+        ldaModel.write.overwrite().save(new Path(dir, "lda").toString)
+        model.trainSetTopics.select("id", "title", "url", "topics")
+            .write.mode("overwrite").parquet(new Path(dir, "train-topics").toString)
+        if (model.hashedTerms.nonEmpty) {
+            spark.createDataFrame(model.hashedTerms.toSeq).toDF("index", "terms")
+                .write.mode("overwrite").parquet(new Path(dir, "hashed-terms").toString)
+        }
+
+        fs.create(new Path(dir, CompleteMarker)).close()
+
+        prune(fs, dir.getParent)
+    }
+
+    /**
+     * Returns the saved model with this fingerprint if there's one, or else fits and saves a new one.
+     */
+    def loadOrFit(spark: SparkSession, modelDir: String, fingerprint: String)(fit: => FittedModel): FittedModel = {
+        load(spark, modelDir, fingerprint) match {
+            case Some(model) =>
+                println(s"Using saved model ${modelPath(modelDir, fingerprint)}")
+                model
+
+            case None =>
+                val model = fit
+                save(spark, modelDir, fingerprint, model)
+                model
+        }
+    }
+
+    def modelPath(modelDir: String, fingerprint: String): Path = {
+        new Path(new Path(modelDir, s"v$FormatVersion"), fingerprint)
+    }
+
+    private def prune(fs: FileSystem, versionDir: Path) {
+        val models = fs.listStatus(versionDir).filter(_.isDirectory).sortBy(-_.getModificationTime)
+        models.drop(KeepModels).foreach(s => fs.delete(s.getPath, true))
+    }
+}
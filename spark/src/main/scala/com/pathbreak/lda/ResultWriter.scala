@@ -0,0 +1,89 @@
+package com.pathbreak.lda
+
+import java.io.{FileOutputStream, OutputStreamWriter, PrintWriter}
+
+import org.json4s.JsonAST.JValue
+import org.json4s.JsonDSL._
+import org.json4s.jackson.JsonMethods.{compact, render}
+
+/**
+ * Writes results of the Lda job to a file as JSON lines, one record per line,
+ * each flushed as soon as it's written so that a reader can follow the file:
+ *
+ *      {"type": "stage", "name": "fit", "seconds": 12.5}
+ *      {"type": "vocabulary", "features": 5000, "hashing": false, "documents": 1200,
+ *          "nonzeros": 90000, "density": 0.015, "terms_per_document": 75.0, "topic_matrix_bytes": 800000}
+ *      {"type": "recommendation", "rank": 1, "distance": 0.01,
+ *          "target": {"title": ..., "url": ..., "topics": [...]},
+ *          "history": {"title": ..., "url": ..., "topics": [...]}}
+ *      {"type": "topic", "topic": 0, "terms": [["term", 0.05], ...]}
+ *      {"type": "done", "seconds": 30.1}
+ *
+ * The "done" record is always the last one.
+ */
+class ResultWriter(path: String) {
+
+    private val out = new PrintWriter(new OutputStreamWriter(new FileOutputStream(path), "UTF-8"))
+
+    def write(record: JValue) {
+        out.println(compact(render(record)))
+        out.flush()
+    }
+
+    def stage(name: String, seconds: Double) {
+        write(("type" -> "stage") ~ ("name" -> name) ~ ("seconds" -> seconds))
+    }
+
+    def vocabulary(stats: VocabularyStats) {
+        write(
+            ("type" -> "vocabulary") ~
+            ("features" -> stats.features) ~
+            ("hashing" -> stats.hashing) ~
+            ("documents" -> stats.documents) ~
+            ("nonzeros" -> stats.nonzeros) ~
+            ("density" -> stats.density) ~
+            ("terms_per_document" -> stats.termsPerDocument) ~
+            ("topic_matrix_bytes" -> stats.topicMatrixBytes))
+    }
+
+    def recommendations(similar: Array[Recommendation]) {
+        similar.zipWithIndex.foreach { case (r, i) =>
+            write(
+                ("type" -> "recommendation") ~
+                ("rank" -> (i + 1)) ~
+                ("distance" -> r.distance) ~
+                ("target" ->
+                    ("title" -> r.targetTitle) ~ ("url" -> r.targetUrl) ~ ("topics" -> r.targetTopics.toArray.toList)) ~
+                ("history" ->
+                    ("title" -> r.historyTitle) ~ ("url" -> r.historyUrl) ~ ("topics" -> r.historyTopics.toArray.toList)))
+        }
+    }
+
+    def topics(topics: Array[(Int, Seq[(String, Double)])]) {
+        topics.foreach { case (topic, terms) =>
+            write(("type" -> "topic") ~ ("topic" -> topic) ~
+                ("terms" -> terms.map { case (term, weight) => List[JValue](term, weight) }.toList))
+        }
+    }
+
+    def done(seconds: Double) {
+        write(("type" -> "done") ~ ("seconds" -> seconds))
+    }
+
+    def close() {
+        out.close()
+    }
+}
+
+
+/**
+ * Times stages of a job and reports them to an optional ResultWriter.
+ */
+class StageTimer(writer: Option[ResultWriter]) {
+    def apply[T](name: String)(body: => T): T = {
+        val t0 = System.nanoTime()
+        val result = body
+        writer.foreach(_.stage(name, (System.nanoTime() - t0) / 1e9))
+        result
+    }
+}
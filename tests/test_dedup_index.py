@@ -0,0 +1,37 @@
+import os
+
+from dedup_index import DedupIndex
+from storage_backends import FileStorageBackend
+
+
+def entry(i, contents=None):
+    return { 'id': str(i), 'url': 'http://a/%d' % (i), 'contents': 'entry %d' % (i) if contents is None else contents }
+
+
+def test_seen_by_url_or_contents_across_partitions(tmp_path):
+    index = DedupIndex(str(tmp_path))
+    index.add('2017-01-01', [ entry(1), entry(2, '') ])
+    index.add('2017-01-02', [ entry(3) ])
+
+    assert index.seen(entry(1, 'changed'))
+    assert index.seen({ 'id': '9', 'url': 'http://b/9', 'contents': 'entry 3' })
+    assert index.seen_url('http://a/3')
+    # Not indexed without contents, so that it's fetched again.
+    assert not index.seen(entry(2, ''))
+    assert not index.seen(entry(4))
+    index.close()
+
+
+def test_rebuilt_from_partitions(tmp_path):
+    partition = tmp_path / '2017-01-01'
+    partition.mkdir()
+    FileStorageBackend({}).write(str(partition), [ entry(1), entry(2) ])
+
+    index = DedupIndex(str(tmp_path))
+    assert index.seen(entry(2))
+    index.close()
+
+    os.remove(str(tmp_path / DedupIndex.INDEX_FILE))
+    index = DedupIndex(str(tmp_path))
+    assert index.seen(entry(1)) and not index.seen(entry(3))
+    index.close()
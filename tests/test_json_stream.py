@@ -0,0 +1,61 @@
+import io
+import json
+
+import pytest
+
+from json_stream import iter_json_array
+
+
+class CountingReader(io.StringIO):
+    '''
+    Counts the characters read from it.
+    '''
+    def __init__(self, text):
+        io.StringIO.__init__(self, text)
+        self.chars_read = 0
+
+    def read(self, size=-1):
+        data = io.StringIO.read(self, size)
+        self.chars_read += len(data)
+        return data
+
+
+ELEMENTS = [ 1, -2.5e3, True, False, None, 'café "quoted" \\', { 'a': [ 1, { 'b': 'c' } ] }, [], {}, 12345678901234567890 ]
+
+
+@pytest.mark.parametrize('chunk_size', [ 1, 2, 3, 7, 64 * 1024 ])
+def test_elements_across_chunk_boundaries(chunk_size):
+    text = json.dumps(ELEMENTS, ensure_ascii=True, indent=1)
+    assert list(iter_json_array(io.StringIO(text), chunk_size)) == ELEMENTS
+
+
+def test_empty_array():
+    assert list(iter_json_array(io.StringIO(' [ ] '))) == []
+
+
+@pytest.mark.parametrize('text', [ '[{"a": 1}, {"a": 2', '[{"a": 1}, "abc', '[1, tru', '[{"a": 1}', '[1,' ])
+def test_truncated_input(text):
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO(text), chunk_size=4))
+
+
+def test_malformed_element_raises_without_reading_the_rest():
+    elements = [ { 'id': i, 'text': 'x' * 100 } for i in range(1000) ]
+    text = '[{"id": 0, "text": oops}, ' + json.dumps(elements)[1:]
+    json_file = CountingReader(text)
+
+    with pytest.raises(ValueError):
+        list(iter_json_array(json_file, chunk_size=256))
+    assert json_file.chars_read <= 512
+
+
+def test_large_element_read_in_growing_chunks():
+    element = { 'text': 'y' * 1000000 }
+    json_file = CountingReader(json.dumps([ element, 1 ]))
+    reads = []
+    read = json_file.read
+    json_file.read = lambda size=-1: reads.append(size) or read(size)
+
+    assert list(iter_json_array(json_file, chunk_size=1024)) == [ element, 1 ]
+    # About log2(1000000 / 1024) reads, rather than 1000000 / 1024.
+    assert len(reads) < 20
@@ -0,0 +1,52 @@
+import numpy as np
+
+import local_lda
+import text_pipeline
+import vocabulary
+from target_store import TargetStore
+
+ENTRIES = [
+    { 'id': '1', 'url': 'http://a/1', 'contents': 'Apples and oranges, apples and pears' },
+    { 'id': '2', 'url': 'http://a/2', 'contents': 'Pears  pears\xa0pears and pears plums' },
+    { 'id': '3', 'url': 'http://a/3', 'contents': 'Plums of the orchard, plums' },
+]
+
+
+def store(target_dir, vocabulary_file=None):
+    target_store = TargetStore({ 'TARGET_DIR': target_dir, 'VOCABULARY_FILE': vocabulary_file })
+    target_store.store_content('feed', [ dict(e) for e in ENTRIES ], target_store.prepare_to_store('feed'))
+    target_store.close()
+
+
+def test_stored_counts_same_as_tokenized(tmp_path):
+    vocabulary_file = str(tmp_path / 'vocabulary.txt')
+    store(str(tmp_path / 'stored'), vocabulary_file)
+    store(str(tmp_path / 'tokenized'))
+    stop_words = text_pipeline.load_stop_words(None)
+
+    term_ids = local_lda.TermIds(vocabulary.load_terms(vocabulary_file))
+    _, stored = local_lda.load_documents(str(tmp_path / 'stored'), stop_words, term_ids)
+    # Every term is in the shared vocabulary, so nothing was tokenized.
+    assert len(term_ids.terms) == term_ids.num_stored
+
+    tokenized_ids = local_lda.TermIds()
+    _, tokenized = local_lda.load_documents(str(tmp_path / 'tokenized'), stop_words, tokenized_ids)
+
+    stored_vocabulary = local_lda.fit_vocabulary(stored, term_ids.terms, vocab_size=3)
+    tokenized_vocabulary = local_lda.fit_vocabulary(tokenized, tokenized_ids.terms, vocab_size=3)
+    assert stored_vocabulary == tokenized_vocabulary == [ 'pears', 'plums', 'apples' ]
+
+    for min_tf in (1.0, 2.0, 0.3):
+        stored_counts = local_lda.count_matrix(stored, term_ids, stored_vocabulary, min_tf)
+        tokenized_counts = local_lda.count_matrix(tokenized, tokenized_ids, tokenized_vocabulary, min_tf)
+        assert np.array_equal(stored_counts.toarray(), tokenized_counts.toarray())
+
+
+def test_count_matrix_min_tf():
+    term_ids = local_lda.TermIds()
+    rows = [ term_ids.counts(terms) for terms in (['a', 'a', 'b'], ['b', 'c', 'c', 'c']) ]
+    counts = local_lda.sp.csr_matrix([ [ row.get(i, 0) for i in range(3) ] for row in rows ], dtype=np.float64)
+
+    assert local_lda.count_matrix(counts, term_ids, [ 'a', 'b', 'c' ], 2.0).toarray().tolist() == [ [2, 0, 0], [0, 0, 3] ]
+    # A fraction of each document's terms: above 1/3 and 1/4 of them.
+    assert local_lda.count_matrix(counts, term_ids, [ 'c', 'a' ], 0.5).toarray().tolist() == [ [0, 2], [3, 0] ]
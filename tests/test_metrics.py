@@ -0,0 +1,47 @@
+import json
+import os.path
+
+from metrics import Metrics
+from target_store import TargetStore
+
+
+def counter(metrics, name, **labels):
+    return metrics.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+
+def test_store_entries_counted_after_deduplication(tmp_path):
+    store = TargetStore({ 'TARGET_DIR': str(tmp_path), 'STORAGE_BACKEND': 'segments' })
+    metrics = Metrics('fetch')
+    metrics.instrument_store(store, 'target')
+    store_path = store.prepare_to_store('feed')
+
+    entries = [ { 'id': str(i), 'url': 'http://a/%d' % (i), 'contents': 'entry %d' % (i) } for i in range(3) ]
+    store.store_content('feed', entries, store_path)
+    # Two already stored.
+    store.store_content('feed', entries[1:] + [ { 'id': '3', 'url': 'http://a/3', 'contents': 'entry 3' } ], store_path)
+    store.close()
+
+    assert counter(metrics, 'store_writes_total', store='target') == 2
+    assert counter(metrics, 'store_entries_total', store='target') == 4
+    with open(os.path.join(store_path, 'segment-00000.json'), 'rb') as f:
+        assert counter(metrics, 'store_bytes_total', store='target') == len(f.read())
+
+
+def test_export(tmp_path):
+    metrics = Metrics('fetch')
+    metrics.inc('store_entries_total', { 'store': 'tar"get' }, 3)
+    metrics.observe('store_write_seconds', { 'store': 'target' }, 0.25)
+    metrics.finish()
+    metrics.export(str(tmp_path))
+
+    with open(str(tmp_path / 'fetch.json')) as f:
+        summary = json.load(f)
+    assert summary['counters'] == [ { 'name': 'store_entries_total', 'labels': { 'store': 'tar"get' }, 'value': 3 } ]
+    assert summary['histograms'][0]['count'] == 1
+
+    with open(str(tmp_path / 'fetch.prom')) as f:
+        lines = f.read().splitlines()
+    assert '# TYPE recommender_store_entries_total counter' in lines
+    assert 'recommender_store_entries_total{command="fetch",store="tar\\"get"} 3' in lines
+    assert 'recommender_store_write_seconds_count{command="fetch",store="target"} 1' in lines
+    assert sorted(p.name for p in tmp_path.iterdir()) == [ 'fetch.json', 'fetch.prom' ]
@@ -0,0 +1,56 @@
+import pytest
+
+from near_dup import NearDupIndex
+from storage_backends import FileStorageBackend
+
+TEXT = ' '.join('word%d' % (i) for i in range(200))
+
+
+def entry(i, contents):
+    return { 'id': str(i), 'url': 'http://a/%d' % (i), 'contents': contents }
+
+
+def test_band_rows():
+    rows = NearDupIndex.band_rows(128, 0.8)
+    assert 128 % rows == 0
+    assert (1.0 / (128 // rows)) ** (1.0 / rows) <= 0.8
+
+
+def test_near_duplicates_dropped(tmp_path):
+    index = NearDupIndex(str(tmp_path), threshold=0.8, action='drop')
+    to_store, representatives = index.check([ entry(1, TEXT), entry(2, TEXT + ' extra'), entry(3, 'something else entirely') ])
+    assert [ e['id'] for e in to_store ] == [ '1', '3' ]
+    index.add('2017-01-01', representatives)
+
+    # Near-duplicate of an indexed entry, in a later batch.
+    to_store, _ = index.check([ entry(4, 'prefix ' + TEXT) ])
+    assert to_store == []
+    index.close()
+
+
+def test_near_duplicates_flagged(tmp_path):
+    index = NearDupIndex(str(tmp_path), action='flag')
+    to_store, representatives = index.check([ entry(1, TEXT), entry(2, TEXT + ' extra'), entry(3, '') ])
+    assert [ (e['id'], e.get('near_duplicate_of', None)) for e in to_store ] == [ ('1', None), ('2', '1'), ('3', None) ]
+    assert [ e['id'] for e, _, _ in representatives ] == [ '1' ]
+    index.close()
+
+
+def test_rebuilt_from_stored_representatives(tmp_path):
+    partition = tmp_path / '2017-01-01'
+    partition.mkdir()
+    flagged = dict(entry(2, 'other ' * 50), near_duplicate_of='9')
+    FileStorageBackend({}).write(str(partition), [ entry(1, TEXT), flagged ])
+
+    index = NearDupIndex(str(tmp_path))
+    to_store, _ = index.check([ entry(3, TEXT + ' extra'), entry(4, 'other ' * 50) ])
+    # Entries stored as near-duplicates aren't representatives.
+    assert [ e['id'] for e in to_store ] == [ '4' ]
+    index.close()
+
+
+def test_invalid_settings(tmp_path):
+    with pytest.raises(RuntimeError):
+        NearDupIndex(str(tmp_path), threshold=0)
+    with pytest.raises(RuntimeError):
+        NearDupIndex(str(tmp_path), action='delete')
@@ -0,0 +1,24 @@
+import socket
+import ssl
+
+import pytest
+
+from request_scheduler import RetryableError, classify_error
+
+
+@pytest.mark.parametrize('error', [
+    ConnectionResetError(), TimeoutError(), socket.timeout(), socket.gaierror(), RetryableError('busy') ])
+def test_retryable(error):
+    assert classify_error(error)[0]
+
+
+@pytest.mark.parametrize('error', [
+    ssl.SSLCertVerificationError(), FileNotFoundError(), PermissionError(), OSError(), ValueError() ])
+def test_not_retryable(error):
+    assert classify_error(error) == (False, None)
+
+
+def test_requests_errors():
+    requests = pytest.importorskip('requests')
+    assert classify_error(requests.ConnectionError())[0]
+    assert not classify_error(requests.exceptions.SSLError())[0]
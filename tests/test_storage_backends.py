@@ -0,0 +1,56 @@
+import json
+import os.path
+
+from storage_backends import FileStorageBackend, SegmentStorageBackend, iter_partition_entries
+
+
+def entries(ids):
+    return [ { 'id': str(i), 'url': 'http://a/%d' % (i), 'contents': 'entry %d' % (i) } for i in ids ]
+
+
+def test_partial_last_line_skipped_by_readers(tmp_path):
+    SegmentStorageBackend({}).write(str(tmp_path), entries(range(3)))
+    with open(str(tmp_path / 'segment-00000.json'), 'a') as f:
+        f.write('{"id": "3", "cont')
+
+    assert [ e['id'] for e in iter_partition_entries(str(tmp_path)) ] == [ '0', '1', '2' ]
+
+
+def test_uncommitted_data_truncated_on_reopen(tmp_path):
+    segment_filename = str(tmp_path / 'segment-00000.json')
+    index_filename = str(tmp_path / SegmentStorageBackend.INDEX_FILE)
+
+    SegmentStorageBackend({}).write(str(tmp_path), entries(range(3)))
+    committed_size = os.path.getsize(segment_filename)
+    committed_index_size = os.path.getsize(index_filename)
+
+    # A crash while a batch was written: one whole line and one partial line of data,
+    # and a partial index line.
+    with open(segment_filename, 'a') as f:
+        f.write(json.dumps(entries([3])[0]) + '\n' + '{"id": "4", "cont')
+    with open(index_filename, 'a') as f:
+        f.write('["3", "segment-00000.json", ')
+
+    backend = SegmentStorageBackend({})
+    assert backend.contains(str(tmp_path), { 'id': '2' })
+    assert not backend.contains(str(tmp_path), { 'id': '3' })
+    assert os.path.getsize(segment_filename) == committed_size
+    assert os.path.getsize(index_filename) == committed_index_size
+
+    # Written again after the crash. 2 was committed, so it's not written twice.
+    num_entries, _ = backend.write(str(tmp_path), entries(range(2, 5)))
+    assert num_entries == 2
+    assert backend.read(str(tmp_path), '4') == entries([4])[0]
+    assert [ e['id'] for e in iter_partition_entries(str(tmp_path)) ] == [ '0', '1', '2', '3', '4' ]
+
+
+def test_entries_saved_by_files_backend_not_written_again(tmp_path):
+    FileStorageBackend({}).write(str(tmp_path), entries(range(2)))
+
+    backend = SegmentStorageBackend({})
+    assert backend.contains(str(tmp_path), { 'id': '1' })
+    assert backend.read(str(tmp_path), '1') == entries([1])[0]
+
+    num_entries, _ = backend.write(str(tmp_path), entries(range(3)))
+    assert num_entries == 1
+    assert sorted(e['id'] for e in iter_partition_entries(str(tmp_path))) == [ '0', '1', '2' ]
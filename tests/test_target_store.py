@@ -0,0 +1,20 @@
+import os.path
+
+import pytest
+
+from target_store import TargetStore
+
+
+def test_closed_store_rejects_writes(tmp_path):
+    store = TargetStore({ 'TARGET_DIR': str(tmp_path), 'DEDUP_INDEX': True })
+    store_path = store.prepare_to_store('feed')
+    store.store_content('feed', [ { 'id': '1', 'url': 'http://a/1', 'contents': 'one' } ], store_path)
+    store.close()
+
+    # Like the fetcher thread of a target that timed out, after fetch returned.
+    with pytest.raises(RuntimeError):
+        store.store_content('feed', [ { 'id': '2', 'url': 'http://a/2', 'contents': 'two' } ], store_path)
+    with pytest.raises(RuntimeError):
+        store.already_stored('feed', { 'id': '2', 'url': 'http://a/2' }, store_path)
+
+    assert sorted(p.name for p in os.scandir(store_path)) == [ '1.json' ]
@@ -0,0 +1,18 @@
+import text_pipeline
+
+
+def test_tokenize_splits_on_ascii_whitespace_only():
+    # Spark: "a\xa0b  c".toLowerCase.split("\\s") == ["a\xa0b", "", "c"]
+    assert text_pipeline.tokenize('A\xa0b  c') == ['a\xa0b', 'c']
+    assert text_pipeline.tokenize('a\tb\nc\x0bd\fe\rf') == ['a', 'b', 'c', 'd', 'e', 'f']
+    assert text_pipeline.tokenize('a\u2003b') == ['a\u2003b']
+
+
+def test_tokenize_drops_empty_tokens():
+    assert text_pipeline.tokenize('  a   b  ') == ['a', 'b']
+    assert text_pipeline.tokenize('') == []
+
+
+def test_terms_removes_stop_words():
+    stop_words = text_pipeline.load_stop_words(None)
+    assert text_pipeline.terms('The cat  sat on\xa0the mat', stop_words) == ['cat', 'sat', 'on\xa0the', 'mat']
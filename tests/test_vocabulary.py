@@ -0,0 +1,31 @@
+from vocabulary import TermCounter, Vocabulary, load_terms
+
+
+def test_ids_shared_through_the_file(tmp_path):
+    filename = str(tmp_path / 'vocabulary.txt')
+    # Like two processes storing entries at the same time.
+    first = Vocabulary(filename)
+    second = Vocabulary(filename)
+
+    assert first.ids([ 'b', 'a' ]) == { 'a': 0, 'b': 1 }
+    # second reads what first appended before adding its own terms.
+    assert second.ids([ 'c', 'a' ]) == { 'a': 0, 'c': 2 }
+    assert first.ids([ 'c', 'd' ]) == { 'c': 2, 'd': 3 }
+    assert load_terms(filename) == [ 'a', 'b', 'c', 'd' ]
+
+
+def test_partly_written_term_ignored(tmp_path):
+    filename = str(tmp_path / 'vocabulary.txt')
+    with open(filename, 'wb') as f:
+        f.write('a\nb\ncaf'.encode('utf-8'))
+
+    assert load_terms(filename) == [ 'a', 'b' ]
+
+
+def test_term_counts(tmp_path):
+    counter = TermCounter(str(tmp_path / 'vocabulary.txt'), custom_stop_words_file=None)
+    entries = [ { 'contents': 'Apples and apples' }, { 'contents': None } ]
+    counter.add_term_counts(entries)
+
+    assert entries[0]['term_ids'] == [ 0 ] and entries[0]['term_counts'] == [ 2 ]
+    assert entries[1]['term_ids'] == [] and entries[1]['term_counts'] == []